@@ -4,10 +4,8 @@ import json
 import logging
 from aiohttp import web
 import aiohttp_jinja2
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib import colors
+from database import get_pool
+from compression import enable_stream_compression
 
 logger = logging.getLogger(__name__)
 
@@ -198,7 +196,7 @@ async def accounting(request):
 
 @accounting_routes.get('/admin/accounting/export/excel')
 async def export_accounting_excel(request):
-    db_pool = request.app['db_pool']
+    db_pool = get_pool(request.app, 'export')
     
     # Получаем параметры
     start_date = request.query.get('start_date')
@@ -255,6 +253,7 @@ async def export_accounting_excel(request):
                 response.headers['Content-Type'] = 'text/csv'
                 response.headers['Content-Disposition'] = f'attachment; filename="sales_report_{start_date}_{end_date}.csv"'
                 
+                enable_stream_compression(request, response)
                 await response.prepare(request)
                 await response.write(output.getvalue().encode('utf-8'))
                 await response.write_eof()
@@ -308,6 +307,7 @@ async def export_accounting_excel(request):
                 response.headers['Content-Type'] = 'text/csv'
                 response.headers['Content-Disposition'] = f'attachment; filename="refunds_report_{start_date}_{end_date}.csv"'
                 
+                enable_stream_compression(request, response)
                 await response.prepare(request)
                 await response.write(output.getvalue().encode('utf-8'))
                 await response.write_eof()
@@ -361,6 +361,7 @@ async def export_accounting_excel(request):
                 response.headers['Content-Type'] = 'text/csv'
                 response.headers['Content-Disposition'] = f'attachment; filename="transactions_report_{start_date}_{end_date}.csv"'
                 
+                enable_stream_compression(request, response)
                 await response.prepare(request)
                 await response.write(output.getvalue().encode('utf-8'))
                 await response.write_eof()
@@ -373,7 +374,7 @@ async def export_accounting_excel(request):
 
 @accounting_routes.get('/admin/accounting/export/pdf')
 async def export_accounting_pdf(request):
-    db_pool = request.app['db_pool']
+    db_pool = get_pool(request.app, 'export')
     
     # Получаем параметры
     start_date = request.query.get('start_date')
@@ -406,6 +407,13 @@ async def export_accounting_pdf(request):
                 
                 records = await conn.fetch(query, *params)
                 
+                # reportlab нужен только для PDF-экспорта, а его импорт занимает ~90 мс -
+                # загружаем при первом экспорте, а не при холодном старте сервиса
+                from reportlab.lib.pagesizes import letter
+                from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
+                from reportlab.lib.styles import getSampleStyleSheet
+                from reportlab.lib import colors
+                
                 # Создаем PDF в памяти
                 buffer = io.BytesIO()
                 doc = SimpleDocTemplate(buffer, pagesize=letter)
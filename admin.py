@@ -2,7 +2,6 @@ import os
 import logging
 from aiohttp import web
 import aiohttp_jinja2
-import jinja2
 import jwt
 from datetime import datetime, timedelta, timezone
 import asyncpg
@@ -14,10 +13,9 @@ import csv
 import io
 import time
 import json
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib import colors
+import server
+from static_assets import STATIC_PREFIX, setup_static
+from templating import setup_templates
 
 # Импорты для работы с кошельком и API
 try:
@@ -70,6 +68,10 @@ async def auth_middleware(request, handler):
     if request.path.startswith('/admin/login') or request.path == '/admin':
         return await handler(request)
     
+    # Статические ресурсы не требуют проверки JWT
+    if request.path.startswith(STATIC_PREFIX):
+        return await handler(request)
+    
     token = request.cookies.get('auth_token')
     if not token:
         return web.HTTPFound('/admin/login')
@@ -1717,6 +1719,13 @@ async def export_accounting_pdf(request):
                 
                 records = await conn.fetch(query, *params)
                 
+                # reportlab нужен только для PDF-экспорта, а его импорт занимает ~90 мс -
+                # загружаем при первом экспорте, а не при холодном старте сервиса
+                from reportlab.lib.pagesizes import letter
+                from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
+                from reportlab.lib.styles import getSampleStyleSheet
+                from reportlab.lib import colors
+                
                 # Создаем PDF в памяти
                 buffer = io.BytesIO()
                 doc = SimpleDocTemplate(buffer, pagesize=letter)
@@ -1779,10 +1788,11 @@ async def export_accounting_pdf(request):
         return web.Response(text=f"Ошибка экспорта: {e}", status=500)
 
 def create_admin_app():
-    app = web.Application(middlewares=[auth_middleware])
+    app = web.Application(middlewares=[auth_middleware], **server.application_kwargs())
     
     # Настройка шаблонизатора
-    aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader('templates'))
+    setup_templates(app)
+    setup_static(app)
     
     app.add_routes(routes)
     app.on_startup.append(init_db)
@@ -1797,10 +1807,10 @@ async def main():
         return
     
     app = create_admin_app()
-    runner = web.AppRunner(app)
+    runner = web.AppRunner(app, **server.runner_kwargs())
     await runner.setup()
     
-    site = web.TCPSite(runner, '0.0.0.0', PORT)
+    site = web.TCPSite(runner, '0.0.0.0', PORT, **server.site_kwargs())
     await site.start()
     
     logger.info(f"Admin panel started on port {PORT}")
@@ -1809,4 +1819,4 @@ async def main():
     await asyncio.Event().wait()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    server.run(main())
@@ -0,0 +1,254 @@
+import json
+import inspect
+import logging
+from decimal import Decimal
+from datetime import date, datetime
+from aiohttp import web
+import asyncpg
+import statements
+from auth import API_PREFIX
+from cursors import encode_cursor, decode_cursor
+from users import dashboard, USER_COLUMNS
+from accounting import accounting
+from payment_system import payment_system
+from cohorts import cohorts
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+# Время в таблицах бота бывает NULL, а сравнение строк с NULL не дает ни true, ни false -
+# такие строки выпадали бы из страниц после первой. Поэтому в сортировке и курсоре время
+# заменяется на epoch (как в users.USER_SORTS и его индексах), а в ответе остается как есть
+EPOCH = datetime(1970, 1, 1)
+
+def _time_sort(column):
+    return f"COALESCE({column}, 'epoch'::timestamp)"
+
+# Списки с курсорной пагинацией: имя ресурса -> таблица, FROM, допустимые поля
+# (имя в API -> выражение SQL), ключ сортировки (поля, по убыванию) и выражения
+# сортировки для полей ключа, допускающих NULL.
+# Последнее поле ключа уникально, поэтому курсор однозначно задает позицию
+API_RESOURCES = {
+    'orders': {
+        'table': 'purchases',
+        'from': 'purchases p LEFT JOIN users u ON p.user_id = u.user_id',
+        'fields': {
+            'id': 'p.id',
+            'user_id': 'p.user_id',
+            'product': 'p.product',
+            'price': 'p.price',
+            'status': 'p.status',
+            'purchase_time': 'p.purchase_time',
+            'username': 'u.username',
+            'first_name': 'u.first_name'
+        },
+        'key': (('purchase_time', datetime.fromisoformat), ('id', int)),
+        'sort': {'purchase_time': _time_sort('p.purchase_time')}
+    },
+    'transactions': {
+        'table': 'transactions',
+        'from': 'transactions t LEFT JOIN users u ON t.user_id = u.user_id',
+        'fields': {
+            'id': 't.id',
+            'user_id': 't.user_id',
+            'amount': 't.amount',
+            'currency': 't.currency',
+            'status': 't.status',
+            'invoice_uuid': 't.invoice_uuid',
+            'created_at': 't.created_at',
+            'username': 'u.username',
+            'first_name': 'u.first_name'
+        },
+        'key': (('created_at', datetime.fromisoformat), ('id', int)),
+        'sort': {'created_at': _time_sort('t.created_at')}
+    },
+    'users': {
+        'table': 'users',
+        'from': 'users',
+        'fields': {name: name for name in USER_COLUMNS},
+        'key': (('created_at', datetime.fromisoformat), ('user_id', int)),
+        'sort': {'created_at': _time_sort('created_at')}
+    },
+    'products': {
+        'table': 'products',
+        'from': '''products p
+            LEFT JOIN cities c ON p.city_id = c.id
+            LEFT JOIN categories cat ON p.category_id = cat.id
+            LEFT JOIN subcategories s ON p.subcategory_id = s.id
+            LEFT JOIN districts d ON p.district_id = d.id
+            LEFT JOIN delivery_types dt ON p.delivery_type_id = dt.id''',
+        'fields': {
+            'id': 'p.id',
+            'uuid': 'p.uuid',
+            'name': 'p.name',
+            'description': 'p.description',
+            'price': 'p.price',
+            'image_url': 'p.image_url',
+            'city_id': 'p.city_id',
+            'city_name': 'c.name',
+            'category_id': 'p.category_id',
+            'category_name': 'cat.name',
+            'subcategory_id': 'p.subcategory_id',
+            'subcategory_name': 's.name',
+            'subcategory_quantity': 's.quantity',
+            'district_id': 'p.district_id',
+            'district_name': 'd.name',
+            'delivery_type_id': 'p.delivery_type_id',
+            'delivery_type_name': 'dt.name'
+        },
+        'key': (('id', int),)
+    }
+}
+
+# Сводные страницы: контекст берется из обработчика HTML-страницы без
+# шаблона и проверки ETag, так что запросы к БД не дублируются
+API_PAGES = {
+    'dashboard': inspect.unwrap(dashboard),
+    'accounting': inspect.unwrap(accounting),
+    'payment-system': inspect.unwrap(payment_system),
+    'cohorts': inspect.unwrap(cohorts)
+}
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def _default_rows(obj):
+    # Строки списков отдаются массивами в порядке "fields" - без промежуточных словарей
+    if isinstance(obj, asyncpg.Record):
+        return tuple(obj)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def _default_objects(obj):
+    if isinstance(obj, asyncpg.Record):
+        return dict(obj)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def dumps(data, default=_default_objects):
+    """Сериализация ответа API: orjson, если установлен, иначе стандартный json"""
+    if orjson is not None:
+        return orjson.dumps(data, default=default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=default, ensure_ascii=False).encode('utf-8')
+
+def json_response(data, status=200, default=_default_objects):
+    return web.Response(body=dumps(data, default), status=status, content_type='application/json')
+
+def parse_fields(request, resource):
+    """Поля из ?fields=a,b,c; поля ключа сортировки добавляются всегда - по ним строится курсор"""
+    available = resource['fields']
+    fields = request.query.get('fields')
+    if not fields:
+        return list(available)
+
+    selected = []
+    for name in fields.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in available:
+            raise ApiError(f'Неизвестное поле: {name}')
+        if name not in selected:
+            selected.append(name)
+
+    for name, _ in resource['key']:
+        if name not in selected:
+            selected.append(name)
+    return selected
+
+def parse_limit(request):
+    try:
+        limit = int(request.query.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError('Некорректный limit')
+    return max(1, min(limit, MAX_LIMIT))
+
+def build_list_query(resource, fields, with_cursor):
+    """SQL страницы списка; набор полей берется только из белого списка ресурса,
+    повторяющиеся комбинации попадают в кэш подготовленных запросов asyncpg"""
+    columns = ', '.join(f"{resource['fields'][name]} AS {name}" for name in fields)
+    sort = resource.get('sort', {})
+    key = [sort.get(name, resource['fields'][name]) for name, _ in resource['key']]
+    order_by = ', '.join(f"{expression} DESC" for expression in key)
+
+    query = f"SELECT {columns} FROM {resource['from']}"
+    if with_cursor:
+        placeholders = ', '.join(f"${i}" for i in range(2, len(key) + 2))
+        query += f" WHERE ({', '.join(key)}) < ({placeholders})"
+    return query + f" ORDER BY {order_by} LIMIT $1"
+
+def _cursor_value(resource, name, value):
+    # NULL в поле с выражением сортировки сортируется как epoch - так его и запоминаем
+    if value is None and name in resource.get('sort', {}):
+        return EPOCH
+    return value
+
+async def list_page(conn, resource, fields, limit, key_values):
+    """Страница списка и курсор следующей (None - страница последняя)"""
+    # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+    query = build_list_query(resource, fields, bool(key_values))
+    rows = await conn.fetch(query, limit + 1, *key_values)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([_cursor_value(resource, name, last[name]) for name, _ in resource['key']])
+
+api_routes = web.RouteTableDef()
+
+@api_routes.get(API_PREFIX + '/{resource:orders|transactions|users|products}')
+async def api_list(request):
+    resource = API_RESOURCES[request.match_info['resource']]
+
+    try:
+        fields = parse_fields(request, resource)
+        limit = parse_limit(request)
+        cursor = request.query.get('cursor')
+        key_values = decode_cursor(cursor, resource['key']) if cursor else []
+    except ApiError as e:
+        return json_response({'error': e.message}, status=e.status)
+    except ValueError:
+        return json_response({'error': 'Некорректный курсор'}, status=400)
+
+    try:
+        async with request.app['db_pool'].acquire() as conn:
+            table_exists = await statements.fetchval(conn, 'table_exists', resource['table'])
+            if not table_exists:
+                return json_response({
+                    'error': 'Таблица не создана. Запустите сначала основного бота.'
+                }, status=503)
+
+            rows, next_cursor = await list_page(conn, resource, fields, limit, key_values)
+    except Exception as e:
+        logger.error(f"Error in api_list {request.match_info['resource']}: {e}")
+        return json_response({'error': f'Ошибка загрузки данных: {e}'}, status=500)
+
+    return json_response({
+        'fields': fields,
+        'rows': rows,
+        'next_cursor': next_cursor
+    }, default=_default_rows)
+
+@api_routes.get(API_PREFIX + '/{page:dashboard|accounting|payment-system|cohorts}')
+async def api_page(request):
+    context = await API_PAGES[request.match_info['page']](request)
+    if context.get('error'):
+        return json_response(context, status=500)
+    context.pop('error', None)
+    return json_response(context)
@@ -1,13 +1,13 @@
-import os
-import jwt
+import asyncio
 from aiohttp import web
 import aiohttp_jinja2
-from datetime import datetime, timedelta, timezone
+from static_assets import STATIC_PREFIX
+from sessions import SESSION_MAX_AGE, READ_ONLY_METHODS
+from throttle import client_ip, username_delay, record_failure, record_success
 
 # Настройки
-ADMIN_USERNAME = os.getenv('ADMIN_USERNAME', 'admin')
-ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', 'password')
-JWT_SECRET = os.getenv('JWT_SECRET', 'your-secret-key')
+API_PREFIX = '/admin/api/v1'
+SESSION_COOKIE = 'auth_token'
 
 # Middleware для проверки аутентификации
 @web.middleware
@@ -15,18 +15,32 @@ async def auth_middleware(request, handler):
     if request.url.path.startswith('/admin/login') or request.url.path == '/admin':
         return await handler(request)
     
-    token = request.cookies.get('auth_token')
-    if not token:
-        return web.HTTPFound('/admin/login')
+    # Статические ресурсы не требуют проверки сессии
+    if request.url.path.startswith(STATIC_PREFIX):
+        return await handler(request)
+    
+    # JSON API: скрипты передают токен сессии в заголовке и получают 401 вместо редиректа
+    is_api = request.url.path.startswith(API_PREFIX)
+    token = request.cookies.get(SESSION_COOKIE)
+    authorization = request.headers.get('Authorization', '')
+    if is_api and authorization.startswith('Bearer '):
+        token = authorization[len('Bearer '):]
     
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
-        request['user'] = payload
-    except jwt.InvalidTokenError:
+    session = await request.app['session_store'].get(token) if token else None
+    if session is None:
+        if is_api:
+            return web.json_response({'error': 'Требуется авторизация'}, status=401)
         response = web.HTTPFound('/admin/login')
-        response.del_cookie('auth_token')
+        if token:
+            response.del_cookie(SESSION_COOKIE)
         return response
     
+    request['user'] = session
+    
+    # Роль viewer - только просмотр
+    if session['role'] != 'admin' and request.method not in READ_ONLY_METHODS:
+        raise web.HTTPForbidden(text='Недостаточно прав')
+    
     return await handler(request)
 
 # Маршруты аутентификации
@@ -47,21 +61,33 @@ async def login(request):
     data = await request.post()
     username = data.get('username')
     password = data.get('password')
+    ip = client_ip(request)
     
-    if username == ADMIN_USERNAME and password == ADMIN_PASSWORD:
-        token = jwt.encode({
-            'username': username,
-            'exp': datetime.now(timezone.utc) + timedelta(hours=24)
-        }, JWT_SECRET, algorithm='HS256')
-        
+    # Перебор паролей к одной учетной записи: отвечаем все медленнее, но не блокируем
+    if username:
+        delay = await username_delay(request.app, username)
+        if delay:
+            await asyncio.sleep(delay)
+    
+    token = None
+    if username and password:
+        token = await request.app['session_store'].create(username, password, ip)
+    
+    if token:
+        await record_success(request.app, username)
         response = web.HTTPFound('/admin/dashboard')
-        response.set_cookie('auth_token', token, httponly=True, max_age=86400)
+        response.set_cookie(SESSION_COOKIE, token, httponly=True, max_age=SESSION_MAX_AGE)
         return response
     else:
+        await record_failure(request.app, ip, username)
         return web.HTTPFound('/admin/login?error=1')
 
 @auth_routes.get('/admin/logout')
 async def logout(request):
+    token = request.cookies.get(SESSION_COOKIE)
+    if token:
+        await request.app['session_store'].revoke(token=token)
+    
     response = web.HTTPFound('/admin/login')
-    response.del_cookie('auth_token')
+    response.del_cookie(SESSION_COOKIE)
     return response
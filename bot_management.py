@@ -1,5 +1,6 @@
 from aiohttp import web
 import aiohttp_jinja2
+from reference_data import get_reference, invalidate
 
 bot_management_routes = web.RouteTableDef()
 
@@ -33,14 +34,9 @@ async def bot_management(request):
             # Загружаем данные для всех разделов
             texts = await conn.fetch('SELECT * FROM texts ORDER BY lang, key')
             languages = await conn.fetch('SELECT DISTINCT lang FROM texts ORDER BY lang')
-            cities = await conn.fetch('SELECT * FROM cities ORDER BY name')
+            cities = await get_reference(request.app, conn, 'cities')
             
-            districts = await conn.fetch('''
-                SELECT d.*, c.name as city_name 
-                FROM districts d 
-                JOIN cities c ON d.city_id = c.id 
-                ORDER BY c.name, d.name
-            ''')
+            districts = await get_reference(request.app, conn, 'districts_with_city')
             
             products = await conn.fetch('''
                 SELECT p.*, c.name as city_name 
@@ -49,7 +45,7 @@ async def bot_management(request):
                 ORDER BY c.name, p.name
             ''')
             
-            delivery_types = await conn.fetch('SELECT * FROM delivery_types ORDER BY name')
+            delivery_types = await get_reference(request.app, conn, 'delivery_types')
             
             # Загружаем настройки бота
             bot_settings_rows = await conn.fetch('SELECT * FROM bot_settings')
@@ -144,6 +140,7 @@ async def update_city(request):
                 'UPDATE cities SET name = $1 WHERE id = $2',
                 data['name'], int(data['id'])
             )
+            await invalidate(request.app, conn, 'cities')
         
         return web.HTTPFound('/admin/bot-management#cities')
     except Exception as e:
@@ -163,6 +160,7 @@ async def add_city(request):
                 'INSERT INTO cities (name) VALUES ($1)',
                 data['name']
             )
+            await invalidate(request.app, conn, 'cities')
         
         return web.HTTPFound('/admin/bot-management#cities')
     except Exception as e:
@@ -179,6 +177,7 @@ async def delete_city(request):
     try:
         async with db_pool.acquire() as conn:
             await conn.execute('DELETE FROM cities WHERE id = $1', city_id)
+            await invalidate(request.app, conn, 'cities', 'districts')
         
         return web.HTTPFound('/admin/bot-management#cities')
     except Exception as e:
@@ -198,6 +197,7 @@ async def update_district(request):
                 'UPDATE districts SET name = $1, city_id = $2 WHERE id = $3',
                 data['name'], int(data['city_id']), int(data['id'])
             )
+            await invalidate(request.app, conn, 'districts')
         
         return web.HTTPFound('/admin/bot-management#districts')
     except Exception as e:
@@ -217,6 +217,7 @@ async def add_district(request):
                 'INSERT INTO districts (name, city_id) VALUES ($1, $2)',
                 data['name'], int(data['city_id'])
             )
+            await invalidate(request.app, conn, 'districts')
         
         return web.HTTPFound('/admin/bot-management#districts')
     except Exception as e:
@@ -233,6 +234,7 @@ async def delete_district(request):
     try:
         async with db_pool.acquire() as conn:
             await conn.execute('DELETE FROM districts WHERE id = $1', district_id)
+            await invalidate(request.app, conn, 'districts')
         
         return web.HTTPFound('/admin/bot-management#districts')
     except Exception as e:
@@ -252,6 +254,7 @@ async def update_product_bot(request):
                 'UPDATE products SET name = $1, price = $2, image_url = $3, city_id = $4 WHERE id = $5',
                 data['name'], float(data['price']), data['image_url'], int(data['city_id']), int(data['id'])
             )
+            await invalidate(request.app, conn, 'products')
         
         return web.HTTPFound('/admin/bot-management#products')
     except Exception as e:
@@ -271,6 +274,7 @@ async def add_product_bot(request):
                 'INSERT INTO products (name, price, image_url, city_id) VALUES ($1, $2, $3, $4)',
                 data['name'], float(data['price']), data['image_url'], int(data['city_id'])
             )
+            await invalidate(request.app, conn, 'products')
         
         return web.HTTPFound('/admin/bot-management#products')
     except Exception as e:
@@ -287,6 +291,7 @@ async def delete_product_bot(request):
     try:
         async with db_pool.acquire() as conn:
             await conn.execute('DELETE FROM products WHERE id = $1', product_id)
+            await invalidate(request.app, conn, 'products')
         
         return web.HTTPFound('/admin/bot-management#products')
     except Exception as e:
@@ -306,6 +311,7 @@ async def update_delivery_type(request):
                 'UPDATE delivery_types SET name = $1 WHERE id = $2',
                 data['name'], int(data['id'])
             )
+            await invalidate(request.app, conn, 'delivery_types')
         
         return web.HTTPFound('/admin/bot-management#delivery')
     except Exception as e:
@@ -325,6 +331,7 @@ async def add_delivery_type(request):
                 'INSERT INTO delivery_types (name) VALUES ($1)',
                 data['name']
             )
+            await invalidate(request.app, conn, 'delivery_types')
         
         return web.HTTPFound('/admin/bot-management#delivery')
     except Exception as e:
@@ -341,6 +348,7 @@ async def delete_delivery_type(request):
     try:
         async with db_pool.acquire() as conn:
             await conn.execute('DELETE FROM delivery_types WHERE id = $1', type_id)
+            await invalidate(request.app, conn, 'delivery_types')
         
         return web.HTTPFound('/admin/bot-management#delivery')
     except Exception as e:
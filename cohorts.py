@@ -0,0 +1,235 @@
+import os
+import asyncio
+import logging
+from datetime import date, datetime
+from aiohttp import web
+import aiohttp_jinja2
+import statements
+from database import get_pool
+
+logger = logging.getLogger(__name__)
+
+# Как часто дописывать в сводки новые регистрации и покупки
+COHORT_ROLLUP_INTERVAL = int(os.environ.get('COHORT_ROLLUP_INTERVAL', 300))
+# Полный пересчет сводок: учитывает удаленных пользователей и покупки,
+# закоммиченные позже покупок с большим id
+COHORT_REBUILD_INTERVAL = int(os.environ.get('COHORT_REBUILD_INTERVAL', 86400))
+# Регистрации перечитываются с таким запасом по created_at: пользователь,
+# чья транзакция закоммичена позже, не теряется, а повтор отсекает первичный ключ
+COHORT_USERS_OVERLAP = '1 hour'
+COHORT_REPORT_WEEKS = 12
+DASHBOARD_COHORTS = 6
+DASHBOARD_WEEKS = 4
+
+# Когорта - неделя регистрации. Сводки:
+#   cohort_members      - пользователь и его когорта
+#   cohort_buyer_weeks  - недели, в которые пользователь покупал (для подсчета уникальных покупателей)
+#   cohort_sizes        - размер когорты
+#   cohort_activity     - покупатели и выручка когорты на N-й неделе после регистрации
+#   cohort_state        - докуда обработаны покупки и регистрации
+COHORT_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS cohort_members (
+        user_id BIGINT PRIMARY KEY,
+        cohort_week DATE NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS cohort_buyer_weeks (
+        user_id BIGINT NOT NULL,
+        week DATE NOT NULL,
+        PRIMARY KEY (user_id, week)
+    );
+    CREATE TABLE IF NOT EXISTS cohort_sizes (
+        cohort_week DATE PRIMARY KEY,
+        users INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS cohort_activity (
+        cohort_week DATE NOT NULL,
+        week_offset INTEGER NOT NULL,
+        buyers INTEGER NOT NULL,
+        revenue NUMERIC NOT NULL,
+        PRIMARY KEY (cohort_week, week_offset)
+    );
+    CREATE TABLE IF NOT EXISTS cohort_state (
+        id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+        last_purchase_id BIGINT NOT NULL,
+        users_since TIMESTAMP NOT NULL,
+        rebuilt_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP
+    );
+'''
+
+# Новые участники когорт: размер когорты растет только на действительно добавленных
+ADD_MEMBERS = f'''
+    WITH added AS (
+        INSERT INTO cohort_members (user_id, cohort_week)
+        SELECT user_id, date_trunc('week', created_at)::date
+        FROM users
+        WHERE created_at >= $1::timestamp - interval '{COHORT_USERS_OVERLAP}'
+        ON CONFLICT DO NOTHING
+        RETURNING cohort_week
+    )
+    INSERT INTO cohort_sizes (cohort_week, users)
+    SELECT cohort_week, COUNT(*) FROM added GROUP BY cohort_week
+    ON CONFLICT (cohort_week) DO UPDATE SET users = cohort_sizes.users + EXCLUDED.users
+'''
+
+# Покупки с id в ($1, $2]: выручка добавляется целиком, покупатель - только
+# за первую покупку на этой неделе (ее отмечает вставка в cohort_buyer_weeks).
+# Покупки пользователей без когорты (без created_at) не учитываются
+ADD_PURCHASES = '''
+    WITH new_purchases AS (
+        SELECT p.user_id, m.cohort_week, date_trunc('week', p.purchase_time)::date AS week, p.price
+        FROM purchases p
+        JOIN cohort_members m ON m.user_id = p.user_id
+        WHERE p.id > $1 AND p.id <= $2 AND p.purchase_time IS NOT NULL
+    ), new_buyers AS (
+        INSERT INTO cohort_buyer_weeks (user_id, week)
+        SELECT DISTINCT user_id, week FROM new_purchases
+        ON CONFLICT DO NOTHING
+        RETURNING user_id, week
+    ), buyers AS (
+        SELECT m.cohort_week, (b.week - m.cohort_week) / 7 AS week_offset, COUNT(*) AS buyers
+        FROM new_buyers b
+        JOIN cohort_members m ON m.user_id = b.user_id
+        GROUP BY 1, 2
+    ), revenue AS (
+        SELECT cohort_week, (week - cohort_week) / 7 AS week_offset, COALESCE(SUM(price), 0) AS revenue
+        FROM new_purchases
+        GROUP BY 1, 2
+    )
+    INSERT INTO cohort_activity (cohort_week, week_offset, buyers, revenue)
+    SELECT r.cohort_week, r.week_offset, COALESCE(b.buyers, 0), r.revenue
+    FROM revenue r
+    LEFT JOIN buyers b ON b.cohort_week = r.cohort_week AND b.week_offset = r.week_offset
+    ON CONFLICT (cohort_week, week_offset) DO UPDATE SET
+        buyers = cohort_activity.buyers + EXCLUDED.buyers,
+        revenue = cohort_activity.revenue + EXCLUDED.revenue
+'''
+
+async def _roll_up(conn, state):
+    """Дописывает в сводки изменения после state; вызывается внутри транзакции"""
+    now, last_id = await conn.fetchrow(
+        'SELECT LOCALTIMESTAMP, COALESCE(MAX(id), 0) FROM purchases'
+    )
+    await conn.execute(ADD_MEMBERS, state['users_since'])
+    await conn.execute(ADD_PURCHASES, state['last_purchase_id'], last_id)
+    await conn.execute(
+        'UPDATE cohort_state SET last_purchase_id = $1, users_since = $2',
+        last_id, now
+    )
+
+async def update_cohorts(app, rebuild=False):
+    """Инкрементальное (или полное при rebuild) обновление сводок когорт"""
+    async with get_pool(app, 'background').acquire() as conn:
+        for table in ('users', 'purchases'):
+            if not await statements.fetchval(conn, 'table_exists', table):
+                return False
+
+        # Сводки обновляет только один воркер
+        if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext('admin_cohort_rollup'))"):
+            return False
+        try:
+            await conn.execute(COHORT_SCHEMA)
+            async with conn.transaction():
+                state = await conn.fetchrow('''
+                    SELECT last_purchase_id, users_since,
+                           rebuilt_at < LOCALTIMESTAMP - make_interval(secs => $1) AS stale
+                    FROM cohort_state
+                    FOR UPDATE
+                ''', COHORT_REBUILD_INTERVAL)
+                if state is None or state['stale'] or rebuild:
+                    # Пересчет в одной транзакции: отчет видит либо старые сводки, либо новые.
+                    # DELETE, а не TRUNCATE: TRUNCATE держал бы ACCESS EXCLUSIVE до конца пересчета
+                    # и останавливал чтение отчета, а удаленные DELETE строки читатели видят до COMMIT
+                    for table in ('cohort_members', 'cohort_buyer_weeks', 'cohort_sizes', 'cohort_activity', 'cohort_state'):
+                        await conn.execute(f'DELETE FROM {table}')
+                    # datetime.min asyncpg передает как -infinity
+                    state = {'last_purchase_id': 0, 'users_since': datetime.min}
+                    await conn.execute(
+                        'INSERT INTO cohort_state (last_purchase_id, users_since) VALUES ($1, $2)',
+                        state['last_purchase_id'], state['users_since']
+                    )
+                    logger.info("Rebuilding cohort rollups")
+                await _roll_up(conn, state)
+            return True
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext('admin_cohort_rollup'))")
+
+async def periodic_cohort_rollup(app):
+    while True:
+        try:
+            await update_cohorts(app)
+        except Exception as e:
+            logger.error(f"Error updating cohort rollups: {e}")
+        await asyncio.sleep(COHORT_ROLLUP_INTERVAL)
+
+async def cohort_report(conn, weeks=COHORT_REPORT_WEEKS, max_offset=COHORT_REPORT_WEEKS):
+    """Последние когорты: размер, доля покупателей на неделе N и выручка на пользователя (LTV)"""
+    if await conn.fetchval("SELECT to_regclass('cohort_sizes') IS NULL"):
+        return []
+    sizes = await conn.fetch('''
+        SELECT cohort_week, users FROM cohort_sizes
+        ORDER BY cohort_week DESC
+        LIMIT $1
+    ''', weeks)
+    if not sizes:
+        return []
+    activity = await conn.fetch('''
+        SELECT cohort_week, week_offset, buyers, revenue FROM cohort_activity
+        WHERE cohort_week >= $1 AND week_offset <= $2
+        ORDER BY cohort_week, week_offset
+    ''', sizes[-1]['cohort_week'], max_offset)
+    totals = dict(await conn.fetch('''
+        SELECT cohort_week, SUM(revenue) FROM cohort_activity
+        WHERE cohort_week >= $1
+        GROUP BY cohort_week
+    ''', sizes[-1]['cohort_week']))
+
+    by_cohort = {}
+    for row in activity:
+        by_cohort.setdefault(row['cohort_week'], {})[row['week_offset']] = row['buyers']
+    today = date.today()
+    report = []
+    for size in sizes:
+        cohort_week, users = size['cohort_week'], size['users']
+        buyers = by_cohort.get(cohort_week, {})
+        # Недели, которые еще не наступили, не показываем вовсе, а не как 0%
+        weeks_passed = min(max_offset, (today - cohort_week).days // 7)
+        revenue = totals.get(cohort_week, 0)
+        report.append({
+            'cohort_week': cohort_week,
+            'users': users,
+            'retention': [round(100 * buyers.get(offset, 0) / users, 1) for offset in range(weeks_passed + 1)],
+            'revenue': revenue,
+            'ltv': round(revenue / users, 2)
+        })
+    return report
+
+cohorts_routes = web.RouteTableDef()
+
+@cohorts_routes.get('/admin/cohorts')
+@aiohttp_jinja2.template('cohorts.html')
+async def cohorts(request):
+    try:
+        async with request.app['db_pool'].acquire() as conn:
+            report = await cohort_report(conn)
+        return {
+            'cohorts': report,
+            'max_offset': COHORT_REPORT_WEEKS
+        }
+    except Exception as e:
+        logger.error(f"Error in cohorts: {e}")
+        return {
+            'error': f'Ошибка загрузки когорт: {e}',
+            'cohorts': [],
+            'max_offset': COHORT_REPORT_WEEKS
+        }
+
+async def start_cohort_rollup(app):
+    app['cohort_rollup_task'] = asyncio.create_task(periodic_cohort_rollup(app))
+
+async def stop_cohort_rollup(app):
+    app['cohort_rollup_task'].cancel()
+
+def setup_cohorts(app):
+    app.on_startup.append(start_cohort_rollup)
+    app.on_cleanup.append(stop_cohort_rollup)
+    app.add_routes(cohorts_routes)
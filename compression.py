@@ -0,0 +1,178 @@
+import os
+import zlib
+import asyncio
+import logging
+from aiohttp import web
+from aiohttp.web_response import ContentCoding
+
+logger = logging.getLogger(__name__)
+
+# Необязательные кодеки: используются, только если установлены
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Ответы меньше порога не сжимаются: выигрыш меньше накладных расходов
+MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+# Тела больше этого размера сжимаются в пуле потоков, чтобы не блокировать цикл событий
+EXECUTOR_SIZE = 256 * 1024
+
+# Сжимаем только текстовые форматы; PDF, изображения, архивы уже сжаты
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml'
+)
+
+# Статистика по маршрутам: сколько байт было до и после сжатия
+COMPRESSION_STATS = {}
+
+def _compress_gzip(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def _compress_br(data):
+    return brotli.compress(data, quality=5)
+
+def _compress_zstd(data):
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+# Порядок - предпочтение сервера при равных q
+CODECS = [
+    ('zstd', _compress_zstd, zstandard is not None),
+    ('br', _compress_br, brotli is not None),
+    ('gzip', _compress_gzip, True)
+]
+
+def _accepted_encodings(request):
+    accepted = {}
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding.lower()] = q
+    return accepted
+
+def choose_encoding(request, streaming=False):
+    """Выбор кодировки по Accept-Encoding; для потоковых ответов - только gzip"""
+    accepted = _accepted_encodings(request)
+    best = None
+    for name, compress, available in CODECS:
+        if not available or (streaming and name != 'gzip'):
+            continue
+        q = accepted.get(name, accepted.get('*', 0.0))
+        if q > 0 and (best is None or q > best[2]):
+            best = (name, compress, q)
+    return best
+
+def _is_compressible(response):
+    if response.headers.get('Content-Encoding'):
+        return False
+    if response.status < 200 or response.status in (204, 304):
+        return False
+    return response.content_type.startswith(COMPRESSIBLE_TYPES)
+
+def _route_name(request):
+    route = request.match_info.route
+    if route.resource is not None:
+        return route.resource.canonical
+    return request.path
+
+def _record(request, bytes_in, bytes_out):
+    stats = COMPRESSION_STATS.setdefault(_route_name(request), {
+        'responses': 0,
+        'bytes_in': 0,
+        'bytes_out': 0
+    })
+    stats['responses'] += 1
+    stats['bytes_in'] += bytes_in
+    stats['bytes_out'] += bytes_out
+
+async def compress_response(request, response):
+    """on_response_prepare: сжимает готовое тело ответа перед отправкой заголовков"""
+    if request.method == 'HEAD' or not isinstance(response, web.Response):
+        return
+    if not _is_compressible(response):
+        return
+
+    body = response.body
+    if not isinstance(body, (bytes, bytearray)) or len(body) < MIN_SIZE:
+        return
+    encoding = choose_encoding(request)
+    if encoding is None:
+        return
+
+    name, compress, _ = encoding
+    if len(body) > EXECUTOR_SIZE:
+        compressed = await asyncio.get_running_loop().run_in_executor(None, compress, body)
+    else:
+        compressed = compress(body)
+
+    response.body = compressed
+    response.headers['Content-Length'] = str(len(compressed))
+    response.headers['Content-Encoding'] = name
+    response.headers.add('Vary', 'Accept-Encoding')
+    _record(request, len(body), len(compressed))
+
+def enable_stream_compression(request, response):
+    """Включает потоковое gzip-сжатие StreamResponse; вызывать до response.prepare().
+
+    aiohttp сжимает каждый записанный фрагмент по мере отправки,
+    поэтому экспорт не нужно собирать в памяти целиком.
+    """
+    if not _is_compressible(response) or choose_encoding(request, streaming=True) is None:
+        return
+    response.enable_compression(ContentCoding.gzip)
+    response.headers.add('Vary', 'Accept-Encoding')
+    request['compression_streamed'] = True
+    request['compression_bytes_in'] = 0
+
+    # Объем до сжатия считаем на записи: после нее фрагмент уже сжат
+    write = response.write
+
+    async def counting_write(data):
+        request['compression_bytes_in'] += len(data)
+        await write(data)
+
+    response.write = counting_write
+
+@web.middleware
+async def compression_stats_middleware(request, handler):
+    response = await handler(request)
+    if request.get('compression_streamed'):
+        _record(request, request['compression_bytes_in'], response.body_length)
+    return response
+
+compression_routes = web.RouteTableDef()
+
+@compression_routes.get('/admin/metrics/compression')
+async def compression_metrics(request):
+    routes = {}
+    for route, stats in COMPRESSION_STATS.items():
+        routes[route] = dict(stats)
+        if stats['bytes_in']:
+            routes[route]['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+    return web.json_response({
+        'codecs': [name for name, _, available in CODECS if available],
+        'min_size': MIN_SIZE,
+        'routes': routes
+    })
+
+def setup_compression(app):
+    app.on_response_prepare.append(compress_response)
+    app.middlewares.append(compression_stats_middleware)
+    app.add_routes(compression_routes)
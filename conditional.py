@@ -0,0 +1,96 @@
+import os
+import hashlib
+import logging
+import functools
+from datetime import date
+from aiohttp import web
+from aiohttp.helpers import ETag
+import aiohttp_jinja2
+from templating import TEMPLATES_DIR
+
+logger = logging.getLogger(__name__)
+
+# Страницу можно кэшировать в браузере, но перед показом нужно перепроверить ETag
+CACHE_CONTROL = 'private, no-cache'
+ETAGS_ENABLED = os.environ.get('ADMIN_PAGE_ETAGS', '1') != '0'
+
+# Счетчики изменений таблиц из статистики Postgres: меняются и при правках,
+# сделанных ботом, без чтения самих таблиц. Процесс бота сбрасывает статистику
+# не сразу (Postgres 15+ - не реже раза в минуту), поэтому его запись может
+# появиться на странице с такой задержкой: до сброса браузер получает 304.
+# Правки из админки видны сразу - их учитывают версии таблиц (reference_data.invalidate).
+# ADMIN_PAGE_ETAGS=0 отключает 304 совсем
+TABLE_STATS_QUERY = '''
+    SELECT relname, n_tup_ins, n_tup_upd, n_tup_del
+    FROM pg_stat_user_tables
+    WHERE relname = ANY($1::text[])
+    ORDER BY relname
+'''
+
+_template_digests = {}
+
+def _template_digest(template):
+    # Смена шаблона при деплое тоже должна менять ETag
+    digest = _template_digests.get(template)
+    if digest is None:
+        with open(os.path.join(TEMPLATES_DIR, template), 'rb') as f:
+            digest = _template_digests[template] = hashlib.sha1(f.read()).hexdigest()
+    return digest
+
+async def page_etag(request, conn, template, tables, daily=False):
+    """Дешевый токен версии страницы: статистика таблиц + локальные версии + параметры запроса"""
+    stats = await conn.fetch(TABLE_STATS_QUERY, list(tables))
+    versions = request.app.get('table_versions', {})
+
+    parts = [
+        _template_digest(template),
+        request.path_qs,
+        str(request.get('user', {}).get('username')),
+        repr([tuple(row) for row in stats]),
+        repr([versions.get(table, 0) for table in tables])
+    ]
+    if daily:
+        # Счетчики "за сегодня" меняются в полночь без изменения данных
+        parts.append(date.today().isoformat())
+
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()
+
+def _set_cache_headers(response, etag):
+    response.etag = ETag(value=etag, is_weak=True)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    response.headers.add('Vary', 'Cookie')
+
+def conditional_page(template, *tables, daily=False):
+    """Декоратор страницы (вместо aiohttp_jinja2.template): рендерит контекст обработчика
+    в template и отвечает 304 Not Modified без запросов списка и рендеринга Jinja,
+    если ни одна из таблиц не менялась с прошлого показа"""
+    def decorator(handler):
+        async def render(request):
+            context = await handler(request)
+            if isinstance(context, web.StreamResponse):
+                return context, False
+            # Страницу с ошибкой не кэшируем: после восстановления ее нельзя отдавать как 304
+            return aiohttp_jinja2.render_template(template, request, context), not context.get('error')
+
+        @functools.wraps(handler)
+        async def wrapper(request):
+            if not ETAGS_ENABLED:
+                return (await render(request))[0]
+            try:
+                async with request.app['db_pool'].acquire() as conn:
+                    etag = await page_etag(request, conn, template, tables, daily)
+            except Exception as e:
+                logger.error(f"Error computing ETag for {request.path}: {e}")
+                return (await render(request))[0]
+
+            if any(candidate.value == etag for candidate in request.if_none_match or ()):
+                not_modified = web.HTTPNotModified()
+                _set_cache_headers(not_modified, etag)
+                raise not_modified
+
+            response, cacheable = await render(request)
+            if cacheable:
+                _set_cache_headers(response, etag)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,31 @@
+import json
+import base64
+from decimal import Decimal
+from datetime import datetime
+
+# Курсор keyset-пагинации: значения ключа сортировки последней строки страницы,
+# JSON-массив в base64 без выравнивания. Ключ - последовательность пар (имя, разбор значения).
+# Даты и NUMERIC (Decimal) пишутся строкой; обратно их приводит функция разбора ключа
+# (datetime.fromisoformat, Decimal) - строка NUMERIC не теряет точность, как float
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+def encode_cursor(values):
+    raw = json.dumps([_json_value(value) for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, key):
+    """Значения ключа из курсора; ValueError, если курсор поврежден или от другого ключа"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(key):
+            raise ValueError('cursor length mismatch')
+        return [parse(value) for value, (_, parse) in zip(values, key)]
+    except Exception:
+        raise ValueError('invalid cursor')
@@ -1,24 +1,212 @@
 import os
+import time
 import logging
 import ssl
+import asyncio
+import contextvars
 import asyncpg
+from aiohttp import web
+import statements
 
 logger = logging.getLogger(__name__)
 
+# Полосы (lanes) пула соединений: интерактивные страницы, долгие экспорты
+# и фоновые задачи получают отдельные пулы, чтобы экспорт не мог занять
+# все соединения и заблокировать дашборд.
+# Каждое значение можно переопределить переменной окружения
+# DB_POOL_<LANE>_<KEY>, например DB_POOL_EXPORT_MAX_SIZE=4
+POOL_LANES = {
+    'interactive': {
+        'min_size': 1,
+        'max_size': 6,
+        'acquire_timeout': 3.0,
+        'max_lifetime': 1800.0,
+        'max_idle': 300.0,
+        'statement_cache_size': 100
+    },
+    'export': {
+        'min_size': 0,
+        'max_size': 2,
+        'acquire_timeout': 10.0,
+        'max_lifetime': 1800.0,
+        'max_idle': 60.0,
+        'statement_cache_size': 20
+    },
+    'background': {
+        'min_size': 0,
+        'max_size': 2,
+        'acquire_timeout': 5.0,
+        'max_lifetime': 1800.0,
+        'max_idle': 120.0,
+        'statement_cache_size': 20
+    }
+}
+
+DEFAULT_LANE = 'interactive'
+
+# Общий бюджет соединений к Postgres на все процессы админки (см. ADMIN_WORKERS)
+DB_MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS', 40))
+
+# Список полос, у которых в рамках текущего запроса истек таймаут получения соединения
+_acquire_timeouts = contextvars.ContextVar('db_acquire_timeouts', default=None)
+
+class PoolAcquireTimeout(Exception):
+    """Не удалось получить соединение из полосы пула за отведенное время"""
+
+def get_lane_settings(lane):
+    """Настройки полосы с учетом числа воркеров и переменных окружения"""
+    settings = dict(POOL_LANES[lane])
+
+    # Каждый воркер получает свою долю бюджета (минус LISTEN-соединение справочников);
+    # если полосы в сумме не помещаются, уменьшаем их пропорционально
+    workers = int(os.environ.get('ADMIN_WORKERS', 1))
+    budget = max(1, DB_MAX_CONNECTIONS // workers - 1)
+    total = sum(lane_settings['max_size'] for lane_settings in POOL_LANES.values())
+    if total > budget:
+        settings['max_size'] = max(1, settings['max_size'] * budget // total)
+        settings['min_size'] = min(settings['min_size'], settings['max_size'])
+
+    for key, default in settings.items():
+        value = os.environ.get(f'DB_POOL_{lane.upper()}_{key.upper()}')
+        if value is not None:
+            settings[key] = type(default)(value)
+    return settings
+
+class _LaneAcquireContext:
+    def __init__(self, lane):
+        self._lane = lane
+        self._conn = None
+
+    async def __aenter__(self):
+        lane = self._lane
+        lane.waiting += 1
+        try:
+            self._conn = await lane.pool.acquire(timeout=lane.acquire_timeout)
+        except asyncio.TimeoutError:
+            lane.timeouts += 1
+            timed_out = _acquire_timeouts.get()
+            if timed_out is not None:
+                timed_out.append(lane.name)
+            logger.warning(f"Pool lane '{lane.name}' saturated: acquire timed out after {lane.acquire_timeout}s")
+            raise PoolAcquireTimeout(f"Пул '{lane.name}' перегружен, повторите запрос позже")
+        finally:
+            lane.waiting -= 1
+        lane.in_use += 1
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        lane = self._lane
+        lane.in_use -= 1
+        conn = self._conn
+        self._conn = None
+        # Соединения старше max_lifetime закрываются, пул откроет новое при следующем запросе
+        if lane.is_expired(conn):
+            lane.recycled += 1
+            conn.terminate()
+        await lane.pool.release(conn)
+
+class PoolLane:
+    """Обертка над asyncpg-пулом с таймаутом получения соединения и счетчиками загрузки"""
+
+    def __init__(self, name, pool, settings, born):
+        self.name = name
+        self.pool = pool
+        self.acquire_timeout = settings['acquire_timeout']
+        self.max_lifetime = settings['max_lifetime']
+        self.max_size = settings['max_size']
+        self._born = born
+        self.in_use = 0
+        self.waiting = 0
+        self.timeouts = 0
+        self.recycled = 0
+
+    def acquire(self):
+        return _LaneAcquireContext(self)
+
+    def is_expired(self, conn):
+        if not self.max_lifetime or conn.is_closed():
+            return False
+        born = self._born.get(conn.get_server_pid())
+        return born is not None and time.monotonic() - born > self.max_lifetime
+
+    def stats(self):
+        return {
+            'size': self.pool.get_size(),
+            'idle': self.pool.get_idle_size(),
+            'max_size': self.max_size,
+            'in_use': self.in_use,
+            'waiting': self.waiting,
+            'saturation': round(self.in_use / self.max_size, 3) if self.max_size else 0,
+            'acquire_timeout': self.acquire_timeout,
+            'timeouts': self.timeouts,
+            'recycled': self.recycled
+        }
+
+    async def close(self):
+        await self.pool.close()
+
+    def __getattr__(self, name):
+        # fetch/fetchval/execute и прочие методы пула без явного acquire
+        return getattr(self.pool, name)
+
+async def ensure_index(conn, name, definition):
+    """Создает индекс CONCURRENTLY, если его нет или он остался INVALID после прерванной
+    сборки (такой индекс не используется планировщиком, но мешает IF NOT EXISTS).
+    Вызывать под advisory-блокировкой: чужая незаконченная сборка тоже выглядит как INVALID.
+    True - индекс создан"""
+    valid = await conn.fetchval('SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)', name)
+    if valid:
+        return False
+    if valid is False:
+        logger.warning(f"Rebuilding invalid index {name}")
+        await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+    await conn.execute(f'CREATE INDEX CONCURRENTLY {name} ON {definition}')
+    return True
+
+def get_pool(app, lane=DEFAULT_LANE):
+    """Возвращает полосу пула по имени"""
+    return app['db_pools'][lane]
+
+def _ssl_context():
+    # Для Render нам нужно использовать SSL соединение
+    ssl_context = ssl.create_default_context()
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    return ssl_context
+
+async def connect():
+    """Отдельное соединение вне пулов (для LISTEN и других долгоживущих задач)"""
+    return await asyncpg.connect(os.environ.get('DATABASE_URL'), ssl=_ssl_context())
+
+async def _create_lane(name, ssl_context):
+    settings = get_lane_settings(name)
+    born = {}
+
+    async def init_connection(conn):
+        born[conn.get_server_pid()] = time.monotonic()
+        if name == DEFAULT_LANE:
+            await statements.prepare_all(conn)
+
+    pool = await asyncpg.create_pool(
+        os.environ.get('DATABASE_URL'),
+        ssl=ssl_context,
+        min_size=settings['min_size'],
+        max_size=settings['max_size'],
+        max_inactive_connection_lifetime=settings['max_idle'],
+        statement_cache_size=settings['statement_cache_size'],
+        init=init_connection
+    )
+    return PoolLane(name, pool, settings, born)
+
 async def init_db(app):
     try:
-        # Для Render нам нужно использовать SSL соединение
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
+        ssl_context = _ssl_context()
         
-        # Подключаемся к базе данных
-        app['db_pool'] = await asyncpg.create_pool(
-            os.environ.get('DATABASE_URL'),
-            ssl=ssl_context,
-            min_size=1,
-            max_size=10
-        )
+        # Подключаемся к базе данных: отдельный пул на каждую полосу
+        app['db_pools'] = {}
+        for lane in POOL_LANES:
+            app['db_pools'][lane] = await _create_lane(lane, ssl_context)
+        app['db_pool'] = app['db_pools'][DEFAULT_LANE]
         logger.info("Database connection established successfully")
         
         # Инициализируем таблицы
@@ -64,6 +252,35 @@ async def init_db(app):
         raise
 
 async def close_db(app):
-    if 'db_pool' in app:
-        await app['db_pool'].close()
+    if 'db_pools' in app:
+        for lane in app['db_pools'].values():
+            await lane.close()
         logger.info("Database connection closed")
+
+# Middleware: если обработчик не смог получить соединение за таймаут,
+# отвечаем 503 сразу, а не страницей с ошибкой
+@web.middleware
+async def db_pool_middleware(request, handler):
+    timed_out = []
+    token = _acquire_timeouts.set(timed_out)
+    try:
+        response = await handler(request)
+    except PoolAcquireTimeout:
+        response = None
+    finally:
+        _acquire_timeouts.reset(token)
+
+    if timed_out:
+        raise web.HTTPServiceUnavailable(
+            text=f"Сервер перегружен ({', '.join(timed_out)}), повторите запрос позже",
+            headers={'Retry-After': '5'}
+        )
+    return response
+
+database_routes = web.RouteTableDef()
+
+@database_routes.get('/admin/metrics/db-pools')
+async def db_pool_metrics(request):
+    return web.json_response({
+        name: lane.stats() for name, lane in request.app['db_pools'].items()
+    })
@@ -0,0 +1,365 @@
+import os
+import asyncio
+import logging
+from aiohttp import web
+import statements
+from database import get_pool, ensure_index
+from reference_data import invalidate, tracked_transaction
+
+logger = logging.getLogger(__name__)
+
+# Как часто сверять остатки затронутых подкатегорий; 0 - не сверять
+RECONCILE_INTERVAL = int(os.environ.get('INVENTORY_RECONCILE_INTERVAL', 300))
+# Подкатегория с продажами моложе этого откладывается до следующей сверки: бот мог
+# записать продажу, но еще не списать остаток (или наоборот)
+RECONCILE_GRACE = int(os.environ.get('INVENTORY_RECONCILE_GRACE', 60))
+# Пока таблиц бота нет, установка учета повторяется с этим интервалом
+INSTALL_RETRY_INTERVAL = 60
+
+# Остаток подкатегории складывается из:
+#   inventory_baselines  - остаток на момент последней сверки и докуда учтены движения и продажи
+#   inventory_movements  - изменения остатка из админки; пишутся в той же транзакции,
+#                          что и UPDATE subcategories, поэтому журнал и остаток не расходятся
+#   sold_products        - продажи бота
+# Ожидаемый остаток = baseline + движения после него - продажи после него.
+# Подкатегория без baseline (создана после установки) считается от нуля.
+# inventory_state - докуда просмотрены движения и продажи при поиске затронутых подкатегорий,
+# inventory_pending - отложенные из-за свежих продаж.
+#
+# id продажи выдается при вставке, а видна она становится при COMMIT: продажа с меньшим id
+# может зафиксироваться после сверки, которая уже учла большие id. Поэтому граница продаж
+# (sold_id в baseline и inventory_state) сдвигается не до последнего увиденного id, а до
+# отметки из inventory_sold_marks - максимального id на момент прошлой сверки вместе со снимком
+# транзакций. Отметка годится, когда завершились все транзакции, шедшие в момент снимка
+# (xmax снимка <= xmin текущего): после этого продаж с id не больше отмеченного не появится.
+# Продажи выше границы вычитаются из baseline повторно при следующей сверке, поэтому
+# baseline хранит остаток с их учетом "обратно" (остаток + непогашенные продажи)
+INVENTORY_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS inventory_movements (
+        id BIGSERIAL PRIMARY KEY,
+        subcategory_id INTEGER NOT NULL,
+        product_id INTEGER,
+        delta INTEGER NOT NULL,
+        reason TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_inventory_movements_subcategory ON inventory_movements (subcategory_id, id);
+    CREATE TABLE IF NOT EXISTS inventory_baselines (
+        subcategory_id INTEGER PRIMARY KEY,
+        quantity INTEGER NOT NULL,
+        movement_id BIGINT NOT NULL,
+        sold_id BIGINT NOT NULL,
+        reconciled_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS inventory_pending (
+        subcategory_id INTEGER PRIMARY KEY
+    );
+    CREATE TABLE IF NOT EXISTS inventory_state (
+        id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+        movement_id BIGINT NOT NULL,
+        sold_id BIGINT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS inventory_sold_marks (
+        sold_id BIGINT NOT NULL,
+        snapshot pg_snapshot NOT NULL
+    );
+'''
+
+# Текущие остатки принимаются за исходные: прошлые расхождения восстановить не из чего.
+# FOR SHARE дожидается изменений, начатых до появления журнала (adjust_stock без журнала),
+# и читает уже их результат
+OPENING_BASELINES = '''
+    WITH sold AS (SELECT COALESCE(MAX(id), 0) AS id FROM sold_products)
+    INSERT INTO inventory_baselines (subcategory_id, quantity, movement_id, sold_id)
+    SELECT s.id, COALESCE(s.quantity, 0), 0, sold.id FROM subcategories s, sold
+    FOR SHARE OF s
+    ON CONFLICT DO NOTHING
+'''
+
+# Продажи подкатегории после baseline суммируются по этому индексу
+SOLD_INDEX = ('idx_sold_products_subcategory', 'sold_products (subcategory_id, id)')
+
+# Затронутые подкатегории: движения и продажи в ($1, $2] и ($3, $4] плюс отложенные.
+# Собственные исправления сверки повторной проверки не требуют
+TOUCHED = '''
+    SELECT subcategory_id FROM inventory_movements
+    WHERE id > $1 AND id <= $2 AND reason <> 'reconcile'
+    UNION
+    SELECT subcategory_id FROM sold_products
+    WHERE id > $3 AND id <= $4 AND subcategory_id IS NOT NULL
+    UNION
+    SELECT subcategory_id FROM inventory_pending
+'''
+
+# Граница продаж, до которой поздних фиксаций уже не будет (см. INVENTORY_SCHEMA)
+SETTLED_SOLD_ID = '''
+    SELECT MAX(sold_id) FROM inventory_sold_marks
+    WHERE pg_snapshot_xmax(snapshot) <= pg_snapshot_xmin(pg_current_snapshot())
+'''
+
+# Ожидаемый остаток по журналу; строки подкатегорий уже заблокированы сверкой.
+# unsettled - продажи выше новой границы $3: они войдут в следующую сверку еще раз
+EXPECTED = '''
+    SELECT s.id, s.quantity,
+           COALESCE(b.quantity, 0) + COALESCE(m.delta, 0) - COALESCE(sp.sold, 0) AS expected,
+           GREATEST(COALESCE(b.sold_id, 0), $3) AS sold_id,
+           COALESCE(sp.unsettled, 0) AS unsettled,
+           COALESCE(sp.recent, false) AS recent
+    FROM subcategories s
+    LEFT JOIN inventory_baselines b ON b.subcategory_id = s.id
+    LEFT JOIN LATERAL (
+        SELECT SUM(delta) AS delta FROM inventory_movements
+        WHERE subcategory_id = s.id AND id > COALESCE(b.movement_id, 0)
+    ) m ON true
+    LEFT JOIN LATERAL (
+        SELECT SUM(COALESCE(quantity, 1)) AS sold,
+               SUM(COALESCE(quantity, 1)) FILTER (WHERE id > $3) AS unsettled,
+               bool_or(sold_at > LOCALTIMESTAMP - make_interval(secs => $2)) AS recent
+        FROM sold_products
+        WHERE subcategory_id = s.id AND id > COALESCE(b.sold_id, 0)
+    ) sp ON true
+    WHERE s.id = ANY($1::int[])
+    ORDER BY s.id
+'''
+
+SAVE_BASELINES = '''
+    INSERT INTO inventory_baselines (subcategory_id, quantity, movement_id, sold_id)
+    SELECT c.id, c.quantity,
+           (SELECT COALESCE(MAX(id), 0) FROM inventory_movements WHERE subcategory_id = c.id),
+           c.sold_id
+    FROM unnest($1::int[], $2::int[], $3::bigint[]) AS c(id, quantity, sold_id)
+    ON CONFLICT (subcategory_id) DO UPDATE SET
+        quantity = EXCLUDED.quantity,
+        movement_id = EXCLUDED.movement_id,
+        sold_id = EXCLUDED.sold_id,
+        reconciled_at = CURRENT_TIMESTAMP
+'''
+
+async def _lock_subcategories(conn, ids):
+    # Блокируем в порядке id: встречные изменения двух подкатегорий не дают взаимной блокировки
+    return [row['id'] for row in await conn.fetch(
+        'SELECT id FROM subcategories WHERE id = ANY($1::int[]) ORDER BY id FOR UPDATE', list(ids)
+    )]
+
+async def _installed(conn):
+    # Проверяется после блокировки строк подкатегорий: установка ждет их (FOR SHARE)
+    return await conn.fetchval("SELECT to_regclass('inventory_movements') IS NOT NULL")
+
+async def adjust_stock(conn, changes, reason, product_id=None):
+    """Меняет остатки {subcategory_id: delta} и пишет движения; вызывается внутри транзакции"""
+    changes = {int(subcategory_id): int(delta) for subcategory_id, delta in changes.items() if delta}
+    if not changes:
+        return
+    ids = await _lock_subcategories(conn, changes)
+    # Учет еще не установлен (нет таблиц бота при старте или установка не удалась) -
+    # меняем только остаток; исходные baseline при установке возьмут его как есть
+    if not await _installed(conn):
+        await conn.execute('''
+            UPDATE subcategories s SET quantity = COALESCE(s.quantity, 0) + c.delta
+            FROM unnest($1::int[], $2::int[]) AS c(id, delta)
+            WHERE s.id = c.id
+        ''', ids, [changes[subcategory_id] for subcategory_id in ids])
+        return
+    # Дельта, а не прочитанное значение: продажа бота между чтением и записью не теряется
+    await conn.execute('''
+        WITH changed AS (
+            UPDATE subcategories s SET quantity = COALESCE(s.quantity, 0) + c.delta
+            FROM unnest($1::int[], $2::int[]) AS c(id, delta)
+            WHERE s.id = c.id
+            RETURNING s.id, c.delta
+        )
+        INSERT INTO inventory_movements (subcategory_id, product_id, delta, reason)
+        SELECT id, $3, delta, $4 FROM changed
+    ''', ids, [changes[subcategory_id] for subcategory_id in ids], product_id, reason)
+
+async def create_subcategory(conn, category_id, name, quantity):
+    """Новая подкатегория; начальный остаток записывается движением. Внутри транзакции"""
+    subcategory_id = await conn.fetchval(
+        'INSERT INTO subcategories (category_id, name, quantity) VALUES ($1, $2, 0) RETURNING id',
+        category_id, name
+    )
+    await adjust_stock(conn, {subcategory_id: quantity}, 'create_subcategory')
+    return subcategory_id
+
+async def set_quantity(conn, subcategory_id, quantity):
+    """Задает остаток явно (ручной пересчет); в журнал идет разница. Внутри транзакции"""
+    current = await conn.fetchval(
+        'SELECT COALESCE(quantity, 0) FROM subcategories WHERE id = $1 FOR UPDATE', subcategory_id
+    )
+    if current is not None:
+        await adjust_stock(conn, {subcategory_id: quantity - current}, 'set_quantity')
+
+async def move_product(conn, product_id, subcategory_id):
+    """Переносит единицу остатка товара в другую подкатегорию; возвращает прежнюю или None.
+    Внутри транзакции, строка товара остается заблокированной до ее конца"""
+    old_subcategory_id = await conn.fetchval(
+        'SELECT subcategory_id FROM products WHERE id = $1 FOR UPDATE', product_id
+    )
+    if old_subcategory_id is not None and old_subcategory_id != subcategory_id:
+        await adjust_stock(conn, {old_subcategory_id: -1, subcategory_id: 1}, 'move_product', product_id)
+    return old_subcategory_id
+
+async def remove_product(conn, product_id):
+    """Удаляет товар и списывает его единицу остатка; False, если товара уже нет. Внутри транзакции"""
+    subcategory_id = await conn.fetchval(
+        'DELETE FROM products WHERE id = $1 RETURNING subcategory_id', product_id
+    )
+    if subcategory_id is None:
+        return False
+    await adjust_stock(conn, {subcategory_id: -1}, 'remove_product', product_id)
+    return True
+
+async def remove_subcategory(conn, subcategory_id):
+    """Удаляет подкатегорию с ее товарами и состоянием сверки. Внутри транзакции"""
+    await _lock_subcategories(conn, [subcategory_id])
+    await conn.execute('DELETE FROM products WHERE subcategory_id = $1', subcategory_id)
+    await conn.execute('DELETE FROM subcategories WHERE id = $1', subcategory_id)
+    if await _installed(conn):
+        await conn.execute('DELETE FROM inventory_baselines WHERE subcategory_id = $1', subcategory_id)
+        await conn.execute('DELETE FROM inventory_pending WHERE subcategory_id = $1', subcategory_id)
+
+async def install_inventory(app):
+    """Создает таблицы учета остатков и исходные baseline, если их еще нет"""
+    async with get_pool(app, 'background').acquire() as conn:
+        for table in ('subcategories', 'sold_products'):
+            if not await statements.fetchval(conn, 'table_exists', table):
+                return False
+        async with conn.transaction():
+            # Остальные воркеры ждут установки, чтобы не создавать таблицы одновременно
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('admin_inventory_install'))")
+            await conn.execute(INVENTORY_SCHEMA)
+            if await conn.fetchval('SELECT NOT EXISTS (SELECT FROM inventory_state)'):
+                await conn.execute(OPENING_BASELINES)
+                await conn.execute('''
+                    INSERT INTO inventory_state (movement_id, sold_id)
+                    SELECT 0, COALESCE(MAX(id), 0) FROM sold_products
+                ''')
+                logger.info("Installed inventory accounting")
+        return True
+
+async def create_sold_index(app):
+    async with get_pool(app, 'background').acquire() as conn:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext('admin_inventory_index'))"):
+            return
+        try:
+            name, definition = SOLD_INDEX
+            if await ensure_index(conn, name, definition):
+                logger.info(f"Created index {name}")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext('admin_inventory_index'))")
+
+async def _reconcile(app, conn):
+    """Сверяет затронутые подкатегории; вызывается внутри транзакции"""
+    state = await conn.fetchrow('SELECT movement_id, sold_id FROM inventory_state FOR UPDATE')
+    last_movement, last_sold = await conn.fetchrow('''
+        SELECT (SELECT COALESCE(MAX(id), 0) FROM inventory_movements),
+               (SELECT COALESCE(MAX(id), 0) FROM sold_products)
+    ''')
+    settled_sold = max(state['sold_id'], await conn.fetchval(SETTLED_SOLD_ID) or 0)
+    # Продажи выше прошлой границы просматриваются снова, пока граница их не пройдет:
+    # среди них могут появиться поздно зафиксированные
+    touched = [row['subcategory_id'] for row in await conn.fetch(
+        TOUCHED, state['movement_id'], last_movement, state['sold_id'], last_sold
+    )]
+    result = {'checked': 0, 'deferred': [], 'corrected': []}
+    if touched:
+        # Бот ждет эти строки только на время сверки затронутых подкатегорий
+        await _lock_subcategories(conn, touched)
+        rows = await conn.fetch(EXPECTED, touched, RECONCILE_GRACE, settled_sold)
+        checked = [row for row in rows if not row['recent']]
+        result['checked'] = len(checked)
+        result['deferred'] = [row['id'] for row in rows if row['recent']]
+
+        drift = [row for row in checked if row['quantity'] != row['expected']]
+        if drift:
+            await adjust_stock(
+                conn, {row['id']: row['expected'] - (row['quantity'] or 0) for row in drift}, 'reconcile'
+            )
+            result['corrected'] = [{
+                'subcategory_id': row['id'], 'quantity': row['quantity'], 'expected': row['expected']
+            } for row in drift]
+            logger.warning(f"Inventory drift corrected: {result['corrected']}")
+            await invalidate(app, conn, 'subcategories')
+
+        await conn.execute(
+            SAVE_BASELINES,
+            [row['id'] for row in checked], [row['expected'] + row['unsettled'] for row in checked],
+            [row['sold_id'] for row in checked]
+        )
+        # Удаленные подкатегории и сверенные из отложенных уходят, свежие продажи - ждут
+        await conn.execute('DELETE FROM inventory_pending WHERE subcategory_id <> ALL($1::int[])', result['deferred'])
+        await conn.execute('''
+            INSERT INTO inventory_pending (subcategory_id) SELECT unnest($1::int[])
+            ON CONFLICT DO NOTHING
+        ''', result['deferred'])
+    # Движение с меньшим id, закоммиченное позже, сюда не попадет, но войдет
+    # в ожидаемый остаток при следующем касании подкатегории
+    await conn.execute(
+        'UPDATE inventory_state SET movement_id = $1, sold_id = $2', last_movement, settled_sold
+    )
+    await conn.execute('DELETE FROM inventory_sold_marks WHERE sold_id <= $1', settled_sold)
+    await conn.execute(
+        'INSERT INTO inventory_sold_marks (sold_id, snapshot) VALUES ($1, pg_current_snapshot())', last_sold
+    )
+    return result
+
+async def reconcile_inventory(app):
+    """Сверка остатков затронутых с прошлого раза подкатегорий; None, если сверку ведет другой воркер"""
+    async with get_pool(app, 'background').acquire() as conn:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext('admin_inventory_reconcile'))"):
+            return None
+        try:
+            async with tracked_transaction(app, conn):
+                return await _reconcile(app, conn)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext('admin_inventory_reconcile'))")
+
+async def periodic_inventory_reconcile(app):
+    # Установка повторяется, пока не удастся: таблицы бота могут появиться позже админки
+    installed = False
+    while not installed:
+        try:
+            installed = await install_inventory(app)
+        except Exception as e:
+            logger.error(f"Error installing inventory accounting: {e}")
+        if not installed:
+            await asyncio.sleep(INSTALL_RETRY_INTERVAL)
+    if RECONCILE_INTERVAL <= 0:
+        return
+
+    try:
+        await create_sold_index(app)
+    except Exception as e:
+        logger.error(f"Error creating inventory index: {e}")
+
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL)
+        try:
+            await reconcile_inventory(app)
+        except Exception as e:
+            logger.error(f"Error reconciling inventory: {e}")
+
+inventory_routes = web.RouteTableDef()
+
+@inventory_routes.post('/admin/inventory/reconcile')
+async def reconcile_now(request):
+    """Внеочередная сверка остатков затронутых подкатегорий"""
+    try:
+        result = await reconcile_inventory(request.app)
+    except Exception as e:
+        logger.error(f"Error in reconcile_now: {e}")
+        return web.json_response({'error': f'Ошибка сверки: {e}'}, status=500)
+    if result is None:
+        return web.json_response({'error': 'Сверка уже идет'}, status=409)
+    return web.json_response(result)
+
+async def start_inventory(app):
+    app['inventory_task'] = asyncio.create_task(periodic_inventory_reconcile(app))
+
+async def stop_inventory(app):
+    app['inventory_task'].cancel()
+
+def setup_inventory(app):
+    app.on_startup.append(start_inventory)
+    app.on_cleanup.append(stop_inventory)
+    app.add_routes(inventory_routes)
@@ -0,0 +1,278 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+from aiohttp import web
+from database import get_pool
+
+logger = logging.getLogger(__name__)
+
+# Снимок баланса делается, когда у пользователя накопилось столько записей после прошлого снимка:
+# баланс на момент времени = снимок + сумма не более чем стольких дельт
+SNAPSHOT_EVERY = int(os.environ.get('LEDGER_SNAPSHOT_EVERY', 100))
+SNAPSHOT_INTERVAL = int(os.environ.get('LEDGER_SNAPSHOT_INTERVAL', 3600))
+# Пока таблицы users нет (бот еще не создал схему), установка повторяется с этим интервалом
+INSTALL_RETRY_INTERVAL = 60
+STATEMENT_LIMIT = 50
+# Таблицы журнала с историей по user_id - удаляются и архивируются вместе с пользователем
+LEDGER_TABLES = ('balance_ledger', 'balance_snapshots')
+
+# Журнал пишет триггер на users: так в него попадают и изменения баланса,
+# сделанные ботом (пополнения, покупки), а users.balance остается кэшем текущего значения.
+# Причину и автора изменения админка передает через set_config (см. set_balance_context).
+# Таблица users принадлежит боту: ошибка записи в журнал не должна откатывать его UPDATE,
+# поэтому она только логируется (WARNING), а запись журнала пропускается
+LEDGER_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS balance_ledger (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        seq BIGINT NOT NULL,
+        delta NUMERIC NOT NULL,
+        reason TEXT NOT NULL,
+        created_by TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (user_id, seq)
+    );
+    CREATE TABLE IF NOT EXISTS balance_snapshots (
+        user_id BIGINT NOT NULL,
+        seq BIGINT NOT NULL,
+        balance NUMERIC NOT NULL,
+        taken_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, seq)
+    );
+    CREATE TABLE IF NOT EXISTS balance_ledger_installs (
+        installed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE OR REPLACE FUNCTION admin_balance_ledger() RETURNS trigger AS $$
+    DECLARE
+        old_balance NUMERIC := 0;
+    BEGIN
+        IF TG_OP = 'UPDATE' THEN
+            old_balance := COALESCE(OLD.balance, 0);
+        END IF;
+        IF COALESCE(NEW.balance, 0) <> old_balance THEN
+            -- Строка users заблокирована этим UPDATE, поэтому seq пользователя выдается последовательно
+            BEGIN
+                INSERT INTO balance_ledger (user_id, seq, delta, reason, created_by)
+                VALUES (
+                    NEW.user_id,
+                    COALESCE((SELECT MAX(seq) FROM balance_ledger WHERE user_id = NEW.user_id), 0) + 1,
+                    COALESCE(NEW.balance, 0) - old_balance,
+                    COALESCE(NULLIF(current_setting('admin.balance_reason', true), ''), 'bot'),
+                    NULLIF(current_setting('admin.balance_actor', true), '')
+                );
+            EXCEPTION WHEN others THEN
+                RAISE WARNING 'balance ledger entry for user % skipped: %', NEW.user_id, SQLERRM;
+            END;
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+'''
+
+INSTALL_TRIGGER = '''
+    CREATE TRIGGER admin_balance_ledger
+    AFTER INSERT OR UPDATE OF balance ON users
+    FOR EACH ROW EXECUTE FUNCTION admin_balance_ledger()
+'''
+
+# Начальные балансы - снимок с seq 0; делается в одной транзакции с созданием
+# триггера, чтобы ни одно изменение не попало в промежуток между ними.
+# Время установки - граница, раньше которой баланс по журналу неизвестен
+OPENING_SNAPSHOTS = '''
+    INSERT INTO balance_snapshots (user_id, seq, balance)
+    SELECT user_id, 0, COALESCE(balance, 0) FROM users
+    ON CONFLICT DO NOTHING
+'''
+RECORD_INSTALL = 'INSERT INTO balance_ledger_installs DEFAULT VALUES'
+
+# Снимки для пользователей, у которых с прошлого снимка накопилось $2 записей;
+# рассматриваются только пользователи с записями новее $1
+SNAPSHOT_QUERY = '''
+    WITH touched AS (
+        SELECT DISTINCT user_id FROM balance_ledger WHERE id > $1
+    ), last_snapshot AS (
+        SELECT t.user_id, COALESCE(s.seq, 0) AS seq, COALESCE(s.balance, 0) AS balance
+        FROM touched t
+        LEFT JOIN LATERAL (
+            SELECT seq, balance FROM balance_snapshots bs
+            WHERE bs.user_id = t.user_id
+            ORDER BY seq DESC
+            LIMIT 1
+        ) s ON true
+    ), pending AS (
+        SELECT ls.user_id, MAX(l.seq) AS seq, ls.balance + SUM(l.delta) AS balance, COUNT(*) AS entries
+        FROM last_snapshot ls
+        JOIN balance_ledger l ON l.user_id = ls.user_id AND l.seq > ls.seq
+        GROUP BY ls.user_id, ls.balance
+    )
+    INSERT INTO balance_snapshots (user_id, seq, balance)
+    SELECT user_id, seq, balance FROM pending WHERE entries >= $2
+    ON CONFLICT DO NOTHING
+'''
+
+async def set_balance_context(conn, reason, actor=None):
+    """Причина и автор для записей журнала; действует до конца текущей транзакции"""
+    await conn.execute(
+        "SELECT set_config('admin.balance_reason', $1, true), set_config('admin.balance_actor', $2, true)",
+        reason, actor or ''
+    )
+
+async def balance_at(conn, user_id, at):
+    """Баланс на момент времени: ближайший снимок не позже `at` плюс дельты после него.
+    None - если `at` раньше установки журнала и баланс тогда неизвестен"""
+    return await conn.fetchval('''
+        SELECT CASE WHEN $2 >= (SELECT MIN(installed_at) FROM balance_ledger_installs) THEN
+            COALESCE(s.balance, 0) + COALESCE((
+                SELECT SUM(l.delta) FROM balance_ledger l
+                WHERE l.user_id = $1 AND l.seq > COALESCE(s.seq, 0) AND l.created_at <= $2
+            ), 0)
+        END
+        FROM (SELECT 1) AS one
+        LEFT JOIN LATERAL (
+            SELECT seq, balance FROM balance_snapshots
+            WHERE user_id = $1 AND taken_at <= $2
+            ORDER BY seq DESC
+            LIMIT 1
+        ) s ON true
+    ''', user_id, at)
+
+async def balance_through(conn, user_id, seq):
+    """Баланс после записи журнала с номером seq"""
+    return await conn.fetchval('''
+        SELECT COALESCE(s.balance, 0) + COALESCE((
+            SELECT SUM(l.delta) FROM balance_ledger l
+            WHERE l.user_id = $1 AND l.seq > COALESCE(s.seq, 0) AND l.seq <= $2
+        ), 0)
+        FROM (SELECT 1) AS one
+        LEFT JOIN LATERAL (
+            SELECT seq, balance FROM balance_snapshots
+            WHERE user_id = $1 AND seq <= $2
+            ORDER BY seq DESC
+            LIMIT 1
+        ) s ON true
+    ''', user_id, seq)
+
+async def statement(conn, user_id, limit=STATEMENT_LIMIT, before_seq=None):
+    """Выписка: последние записи журнала (новые сверху) с балансом после каждой"""
+    entries = await conn.fetch('''
+        SELECT seq, delta, reason, created_by, created_at
+        FROM balance_ledger
+        WHERE user_id = $1 AND seq < $2
+        ORDER BY seq DESC
+        LIMIT $3
+    ''', user_id, before_seq or 2 ** 62, limit)
+    if not entries:
+        return []
+
+    balance = await balance_through(conn, user_id, entries[-1]['seq'] - 1)
+    result = []
+    for entry in reversed(entries):
+        balance += entry['delta']
+        result.append({**dict(entry), 'balance_after': balance})
+    result.reverse()
+    return result
+
+async def install_ledger(app):
+    """Создает таблицы журнала и триггер на users, если их еще нет"""
+    async with get_pool(app, 'background').acquire() as conn:
+        if not await conn.fetchval("SELECT to_regclass('users') IS NOT NULL"):
+            return False
+
+        # Устанавливает только один воркер
+        if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext('admin_balance_ledger'))"):
+            return False
+        try:
+            installed = await conn.fetchval('''
+                SELECT EXISTS (
+                    SELECT FROM pg_trigger
+                    WHERE tgrelid = 'users'::regclass AND tgname = 'admin_balance_ledger' AND NOT tgisinternal
+                )
+            ''')
+            await conn.execute(LEDGER_SCHEMA)
+            if not installed:
+                async with conn.transaction():
+                    await conn.execute(INSTALL_TRIGGER)
+                    await conn.execute(OPENING_SNAPSHOTS)
+                    await conn.execute(RECORD_INSTALL)
+                logger.info("Installed balance ledger trigger")
+            return True
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext('admin_balance_ledger'))")
+
+async def take_snapshots(app, after_id):
+    """Снимки по пользователям с накопившимися записями; возвращает новую верхнюю отметку id"""
+    async with get_pool(app, 'background').acquire() as conn:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext('admin_balance_snapshots'))"):
+            return after_id
+        try:
+            last_id = await conn.fetchval('SELECT COALESCE(MAX(id), 0) FROM balance_ledger')
+            await conn.execute(SNAPSHOT_QUERY, after_id, SNAPSHOT_EVERY)
+            return last_id
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext('admin_balance_snapshots'))")
+
+async def periodic_ledger_snapshots(app):
+    # Установка повторяется, пока не удастся: users может появиться позже админки
+    installed = False
+    while not installed:
+        try:
+            installed = await install_ledger(app)
+        except Exception as e:
+            logger.error(f"Error installing balance ledger: {e}")
+        if not installed:
+            await asyncio.sleep(INSTALL_RETRY_INTERVAL)
+
+    # Пользователи, не набравшие порог, снова попадут в выборку при следующей записи
+    after_id = 0
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        try:
+            after_id = await take_snapshots(app, after_id)
+        except Exception as e:
+            logger.error(f"Error taking balance snapshots: {e}")
+
+ledger_routes = web.RouteTableDef()
+
+@ledger_routes.get('/admin/users/{user_id}/balance-history')
+async def balance_history(request):
+    """Выписка по балансу пользователя или баланс на момент ?at=ГГГГ-ММ-ДД[ЧЧ:ММ]"""
+    try:
+        user_id = int(request.match_info['user_id'])
+        async with request.app['db_pool'].acquire() as conn:
+            if 'at' in request.query:
+                at = datetime.fromisoformat(request.query['at'])
+                balance = await balance_at(conn, user_id, at)
+                return web.json_response({
+                    'user_id': user_id,
+                    'at': at.isoformat(),
+                    'balance': str(balance) if balance is not None else None
+                })
+
+            before_seq = int(request.query['before']) if 'before' in request.query else None
+            entries = await statement(conn, user_id, before_seq=before_seq)
+        return web.json_response({
+            'user_id': user_id,
+            'entries': [{
+                **entry,
+                'delta': str(entry['delta']),
+                'balance_after': str(entry['balance_after']),
+                'created_at': entry['created_at'].isoformat()
+            } for entry in entries]
+        })
+    except ValueError:
+        return web.json_response({'error': 'Некорректные параметры'}, status=400)
+    except Exception as e:
+        logger.error(f"Error in balance_history for user {request.match_info['user_id']}: {e}")
+        return web.json_response({'error': f'Ошибка загрузки журнала: {e}'}, status=500)
+
+async def start_ledger(app):
+    app['ledger_task'] = asyncio.create_task(periodic_ledger_snapshots(app))
+
+async def stop_ledger(app):
+    app['ledger_task'].cancel()
+
+def setup_ledger(app):
+    app.on_startup.append(start_ledger)
+    app.on_cleanup.append(stop_ledger)
+    app.add_routes(ledger_routes)
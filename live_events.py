@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from aiohttp import web
+from database import get_pool
+from payment_system import SYSTEM_STATUS, refresh_system_status
+
+logger = logging.getLogger(__name__)
+
+# Один опрос БД на процесс, сколько бы вкладок ни было открыто
+POLL_INTERVAL = float(os.environ.get('LIVE_EVENTS_POLL_INTERVAL', 3))
+# Комментарий-пинг, чтобы прокси не закрывали простаивающее соединение
+KEEPALIVE_INTERVAL = 15
+# Статус платежной системы обновляется не чаще, пока открыта хотя бы одна вкладка
+STATUS_REFRESH_INTERVAL = 300
+# Медленный клиент теряет события сверх этого размера очереди
+QUEUE_SIZE = 100
+# Смена статуса отслеживается только у недавних ожидающих транзакций: зависшие
+# неоплаченные счета не раздувают перепроверку на каждом опросе
+PENDING_MAX_AGE_HOURS = int(os.environ.get('LIVE_EVENTS_PENDING_HOURS', 24))
+PENDING_LIMIT = 1000
+
+class EventBroker:
+    """Раздает события всем подписчикам SSE; опрашивает БД, пока есть хотя бы один подписчик.
+
+    Бот пишет в purchases/transactions напрямую, без NOTIFY, поэтому новые
+    строки ищутся по "верхней отметке" id, а смены статуса - по списку
+    ожидающих (pending) транзакций.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.subscribers = set()
+        self.task = None
+        self._reset()
+
+    def _reset(self):
+        self.last_purchase_id = None
+        self.last_transaction_id = None
+        self.pending = {}
+        self.last_status_update = SYSTEM_STATUS['last_update']
+        self.last_status_refresh = time.monotonic()
+
+    def subscribe(self):
+        queue = asyncio.Queue(QUEUE_SIZE)
+        self.subscribers.add(queue)
+        if self.task is None:
+            self._reset()
+            self.task = asyncio.create_task(self._poll())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event, data):
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait((event, data))
+            except asyncio.QueueFull:
+                logger.warning(f"Live events queue full, dropping {event} event")
+
+    async def _poll(self):
+        try:
+            while self.subscribers:
+                try:
+                    async with get_pool(self.app, 'background').acquire() as conn:
+                        await self._check_purchases(conn)
+                        await self._check_transactions(conn)
+                    if time.monotonic() - self.last_status_refresh > STATUS_REFRESH_INTERVAL:
+                        # Раньше каждая открытая вкладка дергала refresh-status сама
+                        self.last_status_refresh = time.monotonic()
+                        await refresh_system_status()
+                    self._check_system_status()
+                except Exception as e:
+                    logger.error(f"Error polling live events: {e}")
+                await asyncio.sleep(POLL_INTERVAL)
+        finally:
+            self.task = None
+
+    async def _check_purchases(self, conn):
+        if self.last_purchase_id is None:
+            self.last_purchase_id = await conn.fetchval('SELECT COALESCE(MAX(id), 0) FROM purchases')
+            return
+
+        rows = await conn.fetch('''
+            SELECT p.id, p.user_id, p.product, p.price, p.purchase_time, u.username, u.first_name
+            FROM purchases p
+            LEFT JOIN users u ON p.user_id = u.user_id
+            WHERE p.id > $1
+            ORDER BY p.id
+            LIMIT 100
+        ''', self.last_purchase_id)
+        for row in rows:
+            self.publish('purchase', dict(row))
+            self.last_purchase_id = row['id']
+
+    async def _check_transactions(self, conn):
+        if self.last_transaction_id is None:
+            self.last_transaction_id = await conn.fetchval('SELECT COALESCE(MAX(id), 0) FROM transactions')
+            pending = await conn.fetch('''
+                SELECT id, status FROM transactions
+                WHERE status = 'pending' AND created_at > LOCALTIMESTAMP - make_interval(hours => $1)
+                ORDER BY id DESC
+                LIMIT $2
+            ''', PENDING_MAX_AGE_HOURS, PENDING_LIMIT)
+            self.pending = {row['id']: row['status'] for row in pending}
+            return
+
+        rows = await conn.fetch('''
+            SELECT t.id, t.user_id, t.amount, t.currency, t.status, t.created_at, u.username, u.first_name
+            FROM transactions t
+            LEFT JOIN users u ON t.user_id = u.user_id
+            WHERE t.id > $1
+            ORDER BY t.id
+            LIMIT 100
+        ''', self.last_transaction_id)
+        for row in rows:
+            self.publish('transaction', dict(row))
+            self.last_transaction_id = row['id']
+            if row['status'] == 'pending':
+                self.pending[row['id']] = row['status']
+
+        # Сверх лимита перестаем следить за самыми старыми
+        for transaction_id in sorted(self.pending)[:-PENDING_LIMIT]:
+            del self.pending[transaction_id]
+
+        if self.pending:
+            rows = await conn.fetch('''
+                SELECT id, status, created_at > LOCALTIMESTAMP - make_interval(hours => $2) AS recent
+                FROM transactions
+                WHERE id = ANY($1::bigint[])
+            ''', list(self.pending), PENDING_MAX_AGE_HOURS)
+            found = set()
+            for row in rows:
+                found.add(row['id'])
+                if row['status'] != self.pending[row['id']]:
+                    self.publish('transaction_status', {'id': row['id'], 'status': row['status']})
+                if row['status'] == 'pending' and row['recent']:
+                    self.pending[row['id']] = row['status']
+                else:
+                    del self.pending[row['id']]
+            # Удаленные транзакции
+            for transaction_id in set(self.pending) - found:
+                del self.pending[transaction_id]
+
+    def _check_system_status(self):
+        if SYSTEM_STATUS['last_update'] != self.last_status_update:
+            self.last_status_update = SYSTEM_STATUS['last_update']
+            self.publish('system_status', {
+                'last_update': SYSTEM_STATUS['last_update'],
+                'wallet_healthy': SYSTEM_STATUS['wallet_healthy'],
+                'ltc_rate': SYSTEM_STATUS['ltc_rate']
+            })
+
+live_events_routes = web.RouteTableDef()
+
+@live_events_routes.get('/admin/events')
+async def events_stream(request):
+    broker = request.app['event_broker']
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(request)
+
+    queue = broker.subscribe()
+    try:
+        while True:
+            try:
+                event, data = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                await response.write(b': keepalive\n\n')
+                continue
+            payload = json.dumps(data, default=str, ensure_ascii=False)
+            await response.write(f'event: {event}\ndata: {payload}\n\n'.encode('utf-8'))
+    except ConnectionResetError:
+        pass
+    finally:
+        broker.unsubscribe(queue)
+
+    return response
+
+async def start_event_broker(app):
+    app['event_broker'] = EventBroker(app)
+
+async def stop_event_broker(app):
+    task = app['event_broker'].task
+    if task is not None:
+        task.cancel()
+
+def setup_live_events(app):
+    app.on_startup.append(start_event_broker)
+    app.on_cleanup.append(stop_event_broker)
+    app.add_routes(live_events_routes)
@@ -1,20 +1,39 @@
 import os
+import time
+# Отсчет холодного старта: импорт модулей, подключение к БД и запуск сервера.
+# Профиль импорта: python -X importtime main.py 2> importtime.log
+STARTED_AT = time.perf_counter()
 import logging
 from aiohttp import web
-import aiohttp_jinja2
-import jinja2
 from dotenv import load_dotenv
 import asyncio
+import signal
 
-from database import init_db, close_db
+from database import init_db, close_db, db_pool_middleware, database_routes
+from reference_data import setup_reference_data
+import server
+from compression import setup_compression
+from live_events import setup_live_events
+from static_assets import setup_static
+from templating import setup_templates
 from auth import auth_middleware, auth_routes
-from users import users_routes
+from sessions import setup_sessions
+from throttle import login_throttle_middleware, setup_login_throttle
+from users import users_routes, setup_user_indexes
+from user_deletion import setup_user_deletion
+from user_detail import setup_user_detail
+from cohorts import setup_cohorts
+from inventory import setup_inventory
+from ledger import setup_ledger
 from orders import orders_routes
 from transactions import transactions_routes
 from payment_system import payment_system_routes
 from products import products_routes
+from product_import import product_import_routes
 from bot_management import bot_management_routes
 from accounting import accounting_routes
+from admin_api import api_routes
+from user_export import user_export_routes
 from settings import settings_routes  # Добавляем импорт модуля настроек
 
 # Загрузка переменных окружения
@@ -22,16 +41,19 @@ load_dotenv()
 
 # Настройки
 PORT = int(os.environ.get('ADMIN_PORT', 5002))
+# Число процессов-воркеров (SO_REUSEPORT); 1 - обычный однопроцессный режим
+WORKERS = int(os.environ.get('ADMIN_WORKERS', 1))
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def create_admin_app():
-    app = web.Application(middlewares=[auth_middleware])
+    app = web.Application(middlewares=[server.upload_size_middleware, db_pool_middleware, login_throttle_middleware, auth_middleware], **server.application_kwargs())
     
     # Настройка шаблонизатора
-    aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader('templates'))
+    setup_templates(app)
+    setup_static(app)
     
     # Добавление маршрутов из всех модулей
     app.add_routes(auth_routes)
@@ -40,32 +62,60 @@ def create_admin_app():
     app.add_routes(transactions_routes)
     app.add_routes(payment_system_routes)
     app.add_routes(products_routes)
+    app.add_routes(product_import_routes)
     app.add_routes(bot_management_routes)
     app.add_routes(accounting_routes)
     app.add_routes(settings_routes)  # Добавляем маршруты настроек
+    app.add_routes(database_routes)
+    app.add_routes(api_routes)
+    app.add_routes(user_export_routes)
     
     app.on_startup.append(init_db)
     app.on_cleanup.append(close_db)
+    setup_reference_data(app)
+    setup_sessions(app)
+    setup_login_throttle(app)
+    setup_user_indexes(app)
+    setup_ledger(app)
+    setup_user_deletion(app)
+    setup_user_detail(app)
+    setup_cohorts(app)
+    setup_inventory(app)
+    setup_live_events(app)
+    setup_compression(app)
     
     return app
 
-async def main():
+async def main(ready=None, reuse_port=False):
     # Проверяем, что DATABASE_URL установлена
     if not os.environ.get('DATABASE_URL'):
         logger.error("DATABASE_URL environment variable is not set")
         return
     
     app = create_admin_app()
-    runner = web.AppRunner(app)
+    runner = web.AppRunner(app, **server.runner_kwargs())
     await runner.setup()
     
-    site = web.TCPSite(runner, '0.0.0.0', PORT)
+    site = web.TCPSite(runner, '0.0.0.0', PORT, reuse_port=reuse_port, **server.site_kwargs())
     await site.start()
     
-    logger.info(f"Admin panel started on port {PORT}")
+    startup_ms = (time.perf_counter() - STARTED_AT) * 1000
+    logger.info(f"Admin panel started on port {PORT} (pid {os.getpid()}, ready in {startup_ms:.0f} ms)")
+    if ready is not None:
+        ready.set()
     
-    # Бесконечное ожидание
-    await asyncio.Event().wait()
+    # Ожидание до сигнала остановки, затем корректное завершение запросов
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+    await stop_event.wait()
+    
+    await runner.cleanup()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if WORKERS > 1:
+        from workers import supervise
+        supervise(WORKERS)
+    else:
+        server.run(main())
@@ -1,13 +1,14 @@
 import logging
 from aiohttp import web
-import aiohttp_jinja2
+import statements
+from conditional import conditional_page
 
 logger = logging.getLogger(__name__)
 
 orders_routes = web.RouteTableDef()
 
 @orders_routes.get('/admin/orders')
-@aiohttp_jinja2.template('orders.html')
+@conditional_page('orders.html', 'purchases', 'users')
 async def orders_list(request):
     db_pool = request.app['db_pool']
     page = int(request.query.get('page', 1))
@@ -17,9 +18,7 @@ async def orders_list(request):
     try:
         async with db_pool.acquire() as conn:
             # Проверяем существование таблицы purchases
-            table_exists = await conn.fetchval(
-                "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'purchases')"
-            )
+            table_exists = await statements.fetchval(conn, 'table_exists', 'purchases')
             
             if not table_exists:
                 return {
@@ -29,15 +28,9 @@ async def orders_list(request):
                     'total_pages': 0
                 }
             
-            orders = await conn.fetch('''
-                SELECT p.*, u.username, u.first_name 
-                FROM purchases p 
-                LEFT JOIN users u ON p.user_id = u.user_id 
-                ORDER BY p.purchase_time DESC 
-                LIMIT $1 OFFSET $2
-            ''', per_page, offset)
+            orders = await statements.fetch(conn, 'orders_page', per_page, offset)
             
-            total_orders = await conn.fetchval('SELECT COUNT(*) FROM purchases')
+            total_orders = await statements.fetchval(conn, 'orders_count')
         
         return {
             'orders': orders,
@@ -8,8 +8,6 @@ import aiohttp
 from aiohttp import web
 import aiohttp_jinja2
 from datetime import datetime, timedelta
-import jwt
-import qrcode
 from decimal import Decimal, ROUND_HALF_UP
 
 # Настройка логирования
@@ -0,0 +1,191 @@
+import io
+import csv
+import json
+import math
+import uuid
+import logging
+from urllib.parse import urlencode
+from aiohttp import web
+from reference_data import invalidate, tracked_transaction
+from inventory import adjust_stock
+
+logger = logging.getLogger(__name__)
+
+IMPORT_REQUIRED = ('name', 'price', 'category', 'subcategory', 'city', 'district', 'delivery_type')
+IMPORT_OPTIONAL = ('description', 'image_url', 'quantity')
+# Сколько ошибок в строках файла показывать; при любой ошибке файл не загружается
+IMPORT_MAX_ERRORS = 10
+
+# Промежуточная таблица: строки файла + id справочников, которые заполняются при разрешении имен
+STAGING_TABLE = 'product_import'
+STAGING_SCHEMA = f'''
+    CREATE TEMP TABLE {STAGING_TABLE} (
+        row_no INTEGER NOT NULL,
+        uuid TEXT NOT NULL,
+        name TEXT NOT NULL,
+        description TEXT,
+        price REAL NOT NULL,
+        image_url TEXT,
+        category TEXT NOT NULL,
+        subcategory TEXT NOT NULL,
+        city TEXT NOT NULL,
+        district TEXT NOT NULL,
+        delivery_type TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        category_id INTEGER,
+        subcategory_id INTEGER,
+        city_id INTEGER,
+        district_id INTEGER,
+        delivery_type_id INTEGER
+    ) ON COMMIT DROP
+'''
+STAGING_COLUMNS = ('row_no', 'uuid', 'name', 'description', 'price', 'image_url', 'category',
+                   'subcategory', 'city', 'district', 'delivery_type', 'quantity')
+
+# Справочники в порядке разрешения (родители раньше детей):
+# таблица, колонка имени в staging, колонка id в staging,
+# родитель (колонка таблицы, колонка id в staging) и значения для новых строк
+REFERENCES = (
+    ('categories', 'category', 'category_id', None, {}),
+    ('cities', 'city', 'city_id', None, {}),
+    ('delivery_types', 'delivery_type', 'delivery_type_id', None, {}),
+    # Количество новой подкатегории набирается общим движением остатка ниже
+    ('subcategories', 'subcategory', 'subcategory_id', ('category_id', 'category_id'), {'quantity': '0'}),
+    ('districts', 'district', 'district_id', ('city_id', 'city_id'), {})
+)
+
+def _reference_queries(table, name, id_column, parent, extra):
+    """INSERT недостающих записей справочника и UPDATE staging их id - по одному запросу на справочник"""
+    match = f't.name = s.{name}'
+    columns, values, group = ['name'], [f's.{name}'], ['name']
+    if parent is not None:
+        parent_column, parent_id = parent
+        match += f' AND t.{parent_column} = s.{parent_id}'
+        columns.append(parent_column)
+        values.append(f's.{parent_id}')
+        group.append(parent_column)
+    columns += list(extra)
+    values += list(extra.values())
+
+    insert = f'''
+        INSERT INTO {table} ({', '.join(columns)})
+        SELECT DISTINCT {', '.join(values)} FROM {STAGING_TABLE} s
+        WHERE NOT EXISTS (SELECT FROM {table} t WHERE {match})
+    '''
+    # Если в справочнике уже есть дубли по имени, берем самую раннюю запись
+    update = f'''
+        UPDATE {STAGING_TABLE} s SET {id_column} = t.id
+        FROM (SELECT {', '.join(group)}, MIN(id) AS id FROM {table} GROUP BY {', '.join(group)}) t
+        WHERE {match}
+    '''
+    return insert, update
+
+def _parse_rows(filename, raw):
+    """Строки файла CSV (с заголовком) или JSON (массив объектов) как словари"""
+    text = raw.decode('utf-8-sig')
+    if filename.lower().endswith('.json') or text.lstrip().startswith('['):
+        rows = json.loads(text)
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError('JSON должен быть массивом объектов')
+        return rows
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    return list(csv.DictReader(io.StringIO(text), dialect=dialect))
+
+def _staging_records(rows):
+    """Кортежи для COPY и список ошибок по строкам (нумерация с 1, как в таблице без заголовка)"""
+    records, errors = [], []
+    for row_no, row in enumerate(rows, 1):
+        row = {key.strip(): str(value).strip() for key, value in row.items() if key and value is not None}
+        missing = [column for column in IMPORT_REQUIRED if not row.get(column)]
+        if missing:
+            errors.append(f"строка {row_no}: не заполнено {', '.join(missing)}")
+            continue
+        try:
+            price = float(row['price'])
+            quantity = int(row.get('quantity') or 1)
+            # float() принимает 'nan' и 'inf' - такие цены в каталог не пускаем
+            if not math.isfinite(price) or price < 0 or quantity < 0:
+                raise ValueError
+        except ValueError:
+            errors.append(f'строка {row_no}: некорректная цена или количество')
+            continue
+        records.append((
+            row_no, str(uuid.uuid4()), row['name'], row.get('description', ''), price,
+            row.get('image_url', ''), row['category'], row['subcategory'], row['city'],
+            row['district'], row['delivery_type'], quantity
+        ))
+    return records, errors
+
+async def import_products(app, conn, records):
+    """Загружает товары одной транзакцией; возвращает число товаров и созданных записей справочников"""
+    created = {}
+    async with tracked_transaction(app, conn):
+        # Параллельный импорт создал бы одинаковые записи справочников
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('admin_product_import'))")
+        await conn.execute(STAGING_SCHEMA)
+        await conn.copy_records_to_table(STAGING_TABLE, records=records, columns=STAGING_COLUMNS)
+
+        for table, name, id_column, parent, extra in REFERENCES:
+            insert, update = _reference_queries(table, name, id_column, parent, extra)
+            created[table] = int((await conn.execute(insert)).split()[-1])
+            await conn.execute(update)
+
+        status = await conn.execute(f'''
+            INSERT INTO products
+            (uuid, name, description, price, image_url, category_id, subcategory_id, city_id, district_id, delivery_type_id)
+            SELECT uuid, name, description, price, image_url, category_id, subcategory_id, city_id, district_id, delivery_type_id
+            FROM {STAGING_TABLE}
+            ORDER BY row_no
+        ''')
+        # Остаток каждой подкатегории меняется одним движением на весь файл
+        totals = await conn.fetch(
+            f'SELECT subcategory_id, SUM(quantity) FROM {STAGING_TABLE} GROUP BY subcategory_id'
+        )
+        await adjust_stock(conn, dict(totals), 'import')
+
+        changed_tables = ['products', 'subcategories'] + [table for table, count in created.items() if count]
+        await invalidate(app, conn, *dict.fromkeys(changed_tables))
+    return int(status.split()[-1]), created
+
+product_import_routes = web.RouteTableDef()
+
+def _redirect(**params):
+    return web.HTTPFound('/admin/products?' + urlencode({'tab': 'add', **params}))
+
+@product_import_routes.post('/admin/products/import')
+async def import_products_upload(request):
+    """Массовая загрузка товаров из CSV/JSON: справочники по именам, создаются при отсутствии"""
+    data = await request.post()
+    upload = data.get('file')
+    if not isinstance(upload, web.FileField):
+        return _redirect(import_error='Выберите файл CSV или JSON')
+
+    try:
+        rows = _parse_rows(upload.filename or '', upload.file.read())
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return _redirect(import_error=f'Не удалось прочитать файл: {e}')
+
+    records, errors = _staging_records(rows)
+    if errors:
+        shown = '; '.join(errors[:IMPORT_MAX_ERRORS])
+        if len(errors) > IMPORT_MAX_ERRORS:
+            shown += f' и еще {len(errors) - IMPORT_MAX_ERRORS}'
+        return _redirect(import_error=f'Файл не загружен: {shown}')
+    if not records:
+        return _redirect(import_error='В файле нет товаров')
+
+    try:
+        async with request.app['db_pool'].acquire() as conn:
+            imported, created = await import_products(request.app, conn, records)
+    except Exception as e:
+        logger.error(f"Error in import_products: {e}")
+        return _redirect(import_error=f'Ошибка импорта: {e}')
+
+    message = f'Импортировано товаров: {imported}'
+    new_references = sum(created.values())
+    if new_references:
+        message += f', создано записей справочников: {new_references}'
+    return _redirect(message=message)
@@ -1,14 +1,18 @@
 import uuid
 from aiohttp import web
-import aiohttp_jinja2
 import logging
+import statements
+from reference_data import get_reference, invalidate, tracked_transaction
+from conditional import conditional_page
+import inventory
 
 logger = logging.getLogger(__name__)
 
 products_routes = web.RouteTableDef()
 
 @products_routes.get('/admin/products')
-@aiohttp_jinja2.template('products.html')
+@conditional_page('products.html', 'products', 'sold_products', 'subcategories', 'categories',
+                  'cities', 'districts', 'delivery_types', 'users')
 async def products_list(request):
     db_pool = request.app['db_pool']
     page = int(request.query.get('page', 1))
@@ -21,9 +25,7 @@ async def products_list(request):
     try:
         async with db_pool.acquire() as conn:
             # Проверяем существование таблицы products
-            table_exists = await conn.fetchval(
-                "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'products')"
-            )
+            table_exists = await statements.fetchval(conn, 'table_exists', 'products')
             
             if not table_exists:
                 return {
@@ -42,79 +44,26 @@ async def products_list(request):
             
             # Получаем данные в зависимости от активной вкладки
             if active_tab == 'catalog':
-                products = await conn.fetch('''
-                    SELECT p.*, c.name as city_name, cat.name as category_name,
-                           s.name as subcategory_name, s.quantity as subcategory_quantity,
-                           d.name as district_name, dt.name as delivery_type_name
-                    FROM products p
-                    LEFT JOIN cities c ON p.city_id = c.id
-                    LEFT JOIN categories cat ON p.category_id = cat.id
-                    LEFT JOIN subcategories s ON p.subcategory_id = s.id
-                    LEFT JOIN districts d ON p.district_id = d.id
-                    LEFT JOIN delivery_types dt ON p.delivery_type_id = dt.id
-                    ORDER BY p.id DESC
-                    LIMIT $1 OFFSET $2
-                ''', per_page, offset)
+                products = await statements.fetch(conn, 'products_page', per_page, offset)
                 
-                total_products = await conn.fetchval('SELECT COUNT(*) FROM products')
+                total_products = await statements.fetchval(conn, 'products_count')
                 total_pages = (total_products + per_page - 1) // per_page
                 
             elif active_tab == 'sold':
-                products = await conn.fetch('''
-                    SELECT sp.*, p.name as product_name, s.name as subcategory_name,
-                           u.user_id, u.username, u.first_name, sp.sold_at, 
-                           sp.sold_price, sp.quantity, s.quantity as remaining_quantity
-                    FROM sold_products sp
-                    LEFT JOIN products p ON sp.product_id = p.id
-                    LEFT JOIN subcategories s ON sp.subcategory_id = s.id
-                    LEFT JOIN users u ON sp.user_id = u.user_id
-                    ORDER BY sp.sold_at DESC
-                    LIMIT $1 OFFSET $2
-                ''', per_page, offset)
+                products = await statements.fetch(conn, 'sold_products_page', per_page, offset)
                 
-                total_products = await conn.fetchval('SELECT COUNT(*) FROM sold_products')
+                total_products = await statements.fetchval(conn, 'sold_products_count')
                 total_pages = (total_products + per_page - 1) // per_page
             else:
                 products = []
                 total_pages = 0
             
-            # Всегда загружаем данные для форм
-            cities_table_exists = await conn.fetchval(
-                "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'cities')"
-            )
-            categories_table_exists = await conn.fetchval(
-                "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'categories')"
-            )
-            subcategories_table_exists = await conn.fetchval(
-                "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'subcategories')"
-            )
-            districts_table_exists = await conn.fetchval(
-                "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'districts')"
-            )
-            delivery_types_table_exists = await conn.fetchval(
-                "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'delivery_types')"
-            )
-            
-            cities = []
-            categories = []
-            subcategories = []
-            districts = []
-            delivery_types = []
-            
-            if cities_table_exists:
-                cities = await conn.fetch('SELECT * FROM cities ORDER BY name')
-            
-            if categories_table_exists:
-                categories = await conn.fetch('SELECT * FROM categories ORDER BY name')
-            
-            if subcategories_table_exists:
-                subcategories = await conn.fetch('SELECT * FROM subcategories ORDER BY name')
-            
-            if districts_table_exists:
-                districts = await conn.fetch('SELECT * FROM districts ORDER BY name')
-            
-            if delivery_types_table_exists:
-                delivery_types = await conn.fetch('SELECT * FROM delivery_types ORDER BY name')
+            # Всегда загружаем данные для форм (из кэша справочников)
+            cities = await get_reference(request.app, conn, 'cities')
+            categories = await get_reference(request.app, conn, 'categories')
+            subcategories = await get_reference(request.app, conn, 'subcategories')
+            districts = await get_reference(request.app, conn, 'districts')
+            delivery_types = await get_reference(request.app, conn, 'delivery_types')
             
             # Загружаем отдельно проданные товары для соответствующей вкладки
             sold_products = []
@@ -142,7 +91,9 @@ async def products_list(request):
             'sold_products': sold_products,
             'page': page,
             'total_pages': total_pages,
-            'active_tab': active_tab
+            'active_tab': active_tab,
+            'message': request.query.get('message'),
+            'import_error': request.query.get('import_error')
         }
     except Exception as e:
         logger.error(f"Error in products_list: {e}")
@@ -170,63 +121,76 @@ async def add_product(request):
         product_uuid = str(uuid.uuid4())
         
         async with db_pool.acquire() as conn:
-            # Если выбрана новая категория, создаем ее
-            if data['category_id'] == 'new':
-                category_id = await conn.fetchval(
-                    'INSERT INTO categories (name) VALUES ($1) RETURNING id',
-                    data['new_category']
-                )
-            else:
-                category_id = int(data['category_id'])
-            
-            # Если выбрана новая подкатегория, создаем ее
-            if data['subcategory_id'] == 'new':
-                subcategory_id = await conn.fetchval(
-                    'INSERT INTO subcategories (category_id, name, quantity) VALUES ($1, $2, $3) RETURNING id',
-                    category_id, data['new_subcategory'], int(data['quantity'])
-                )
-            else:
-                subcategory_id = int(data['subcategory_id'])
-                # Обновляем количество в существующей подкатегории
-                await conn.execute(
-                    'UPDATE subcategories SET quantity = quantity + $1 WHERE id = $2',
-                    int(data['quantity']), subcategory_id
-                )
-            
-            # Если выбран новый город, создаем его
-            if data['city_id'] == 'new':
-                city_id = await conn.fetchval(
-                    'INSERT INTO cities (name) VALUES ($1) RETURNING id',
-                    data['new_city']
-                )
-            else:
-                city_id = int(data['city_id'])
-            
-            # Если выбран новый район, создаем его
-            if data['district_id'] == 'new':
-                district_id = await conn.fetchval(
-                    'INSERT INTO districts (name, city_id) VALUES ($1, $2) RETURNING id',
-                    data['new_district'], city_id
-                )
-            else:
-                district_id = int(data['district_id'])
-            
-            # Если выбран новый тип доставки, создаем его
-            if data['delivery_type_id'] == 'new':
-                delivery_type_id = await conn.fetchval(
-                    'INSERT INTO delivery_types (name) VALUES ($1) RETURNING id',
-                    data['new_delivery_type']
-                )
-            else:
-                delivery_type_id = int(data['delivery_type_id'])
+            # Справочники, товар и остаток меняются вместе: при ошибке не остается
+            # ни подкатегории с прибавленным количеством, ни товара без него
+            async with tracked_transaction(request.app, conn):
+                # Если выбрана новая категория, создаем ее
+                if data['category_id'] == 'new':
+                    category_id = await conn.fetchval(
+                        'INSERT INTO categories (name) VALUES ($1) RETURNING id',
+                        data['new_category']
+                    )
+                else:
+                    category_id = int(data['category_id'])
+                
+                # Если выбрана новая подкатегория, создаем ее
+                if data['subcategory_id'] == 'new':
+                    subcategory_id = await inventory.create_subcategory(
+                        conn, category_id, data['new_subcategory'], int(data['quantity'])
+                    )
+                else:
+                    subcategory_id = int(data['subcategory_id'])
+                
+                # Если выбран новый город, создаем его
+                if data['city_id'] == 'new':
+                    city_id = await conn.fetchval(
+                        'INSERT INTO cities (name) VALUES ($1) RETURNING id',
+                        data['new_city']
+                    )
+                else:
+                    city_id = int(data['city_id'])
+                
+                # Если выбран новый район, создаем его
+                if data['district_id'] == 'new':
+                    district_id = await conn.fetchval(
+                        'INSERT INTO districts (name, city_id) VALUES ($1, $2) RETURNING id',
+                        data['new_district'], city_id
+                    )
+                else:
+                    district_id = int(data['district_id'])
+                
+                # Если выбран новый тип доставки, создаем его
+                if data['delivery_type_id'] == 'new':
+                    delivery_type_id = await conn.fetchval(
+                        'INSERT INTO delivery_types (name) VALUES ($1) RETURNING id',
+                        data['new_delivery_type']
+                    )
+                else:
+                    delivery_type_id = int(data['delivery_type_id'])
             
-            # Добавляем товар
-            await conn.execute('''
-                INSERT INTO products 
-                (uuid, name, description, price, image_url, category_id, subcategory_id, city_id, district_id, delivery_type_id)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
-            ''', product_uuid, data['name'], data['description'], float(data['price']), 
-               data['image_url'], category_id, subcategory_id, city_id, district_id, delivery_type_id)
+                # Добавляем товар
+                product_id = await conn.fetchval('''
+                    INSERT INTO products 
+                    (uuid, name, description, price, image_url, category_id, subcategory_id, city_id, district_id, delivery_type_id)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+                    RETURNING id
+                ''', product_uuid, data['name'], data['description'], float(data['price']), 
+                   data['image_url'], category_id, subcategory_id, city_id, district_id, delivery_type_id)
+                
+                # Остаток существующей подкатегории растет на количество товара
+                # (новая подкатегория уже создана с ним)
+                if data['subcategory_id'] != 'new':
+                    await inventory.adjust_stock(
+                        conn, {subcategory_id: int(data['quantity'])}, 'add_product', product_id
+                    )
+                
+                # Количество в подкатегории меняется всегда, остальные справочники - только при создании
+                changed_tables = ['products', 'subcategories']
+                for field, table in [('category_id', 'categories'), ('city_id', 'cities'),
+                                     ('district_id', 'districts'), ('delivery_type_id', 'delivery_types')]:
+                    if data[field] == 'new':
+                        changed_tables.append(table)
+                await invalidate(request.app, conn, *changed_tables)
         
         return web.HTTPFound('/admin/products?tab=catalog')
     except Exception as e:
@@ -241,35 +205,27 @@ async def update_product(request):
     
     try:
         async with db_pool.acquire() as conn:
-            # Получаем текущий товар
-            product = await conn.fetchrow('SELECT * FROM products WHERE id = $1', product_id)
-            
-            # Если изменилась подкатегория, обновляем количество
-            if 'subcategory_id' in data and data['subcategory_id'] != str(product['subcategory_id']):
-                # Уменьшаем количество в старой подкатегории
-                await conn.execute('''
-                    UPDATE subcategories 
-                    SET quantity = quantity - 1 
-                    WHERE id = $1
-                ''', product['subcategory_id'])
+            async with tracked_transaction(request.app, conn):
+                # Если изменилась подкатегория, единица остатка переходит в новую;
+                # строка товара заблокирована, так что параллельная правка не спишет ее дважды
+                subcategory_id = int(data['subcategory_id'])
+                old_subcategory_id = await inventory.move_product(conn, product_id, subcategory_id)
                 
-                # Увеличиваем количество в новой подкатегории
                 await conn.execute('''
-                    UPDATE subcategories 
-                    SET quantity = quantity + 1 
-                    WHERE id = $1
-                ''', int(data['subcategory_id']))
-            
-            await conn.execute('''
-                UPDATE products 
-                SET name = $1, description = $2, price = $3, image_url = $4,
-                    category_id = $5, subcategory_id = $6, city_id = $7, 
-                    district_id = $8, delivery_type_id = $9,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE id = $10
-            ''', data['name'], data['description'], float(data['price']), data['image_url'],
-               int(data['category_id']), int(data['subcategory_id']), int(data['city_id']), 
-               int(data['district_id']), int(data['delivery_type_id']), product_id)
+                    UPDATE products 
+                    SET name = $1, description = $2, price = $3, image_url = $4,
+                        category_id = $5, subcategory_id = $6, city_id = $7, 
+                        district_id = $8, delivery_type_id = $9,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = $10
+                ''', data['name'], data['description'], float(data['price']), data['image_url'],
+                   int(data['category_id']), subcategory_id, int(data['city_id']), 
+                   int(data['district_id']), int(data['delivery_type_id']), product_id)
+                
+                changed_tables = ['products']
+                if old_subcategory_id is not None and old_subcategory_id != subcategory_id:
+                    changed_tables.append('subcategories')
+                await invalidate(request.app, conn, *changed_tables)
         
         return web.HTTPFound('/admin/products?tab=catalog')
     except Exception as e:
@@ -283,19 +239,11 @@ async def delete_product(request):
     
     try:
         async with db_pool.acquire() as conn:
-            # Получаем информацию о товаре
-            product = await conn.fetchrow('SELECT * FROM products WHERE id = $1', product_id)
-            
-            if product:
-                # Уменьшаем количество в подкатегории
-                await conn.execute('''
-                    UPDATE subcategories 
-                    SET quantity = quantity - 1 
-                    WHERE id = $1
-                ''', product['subcategory_id'])
-                
-                # Удаляем товар
-                await conn.execute('DELETE FROM products WHERE id = $1', product_id)
+            # Удаление товара и списание остатка - одна транзакция; повторное
+            # удаление того же товара ничего не списывает
+            async with tracked_transaction(request.app, conn):
+                if await inventory.remove_product(conn, product_id):
+                    await invalidate(request.app, conn, 'products', 'subcategories')
         
         return web.HTTPFound('/admin/products?tab=catalog')
     except Exception as e:
@@ -309,10 +257,11 @@ async def add_subcategory(request):
     
     try:
         async with db_pool.acquire() as conn:
-            await conn.execute('''
-                INSERT INTO subcategories (category_id, name, quantity)
-                VALUES ($1, $2, $3)
-            ''', int(data['category_id']), data['name'], int(data['quantity']))
+            async with tracked_transaction(request.app, conn):
+                await inventory.create_subcategory(
+                    conn, int(data['category_id']), data['name'], int(data['quantity'])
+                )
+                await invalidate(request.app, conn, 'subcategories')
         
         return web.HTTPFound('/admin/products?tab=catalog')
     except Exception as e:
@@ -327,11 +276,11 @@ async def update_subcategory(request):
     
     try:
         async with db_pool.acquire() as conn:
-            await conn.execute('''
-                UPDATE subcategories 
-                SET name = $1, quantity = $2
-                WHERE id = $3
-            ''', data['name'], int(data['quantity']), subcategory_id)
+            # Ручной пересчет остатка попадает в журнал разницей с текущим значением
+            async with tracked_transaction(request.app, conn):
+                await conn.execute('UPDATE subcategories SET name = $1 WHERE id = $2', data['name'], subcategory_id)
+                await inventory.set_quantity(conn, subcategory_id, int(data['quantity']))
+                await invalidate(request.app, conn, 'subcategories')
         
         return web.HTTPFound('/admin/products?tab=catalog')
     except Exception as e:
@@ -345,11 +294,10 @@ async def delete_subcategory(request):
     
     try:
         async with db_pool.acquire() as conn:
-            # Удаляем все товары этой подкатегории
-            await conn.execute('DELETE FROM products WHERE subcategory_id = $1', subcategory_id)
-            
-            # Удаляем подкатегорию
-            await conn.execute('DELETE FROM subcategories WHERE id = $1', subcategory_id)
+            # Подкатегория удаляется вместе со своими товарами одной транзакцией
+            async with tracked_transaction(request.app, conn):
+                await inventory.remove_subcategory(conn, subcategory_id)
+                await invalidate(request.app, conn, 'products', 'subcategories')
         
         return web.HTTPFound('/admin/products?tab=catalog')
     except Exception as e:
@@ -0,0 +1,113 @@
+import os
+import time
+import logging
+import contextvars
+from contextlib import asynccontextmanager
+import asyncpg
+from database import connect
+
+logger = logging.getLogger(__name__)
+
+# Канал Postgres для межпроцессной инвалидации кэша справочников
+NOTIFY_CHANNEL = 'admin_reference_data'
+
+# Страховочный TTL: справочники могут меняться и самим ботом (например,
+# остатки подкатегорий при продаже), о чем админка не узнает через NOTIFY
+CACHE_TTL = float(os.environ.get('REFERENCE_CACHE_TTL', 300))
+
+# Справочные запросы для выпадающих списков: имя -> (таблицы, от которых зависит, SQL)
+REFERENCE_QUERIES = {
+    'cities': (('cities',), 'SELECT * FROM cities ORDER BY name'),
+    'categories': (('categories',), 'SELECT * FROM categories ORDER BY name'),
+    'subcategories': (('subcategories',), 'SELECT * FROM subcategories ORDER BY name'),
+    'districts': (('districts',), 'SELECT * FROM districts ORDER BY name'),
+    'districts_with_city': (('districts', 'cities'), '''
+        SELECT d.*, c.name as city_name
+        FROM districts d
+        JOIN cities c ON d.city_id = c.id
+        ORDER BY c.name, d.name
+    '''),
+    'delivery_types': (('delivery_types',), 'SELECT * FROM delivery_types ORDER BY name')
+}
+
+# Таблицы, измененные внутри tracked_transaction: сбрасываются после COMMIT.
+# Сброс до фиксации дал бы параллельному запросу этого воркера перечитать еще старые строки
+# и закэшировать их под новой версией таблицы - ETag новой версии отдавал бы 304 на старые данные
+_pending_tables = contextvars.ContextVar('reference_pending_tables', default=None)
+
+def _drop(app, tables):
+    cache = app['reference_data']
+    for name, (depends_on, _) in REFERENCE_QUERIES.items():
+        if any(table in depends_on for table in tables):
+            cache.pop(name, None)
+
+    # Версии таблиц используются для ETag страниц (см. conditional.py)
+    versions = app['table_versions']
+    for table in tables:
+        versions[table] = versions.get(table, 0) + 1
+
+async def get_reference(app, conn, name):
+    """Справочник из памяти процесса; загружается из БД при первом обращении"""
+    cache = app['reference_data']
+    entry = cache.get(name)
+    if entry is not None and time.monotonic() - entry[0] < CACHE_TTL:
+        return entry[1]
+
+    try:
+        rows = await conn.fetch(REFERENCE_QUERIES[name][1])
+    except asyncpg.UndefinedTableError:
+        # Таблицы бота еще не созданы - не кэшируем, чтобы подхватить их позже
+        return []
+
+    cache[name] = (time.monotonic(), rows)
+    return rows
+
+async def invalidate(app, conn, *tables):
+    """Отмечает изменение таблиц: сбрасывает зависящие справочники,
+    увеличивает версии таблиц и оповещает остальные процессы.
+    Внутри транзакции вызывать под tracked_transaction - сброс произойдет после COMMIT"""
+    for table in tables:
+        await conn.execute('SELECT pg_notify($1, $2)', NOTIFY_CHANNEL, table)
+    pending = _pending_tables.get()
+    if pending is not None:
+        pending.extend(tables)
+    elif not conn.is_in_transaction():
+        _drop(app, tables)
+    # Иначе (транзакция без tracked_transaction) сбросит слушатель: NOTIFY доставляется после COMMIT
+
+@asynccontextmanager
+async def tracked_transaction(app, conn):
+    """conn.transaction(), после фиксации которой сбрасываются справочники таблиц,
+    отмеченных invalidate внутри нее; при откате ничего не сбрасывается"""
+    tables = []
+    token = _pending_tables.set(tables)
+    try:
+        async with conn.transaction():
+            yield
+    finally:
+        _pending_tables.reset(token)
+    _drop(app, tables)
+
+def _on_notify(app):
+    def callback(conn, pid, channel, payload):
+        _drop(app, (payload,))
+    return callback
+
+async def start_reference_listener(app):
+    app['reference_data'] = {}
+    app['table_versions'] = {}
+    try:
+        app['reference_listener'] = await connect()
+        await app['reference_listener'].add_listener(NOTIFY_CHANNEL, _on_notify(app))
+    except Exception as e:
+        # Без слушателя кэш продолжает работать, согласованность обеспечит TTL
+        app['reference_listener'] = None
+        logger.error(f"Error starting reference data listener: {e}")
+
+async def stop_reference_listener(app):
+    if app.get('reference_listener') is not None:
+        await app['reference_listener'].close()
+
+def setup_reference_data(app):
+    app.on_startup.append(start_reference_listener)
+    app.on_cleanup.append(stop_reference_listener)
@@ -0,0 +1,77 @@
+import os
+import queue
+import logging
+import asyncio
+import logging.handlers
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Цикл событий: auto - uvloop, если установлен; 1 - обязательно uvloop; 0 - стандартный asyncio
+USE_UVLOOP = os.environ.get('ADMIN_UVLOOP', 'auto')
+
+# Параметры HTTP-сервера aiohttp
+KEEPALIVE_TIMEOUT = float(os.environ.get('ADMIN_KEEPALIVE_TIMEOUT', 75))
+BACKLOG = int(os.environ.get('ADMIN_BACKLOG', 128))
+SHUTDOWN_TIMEOUT = float(os.environ.get('ADMIN_SHUTDOWN_TIMEOUT', 60))
+# Максимальный размер тела запроса; как у aiohttp по умолчанию, в том числе для /admin/login
+CLIENT_MAX_SIZE = int(os.environ.get('ADMIN_CLIENT_MAX_SIZE', 1024 * 1024))
+# Увеличенный предел только для форм загрузки файлов
+UPLOAD_MAX_SIZE = int(os.environ.get('ADMIN_UPLOAD_MAX_SIZE', 64 * 1024 * 1024))
+UPLOAD_PATHS = ('/admin/users/bulk', '/admin/products/import', '/admin/restore')
+# Журнал доступа: sync - как раньше, async - через очередь в отдельном потоке, off - отключен
+ACCESS_LOG = os.environ.get('ADMIN_ACCESS_LOG', 'sync')
+
+def install_event_loop():
+    """Включает uvloop согласно ADMIN_UVLOOP; возвращает имя используемого цикла"""
+    if USE_UVLOOP == '0':
+        return 'asyncio'
+    try:
+        import uvloop
+    except ImportError:
+        if USE_UVLOOP == '1':
+            raise
+        return 'asyncio'
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return 'uvloop'
+
+def _setup_access_log():
+    access_logger = logging.getLogger('aiohttp.access')
+    if ACCESS_LOG == 'off':
+        return None
+    if ACCESS_LOG == 'async':
+        # Запись в обработчики выполняется в потоке QueueListener, а не в цикле событий
+        handlers = access_logger.handlers or logging.getLogger().handlers
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        access_logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+        access_logger.propagate = False
+    return access_logger
+
+@web.middleware
+async def upload_size_middleware(request, handler):
+    """Поднимает предел размера тела для маршрутов загрузки файлов"""
+    if request.method == 'POST' and request.path in UPLOAD_PATHS:
+        request = request.clone(client_max_size=UPLOAD_MAX_SIZE)
+    return await handler(request)
+
+def application_kwargs():
+    return {'client_max_size': CLIENT_MAX_SIZE}
+
+def runner_kwargs():
+    access_logger = _setup_access_log()
+    return {
+        'keepalive_timeout': KEEPALIVE_TIMEOUT,
+        'shutdown_timeout': SHUTDOWN_TIMEOUT,
+        'access_log': access_logger
+    }
+
+def site_kwargs():
+    return {'backlog': BACKLOG}
+
+def run(coro):
+    """asyncio.run с выбранным циклом событий"""
+    loop_name = install_event_loop()
+    logger.info(f"Starting on {loop_name} event loop")
+    asyncio.run(coro)
@@ -0,0 +1,341 @@
+import os
+import sys
+import json
+import time
+import hmac
+import asyncio
+import hashlib
+import secrets
+import logging
+import functools
+from aiohttp import web
+from database import connect
+
+logger = logging.getLogger(__name__)
+
+# Сессия закрывается после простоя и в любом случае по истечении максимального срока
+SESSION_IDLE_TIMEOUT = int(os.getenv('SESSION_IDLE_TIMEOUT', 1800))
+SESSION_MAX_AGE = int(os.getenv('SESSION_MAX_AGE', 86400))
+# Как часто сбрасывать last_seen в БД и удалять истекшие сессии
+SESSION_SWEEP_INTERVAL = int(os.getenv('SESSION_SWEEP_INTERVAL', 60))
+# Канал Postgres, через который закрытие сессии доходит до остальных воркеров
+SESSION_CHANNEL = 'admin_sessions'
+# Сколько помнить неизвестный токен: запросы со старой cookie не идут в БД каждый раз
+INVALID_TOKEN_TTL = 10
+INVALID_TOKEN_LIMIT = 10000
+
+# Роли: viewer может только просматривать страницы
+ROLES = ('admin', 'viewer')
+READ_ONLY_METHODS = ('GET', 'HEAD')
+
+PASSWORD_ITERATIONS = 260000
+
+SESSIONS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS admin_accounts (
+        id SERIAL PRIMARY KEY,
+        username TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        role TEXT NOT NULL DEFAULT 'admin',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS admin_sessions (
+        id SERIAL PRIMARY KEY,
+        token_hash BYTEA NOT NULL UNIQUE,
+        account_id INTEGER NOT NULL REFERENCES admin_accounts(id) ON DELETE CASCADE,
+        created_at DOUBLE PRECISION NOT NULL,
+        last_seen DOUBLE PRECISION NOT NULL,
+        ip TEXT
+    );
+'''
+
+def hash_password(password):
+    salt = secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), PASSWORD_ITERATIONS)
+    return f"pbkdf2_sha256${PASSWORD_ITERATIONS}${salt}${digest.hex()}"
+
+def check_password(password, password_hash):
+    try:
+        _, iterations, salt, expected = password_hash.split('$')
+    except ValueError:
+        return False
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), int(iterations))
+    return hmac.compare_digest(digest.hex(), expected)
+
+@functools.lru_cache(maxsize=1)
+def _dummy_hash():
+    # Для неизвестного имени пароль проверяется против него: ответ занимает столько же,
+    # сколько для существующего, и не выдает наличие учетной записи
+    return hash_password(secrets.token_hex(16))
+
+def _token_digest(token):
+    return hashlib.sha256(token.encode()).digest()
+
+class SessionStore:
+    """Сессии администраторов: таблица admin_sessions + словарь в памяти процесса.
+
+    Проверка сессии на каждом запросе - поиск в словаре по дайджесту токена;
+    в БД идем только при промахе. last_seen обновляется в памяти и
+    сбрасывается в БД фоновой задачей вместе с удалением истекших сессий.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.sessions = {}  # дайджест токена -> сессия
+        self.touched = set()
+        self.invalid = {}  # дайджест неизвестного токена -> до какого времени не проверять
+
+    def _expired(self, session, now):
+        return (now - session['last_seen'] > SESSION_IDLE_TIMEOUT or
+                now - session['created_at'] > SESSION_MAX_AGE)
+
+    async def _load(self, digest):
+        async with self.app['db_pool'].acquire() as conn:
+            row = await conn.fetchrow('''
+                SELECT s.id, s.created_at, s.last_seen, a.username, a.role
+                FROM admin_sessions s
+                JOIN admin_accounts a ON s.account_id = a.id
+                WHERE s.token_hash = $1
+            ''', digest)
+        return dict(row) if row is not None else None
+
+    async def get(self, token):
+        """Сессия по токену или None, если она не существует или истекла"""
+        digest = _token_digest(token)
+        now = time.time()
+        session = self.sessions.get(digest)
+
+        if session is not None and self._expired(session, now):
+            # Сессия могла оставаться активной в другом воркере - перечитываем из БД
+            del self.sessions[digest]
+            session = None
+
+        if session is None:
+            if self.invalid.get(digest, 0) > now:
+                return None
+            session = await self._load(digest)
+            if session is None or self._expired(session, now):
+                if len(self.invalid) >= INVALID_TOKEN_LIMIT:
+                    self.invalid.clear()
+                self.invalid[digest] = now + INVALID_TOKEN_TTL
+                return None
+            self.sessions[digest] = session
+
+        session['last_seen'] = now
+        self.touched.add(digest)
+        return session
+
+    async def create(self, username, password, ip=None):
+        """Проверяет учетные данные и открывает сессию; возвращает токен или None"""
+        async with self.app['db_pool'].acquire() as conn:
+            account = await conn.fetchrow(
+                'SELECT id, username, password_hash, role FROM admin_accounts WHERE username = $1',
+                username
+            )
+            # PBKDF2 намеренно медленный - не блокируем цикл событий
+            password_hash = account['password_hash'] if account is not None else _dummy_hash()
+            valid = await asyncio.get_running_loop().run_in_executor(
+                None, check_password, password, password_hash
+            )
+            if account is None or not valid:
+                return None
+
+            token = secrets.token_urlsafe(32)
+            digest = _token_digest(token)
+            now = time.time()
+            session_id = await conn.fetchval('''
+                INSERT INTO admin_sessions (token_hash, account_id, created_at, last_seen, ip)
+                VALUES ($1, $2, $3, $3, $4)
+                RETURNING id
+            ''', digest, account['id'], now, ip)
+
+        self.sessions[digest] = {
+            'id': session_id,
+            'created_at': now,
+            'last_seen': now,
+            'username': account['username'],
+            'role': account['role']
+        }
+        return token
+
+    async def revoke(self, token=None, session_id=None):
+        """Закрывает сессию по токену или по id и оповещает остальные воркеры"""
+        async with self.app['db_pool'].acquire() as conn:
+            if token is not None:
+                digest = await conn.fetchval(
+                    'DELETE FROM admin_sessions WHERE token_hash = $1 RETURNING token_hash',
+                    _token_digest(token)
+                )
+            else:
+                digest = await conn.fetchval(
+                    'DELETE FROM admin_sessions WHERE id = $1 RETURNING token_hash',
+                    session_id
+                )
+            if digest is None:
+                return False
+            await conn.execute('SELECT pg_notify($1, $2)', SESSION_CHANNEL, digest.hex())
+
+        self.drop(digest)
+        return True
+
+    def drop(self, digest):
+        self.sessions.pop(digest, None)
+        self.touched.discard(digest)
+
+    async def sweep(self):
+        """Сбрасывает last_seen в БД и удаляет истекшие сессии"""
+        touched = [(digest, self.sessions[digest]['last_seen'])
+                   for digest in self.touched if digest in self.sessions]
+        self.touched.clear()
+
+        now = time.time()
+        async with self.app['db_pool'].acquire() as conn:
+            if touched:
+                await conn.execute('''
+                    UPDATE admin_sessions s
+                    SET last_seen = GREATEST(s.last_seen, v.last_seen)
+                    FROM unnest($1::bytea[], $2::float8[]) AS v(token_hash, last_seen)
+                    WHERE s.token_hash = v.token_hash
+                ''', [digest for digest, _ in touched], [last_seen for _, last_seen in touched])
+
+            await conn.execute(
+                'DELETE FROM admin_sessions WHERE last_seen < $1 OR created_at < $2',
+                now - SESSION_IDLE_TIMEOUT, now - SESSION_MAX_AGE
+            )
+
+        for digest, session in list(self.sessions.items()):
+            if self._expired(session, now):
+                del self.sessions[digest]
+        for digest, until in list(self.invalid.items()):
+            if until <= now:
+                del self.invalid[digest]
+
+async def list_sessions(conn):
+    return await conn.fetch('''
+        SELECT s.id, a.username, a.role, s.ip,
+               to_timestamp(s.created_at) AS created_at,
+               to_timestamp(s.last_seen) AS last_seen
+        FROM admin_sessions s
+        JOIN admin_accounts a ON s.account_id = a.id
+        ORDER BY s.last_seen DESC
+    ''')
+
+async def ensure_default_account(conn):
+    """Создает таблицы и учетную запись из ADMIN_USERNAME/ADMIN_PASSWORD.
+
+    Если ADMIN_PASSWORD задан, он остается действующим паролем этой записи:
+    смена переменной окружения меняет пароль при следующем запуске, как и до
+    перехода на сессии. Без ADMIN_PASSWORD запись с паролем по умолчанию
+    создается только в пустой таблице.
+    """
+    username = os.getenv('ADMIN_USERNAME', 'admin')
+    password = os.getenv('ADMIN_PASSWORD')
+    loop = asyncio.get_running_loop()
+    async with conn.transaction():
+        # Воркеры стартуют одновременно: схему и запись создает один, остальные ждут
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('admin_accounts_seed'))")
+        await conn.execute(SESSIONS_SCHEMA)
+
+        current = await conn.fetchval('SELECT password_hash FROM admin_accounts WHERE username = $1', username)
+        if current is None:
+            if password is None and await conn.fetchval('SELECT EXISTS (SELECT FROM admin_accounts)'):
+                return
+            password_hash = await loop.run_in_executor(None, hash_password, password or 'password')
+            await conn.execute('''
+                INSERT INTO admin_accounts (username, password_hash, role) VALUES ($1, $2, 'admin')
+                ON CONFLICT (username) DO NOTHING
+            ''', username, password_hash)
+            logger.info("Created admin account from ADMIN_USERNAME")
+        elif password is not None and not await loop.run_in_executor(None, check_password, password, current):
+            password_hash = await loop.run_in_executor(None, hash_password, password)
+            await conn.execute(
+                'UPDATE admin_accounts SET password_hash = $1 WHERE username = $2', password_hash, username
+            )
+            logger.info("Updated admin account password from ADMIN_PASSWORD")
+
+async def periodic_session_sweep(store):
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+        try:
+            await store.sweep()
+        except Exception as e:
+            logger.error(f"Error sweeping sessions: {e}")
+
+def _on_session_notify(store):
+    def callback(conn, pid, channel, payload):
+        store.drop(bytes.fromhex(payload))
+    return callback
+
+async def start_sessions(app):
+    store = app['session_store'] = SessionStore(app)
+    async with app['db_pool'].acquire() as conn:
+        await ensure_default_account(conn)
+    # Первая неудачная попытка с неизвестным именем не должна быть заметно дольше остальных
+    await asyncio.get_running_loop().run_in_executor(None, _dummy_hash)
+
+    # Используем соединение-слушатель справочников (см. reference_data.py)
+    listener = app.get('reference_listener')
+    if listener is not None:
+        await listener.add_listener(SESSION_CHANNEL, _on_session_notify(store))
+
+    app['session_sweep_task'] = asyncio.create_task(periodic_session_sweep(store))
+
+async def stop_sessions(app):
+    # Несброшенный last_seen теряется - это сдвигает простой не больше чем на интервал очистки
+    task = app.get('session_sweep_task')
+    if task is not None:
+        task.cancel()
+
+def require_admin(request):
+    if request.get('user', {}).get('role') != 'admin':
+        raise web.HTTPForbidden(text='Недостаточно прав')
+
+sessions_routes = web.RouteTableDef()
+
+@sessions_routes.get('/admin/sessions')
+async def sessions_list(request):
+    require_admin(request)
+    try:
+        async with request.app['db_pool'].acquire() as conn:
+            sessions = await list_sessions(conn)
+        return web.json_response({
+            'sessions': [dict(session) for session in sessions]
+        }, dumps=functools.partial(json.dumps, default=str))
+    except Exception as e:
+        logger.error(f"Error in sessions_list: {e}")
+        return web.json_response({'error': f'Ошибка загрузки сессий: {e}'}, status=500)
+
+@sessions_routes.post('/admin/sessions/{session_id}/revoke')
+async def revoke_session(request):
+    require_admin(request)
+    session_id = int(request.match_info['session_id'])
+    try:
+        revoked = await request.app['session_store'].revoke(session_id=session_id)
+        return web.json_response({'success': revoked})
+    except Exception as e:
+        logger.error(f"Error revoking session {session_id}: {e}")
+        return web.json_response({'success': False, 'error': str(e)}, status=500)
+
+def setup_sessions(app):
+    app.on_startup.append(start_sessions)
+    app.on_cleanup.append(stop_sessions)
+    app.add_routes(sessions_routes)
+
+async def add_account(username, password, role):
+    conn = await connect()
+    try:
+        await conn.execute(SESSIONS_SCHEMA)
+        await conn.execute('''
+            INSERT INTO admin_accounts (username, password_hash, role) VALUES ($1, $2, $3)
+            ON CONFLICT (username) DO UPDATE SET password_hash = EXCLUDED.password_hash, role = EXCLUDED.role
+        ''', username, hash_password(password), role)
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == 'add-account' and sys.argv[4] in ROLES:
+        from dotenv import load_dotenv
+        load_dotenv()
+        asyncio.run(add_account(sys.argv[2], sys.argv[3], sys.argv[4]))
+        print(f"Account {sys.argv[2]} ({sys.argv[4]}) saved")
+    else:
+        print(f"Usage: python sessions.py add-account <username> <password> <{'|'.join(ROLES)}>")
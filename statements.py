@@ -0,0 +1,84 @@
+import logging
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Реестр "горячих" запросов админки. Текст каждого запроса фиксирован, поэтому
+# встроенный кэш asyncpg (statement_cache_size полосы пула) хранит его подготовленным
+# и дальше переиспользует без разбора/планирования сервером. Соединения интерактивной
+# полосы подготавливают весь реестр сразу при открытии (prepare_all), так что первый
+# запрос страницы уже не платит за подготовку.
+# Объекты PreparedStatement самим хранить нельзя: asyncpg делает их
+# недействительными при возврате соединения в пул.
+HOT_STATEMENTS = {
+    'table_exists': '''
+        SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = $1)
+    ''',
+    'orders_page': '''
+        SELECT p.*, u.username, u.first_name
+        FROM purchases p
+        LEFT JOIN users u ON p.user_id = u.user_id
+        ORDER BY p.purchase_time DESC
+        LIMIT $1 OFFSET $2
+    ''',
+    'orders_count': 'SELECT COUNT(*) FROM purchases',
+    'transactions_page': '''
+        SELECT t.*, u.username, u.first_name
+        FROM transactions t
+        LEFT JOIN users u ON t.user_id = u.user_id
+        ORDER BY t.created_at DESC
+        LIMIT $1 OFFSET $2
+    ''',
+    'transactions_count': 'SELECT COUNT(*) FROM transactions',
+    'users_count': 'SELECT COUNT(*) FROM users',
+    'products_page': '''
+        SELECT p.*, c.name as city_name, cat.name as category_name,
+               s.name as subcategory_name, s.quantity as subcategory_quantity,
+               d.name as district_name, dt.name as delivery_type_name
+        FROM products p
+        LEFT JOIN cities c ON p.city_id = c.id
+        LEFT JOIN categories cat ON p.category_id = cat.id
+        LEFT JOIN subcategories s ON p.subcategory_id = s.id
+        LEFT JOIN districts d ON p.district_id = d.id
+        LEFT JOIN delivery_types dt ON p.delivery_type_id = dt.id
+        ORDER BY p.id DESC
+        LIMIT $1 OFFSET $2
+    ''',
+    'products_count': 'SELECT COUNT(*) FROM products',
+    'sold_products_page': '''
+        SELECT sp.*, p.name as product_name, s.name as subcategory_name,
+               u.user_id, u.username, u.first_name, sp.sold_at,
+               sp.sold_price, sp.quantity, s.quantity as remaining_quantity
+        FROM sold_products sp
+        LEFT JOIN products p ON sp.product_id = p.id
+        LEFT JOIN subcategories s ON sp.subcategory_id = s.id
+        LEFT JOIN users u ON sp.user_id = u.user_id
+        ORDER BY sp.sold_at DESC
+        LIMIT $1 OFFSET $2
+    ''',
+    'sold_products_count': 'SELECT COUNT(*) FROM sold_products'
+}
+
+async def prepare_all(conn):
+    """Подготавливает все запросы реестра в кэше нового соединения (init-хук пула)"""
+    for name, query in HOT_STATEMENTS.items():
+        try:
+            # Публичный conn.prepare кэш не заполняет; _prepare(use_cache=True) кладет
+            # запрос в тот же кэш, из которого его потом берет conn.fetch(query).
+            # Это внутренний метод - версия asyncpg закреплена в requirements.txt, а
+            # tests/test_statements.py проверяет, что кэш действительно заполняется
+            await conn._prepare(query, use_cache=True)
+        except asyncpg.UndefinedTableError:
+            # Таблицы бота еще не созданы - запрос подготовится при первом использовании
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to prepare statement {name}: {e}")
+
+async def fetch(conn, name, *args):
+    return await conn.fetch(HOT_STATEMENTS[name], *args)
+
+async def fetchrow(conn, name, *args):
+    return await conn.fetchrow(HOT_STATEMENTS[name], *args)
+
+async def fetchval(conn, name, *args):
+    return await conn.fetchval(HOT_STATEMENTS[name], *args)
@@ -0,0 +1,106 @@
+// Живая лента событий админки (Server-Sent Events, /admin/events).
+// Одно соединение на вкладку; браузер сам переподключается при обрыве.
+// Если лента недоступна (нет EventSource, сервер без /admin/events, выход из сессии),
+// вызываются обработчики unavailable - страница может вернуться к периодическому опросу.
+var liveEvents = (function () {
+    var handlers = {};
+    var fallbacks = [];
+    var source = null;
+    var failed = false;
+
+    function fail() {
+        source = null;
+        if (failed) {
+            return;
+        }
+        failed = true;
+        fallbacks.forEach(function (callback) {
+            callback();
+        });
+    }
+
+    function connect() {
+        if (source || failed) {
+            return;
+        }
+        if (!window.EventSource) {
+            fail();
+            return;
+        }
+        source = new EventSource('/admin/events');
+        source.onerror = function () {
+            // Ответ не text/event-stream (404, редирект на вход) - браузер не переподключается
+            if (source.readyState === EventSource.CLOSED) {
+                fail();
+            }
+        };
+        Object.keys(handlers).forEach(listen);
+    }
+
+    function listen(event) {
+        source.addEventListener(event, function (e) {
+            var data = JSON.parse(e.data);
+            handlers[event].forEach(function (handler) {
+                handler(data);
+            });
+        });
+    }
+
+    function on(event, handler) {
+        if (!handlers[event]) {
+            handlers[event] = [];
+            if (source) {
+                listen(event);
+            }
+        }
+        handlers[event].push(handler);
+        connect();
+    }
+
+    function notify(message) {
+        var container = document.getElementById('live-events');
+        if (!container) {
+            container = document.createElement('div');
+            container.id = 'live-events';
+            container.className = 'position-fixed bottom-0 end-0 p-3';
+            container.style.zIndex = 1080;
+            document.body.appendChild(container);
+        }
+
+        var alert = document.createElement('div');
+        alert.className = 'alert alert-info alert-dismissible shadow-sm mb-2';
+        alert.textContent = message;
+
+        var reload = document.createElement('a');
+        reload.href = '#';
+        reload.className = 'alert-link ms-2';
+        reload.textContent = 'Обновить';
+        reload.onclick = function (e) {
+            e.preventDefault();
+            location.reload();
+        };
+        alert.appendChild(reload);
+
+        var close = document.createElement('button');
+        close.type = 'button';
+        close.className = 'btn-close';
+        close.setAttribute('data-bs-dismiss', 'alert');
+        alert.appendChild(close);
+
+        container.appendChild(alert);
+        // Держим на экране только последние уведомления
+        while (container.children.length > 5) {
+            container.removeChild(container.firstChild);
+        }
+    }
+
+    function unavailable(callback) {
+        if (failed) {
+            callback();
+        } else {
+            fallbacks.push(callback);
+        }
+    }
+
+    return {on: on, notify: notify, unavailable: unavailable};
+})();
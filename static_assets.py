@@ -0,0 +1,149 @@
+import os
+import sys
+import gzip
+import hashlib
+import logging
+import urllib.request
+from aiohttp import web
+import aiohttp_jinja2
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+STATIC_PREFIX = '/static/'
+
+# Сторонние ресурсы, которые раньше грузились с CDN: логический путь -> исходный URL.
+# Скачиваются в static/ командой `python static_assets.py vendor` при сборке
+# (buildCommand в render-admin.yaml); пока файла нет, static_url() отдает исходный CDN-адрес
+VENDOR_ASSETS = {
+    'vendor/bootstrap/bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css',
+    'vendor/bootstrap/bootstrap.bundle.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js',
+    'vendor/bootstrap-icons/bootstrap-icons.css': 'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.7.2/font/bootstrap-icons.css',
+    'vendor/bootstrap-icons/fonts/bootstrap-icons.woff2': 'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.7.2/font/fonts/bootstrap-icons.woff2',
+    'vendor/bootstrap-icons/fonts/bootstrap-icons.woff': 'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.7.2/font/fonts/bootstrap-icons.woff',
+    'vendor/jquery/jquery-3.6.0.min.js': 'https://code.jquery.com/jquery-3.6.0.min.js',
+    'vendor/summernote/summernote-lite.min.css': 'https://cdn.jsdelivr.net/npm/summernote@0.8.18/dist/summernote-lite.min.css',
+    'vendor/summernote/summernote-lite.min.js': 'https://cdn.jsdelivr.net/npm/summernote@0.8.18/dist/summernote-lite.min.js',
+    'vendor/summernote/lang/summernote-ru-RU.min.js': 'https://cdn.jsdelivr.net/npm/summernote@0.8.18/dist/lang/summernote-ru-RU.min.js',
+    'vendor/summernote/font/summernote.woff2': 'https://cdn.jsdelivr.net/npm/summernote@0.8.18/dist/font/summernote.woff2',
+    'vendor/summernote/font/summernote.woff': 'https://cdn.jsdelivr.net/npm/summernote@0.8.18/dist/font/summernote.woff',
+    'vendor/summernote/font/summernote.ttf': 'https://cdn.jsdelivr.net/npm/summernote@0.8.18/dist/font/summernote.ttf',
+    'vendor/summernote/font/summernote.eot': 'https://cdn.jsdelivr.net/npm/summernote@0.8.18/dist/font/summernote.eot'
+}
+
+# Форматы, для которых заранее готовим .gz/.br рядом с файлом
+PRECOMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.ttf', '.eot', '.json')
+
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+# Файлы по нехэшированному адресу (шрифты из относительных url() в CSS)
+PLAIN_CACHE = 'public, max-age=86400'
+
+# Манифест: логический путь -> имя с хэшем содержимого и обратно
+ASSET_MANIFEST = {
+    'hashed': {},
+    'logical': {}
+}
+
+def _hashed_name(path, digest):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{digest[:12]}{ext}"
+
+def _precompress(file_path, data):
+    variants = [('.gz', lambda: gzip.compress(data, compresslevel=9))]
+    if brotli is not None:
+        variants.append(('.br', lambda: brotli.compress(data, quality=11)))
+
+    source_mtime = os.path.getmtime(file_path)
+    for suffix, compress in variants:
+        target = file_path + suffix
+        if os.path.exists(target) and os.path.getmtime(target) >= source_mtime:
+            continue
+        try:
+            with open(target, 'wb') as f:
+                f.write(compress())
+        except OSError as e:
+            # Файловая система только для чтения: файл отдается без заранее сжатой копии
+            logger.warning(f"Cannot precompress {file_path}: {e}")
+            return
+
+def build_manifest():
+    """Хэширует файлы в static/ и готовит сжатые варианты"""
+    ASSET_MANIFEST['hashed'].clear()
+    ASSET_MANIFEST['logical'].clear()
+    if not os.path.isdir(STATIC_DIR):
+        return
+
+    for root, _, files in os.walk(STATIC_DIR):
+        for name in files:
+            if name.endswith(('.gz', '.br')):
+                continue
+            file_path = os.path.join(root, name)
+            logical = os.path.relpath(file_path, STATIC_DIR).replace(os.sep, '/')
+            with open(file_path, 'rb') as f:
+                data = f.read()
+
+            hashed = _hashed_name(logical, hashlib.sha256(data).hexdigest())
+            ASSET_MANIFEST['hashed'][logical] = hashed
+            ASSET_MANIFEST['logical'][hashed] = logical
+
+            if name.endswith(PRECOMPRESS_EXTENSIONS):
+                _precompress(file_path, data)
+
+    logger.info(f"Static assets: {len(ASSET_MANIFEST['hashed'])} files")
+
+def static_url(path):
+    """URL ресурса для шаблонов: хэшированный локальный адрес или CDN, если файл не завендорен"""
+    hashed = ASSET_MANIFEST['hashed'].get(path)
+    if hashed is not None:
+        return STATIC_PREFIX + hashed
+    if path in VENDOR_ASSETS:
+        return VENDOR_ASSETS[path]
+    return STATIC_PREFIX + path
+
+static_routes = web.RouteTableDef()
+
+@static_routes.get(STATIC_PREFIX + '{path:.+}')
+async def serve_static(request):
+    path = request.match_info['path']
+
+    # Отдаем только файлы из манифеста - это заодно исключает выход за пределы static/
+    logical = ASSET_MANIFEST['logical'].get(path)
+    if logical is not None:
+        cache_control = IMMUTABLE_CACHE
+    elif path in ASSET_MANIFEST['hashed']:
+        logical = path
+        cache_control = PLAIN_CACHE
+    else:
+        raise web.HTTPNotFound()
+
+    # FileResponse сам выбирает .br/.gz по Accept-Encoding
+    return web.FileResponse(
+        os.path.join(STATIC_DIR, logical),
+        headers={'Cache-Control': cache_control}
+    )
+
+def setup_static(app):
+    build_manifest()
+    aiohttp_jinja2.get_env(app).globals['static_url'] = static_url
+    app.add_routes(static_routes)
+
+def vendor_assets():
+    """Скачивает сторонние ресурсы в static/vendor"""
+    for path, url in VENDOR_ASSETS.items():
+        target = os.path.join(STATIC_DIR, *path.split('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with urllib.request.urlopen(url, timeout=30) as response, open(target, 'wb') as f:
+            f.write(response.read())
+        print(f"{url} -> {target}")
+    build_manifest()
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['vendor']:
+        vendor_assets()
+    else:
+        print("Usage: python static_assets.py vendor")
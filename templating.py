@@ -0,0 +1,42 @@
+import os
+import time
+import logging
+import aiohttp_jinja2
+import jinja2
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_DIR = 'templates'
+
+# Скомпилированный байткод шаблонов на диске: общий для всех воркеров и перезапусков,
+# Jinja сама сверяет контрольную сумму исходника и перекомпилирует измененные шаблоны
+BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR', '.jinja_cache')
+
+# В продакшене шаблоны не меняются - не проверяем mtime файлов на каждом запросе
+AUTO_RELOAD = os.environ.get('JINJA_AUTO_RELOAD', '0') == '1'
+
+def precompile_templates(env):
+    """Компилирует все шаблоны при старте, чтобы первый запрос не платил за компиляцию"""
+    start_time = time.perf_counter()
+    compiled = 0
+    for name in env.list_templates(extensions=['html']):
+        try:
+            env.get_template(name)
+            compiled += 1
+        except jinja2.TemplateError as e:
+            logger.error(f"Error compiling template {name}: {e}")
+
+    elapsed = (time.perf_counter() - start_time) * 1000
+    logger.info(f"Precompiled {compiled} templates in {elapsed:.1f} ms")
+    return compiled
+
+def setup_templates(app):
+    os.makedirs(BYTECODE_CACHE_DIR, exist_ok=True)
+    env = aiohttp_jinja2.setup(
+        app,
+        loader=jinja2.FileSystemLoader(TEMPLATES_DIR),
+        bytecode_cache=jinja2.FileSystemBytecodeCache(BYTECODE_CACHE_DIR),
+        auto_reload=AUTO_RELOAD
+    )
+    precompile_templates(env)
+    return env
@@ -0,0 +1,119 @@
+import os
+import sys
+import uuid
+import asyncio
+import asyncpg
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Тесты идут на настоящем PostgreSQL из TEST_DATABASE_URL (без него пропускаются).
+# Каждый тест работает в своей схеме, которая удаляется после него
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+
+# Таблицы бота в том виде, в каком их читает админка
+BOT_SCHEMA = '''
+    CREATE TABLE users (
+        user_id BIGINT PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        balance REAL DEFAULT 0,
+        discount INTEGER DEFAULT 0,
+        purchase_count INTEGER DEFAULT 0,
+        ban_until TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE purchases (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT,
+        product TEXT,
+        price REAL,
+        status TEXT DEFAULT 'completed',
+        district TEXT,
+        delivery_type TEXT,
+        purchase_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE transactions (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT,
+        amount REAL,
+        currency TEXT,
+        status TEXT,
+        invoice_uuid TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE subcategories (
+        id SERIAL PRIMARY KEY,
+        category_id INTEGER,
+        name TEXT,
+        quantity INTEGER DEFAULT 0
+    );
+    CREATE TABLE sold_products (
+        id SERIAL PRIMARY KEY,
+        product_id INTEGER,
+        subcategory_id INTEGER,
+        user_id BIGINT,
+        quantity INTEGER,
+        sold_price REAL,
+        sold_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+class _ConnectionPool:
+    """Полоса пула, которая всегда отдает одно и то же соединение"""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        return False
+
+@pytest.fixture
+def make_app():
+    """Словарь приложения, у которого все полосы пула отдают переданное соединение"""
+    def make(conn):
+        pool = _ConnectionPool(conn)
+        return {
+            'db_pool': pool,
+            'db_pools': {lane: pool for lane in ('interactive', 'export', 'background')},
+            'reference_data': {},
+            'table_versions': {}
+        }
+    return make
+
+@pytest.fixture
+def db():
+    """Запускает сценарий `async def scenario(connect)` в отдельной схеме с таблицами бота;
+    connect() открывает новое соединение с этой схемой"""
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL не задан')
+
+    def run(scenario):
+        async def main():
+            schema = f'test_{uuid.uuid4().hex[:12]}'
+            connections = []
+
+            async def connect():
+                conn = await asyncpg.connect(TEST_DATABASE_URL, server_settings={'search_path': schema})
+                connections.append(conn)
+                return conn
+
+            admin = await asyncpg.connect(TEST_DATABASE_URL)
+            await admin.execute(f'CREATE SCHEMA {schema}')
+            try:
+                setup = await connect()
+                await setup.execute(BOT_SCHEMA)
+                return await scenario(connect)
+            finally:
+                for conn in connections:
+                    await conn.close()
+                await admin.execute(f'DROP SCHEMA {schema} CASCADE')
+                await admin.close()
+
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,44 @@
+import pytest
+import admin_api
+from cursors import decode_cursor
+
+SEED = {
+    'orders': '''
+        INSERT INTO purchases (user_id, product, price, purchase_time)
+        SELECT g, 'p' || g, 1, CASE WHEN g % 2 = 0 THEN NULL ELSE TIMESTAMP '2024-01-01' + g * INTERVAL '1 hour' END
+        FROM generate_series(1, $1) g
+    ''',
+    'transactions': '''
+        INSERT INTO transactions (user_id, amount, status, created_at)
+        SELECT g, 1, 'paid', CASE WHEN g % 2 = 0 THEN NULL ELSE TIMESTAMP '2024-01-01' + g * INTERVAL '1 hour' END
+        FROM generate_series(1, $1) g
+    ''',
+    'users': '''
+        INSERT INTO users (user_id, username, created_at)
+        SELECT g, 'u' || g, CASE WHEN g % 2 = 0 THEN NULL ELSE TIMESTAMP '2024-01-01' + g * INTERVAL '1 hour' END
+        FROM generate_series(1, $1) g
+    '''
+}
+
+@pytest.mark.parametrize('name', sorted(SEED))
+def test_list_pages_include_rows_without_time(db, name):
+    resource = admin_api.API_RESOURCES[name]
+    id_field = resource['key'][-1][0]
+    fields = [field for field, _ in resource['key']]
+    total, limit = 25, 4
+
+    async def scenario(connect):
+        conn = await connect()
+        # У половины строк времени нет - границы страниц приходятся и на такие строки
+        await conn.execute(SEED[name], total)
+        seen, key_values = [], []
+        while True:
+            rows, cursor = await admin_api.list_page(conn, resource, fields, limit, key_values)
+            seen += [row[id_field] for row in rows]
+            if cursor is None:
+                return seen
+            key_values = decode_cursor(cursor, resource['key'])
+
+    seen = db(scenario)
+    assert sorted(seen) == list(range(1, total + 1))
+    assert len(seen) == len(set(seen))
@@ -0,0 +1,32 @@
+import cohorts
+
+def test_report_readable_during_rebuild(db, make_app, monkeypatch):
+    async def scenario(connect):
+        conn, reader = await connect(), await connect()
+        await conn.execute('''
+            INSERT INTO users (user_id, created_at)
+            SELECT g, LOCALTIMESTAMP - g * INTERVAL '1 day' FROM generate_series(1, 30) g;
+            INSERT INTO purchases (user_id, price, purchase_time)
+            SELECT g, 10, LOCALTIMESTAMP - g * INTERVAL '1 day' + INTERVAL '1 hour' FROM generate_series(1, 30) g;
+        ''')
+        app = make_app(conn)
+        assert await cohorts.update_cohorts(app)
+        before = await cohorts.cohort_report(reader)
+
+        # Отчет читается посреди пересчета, пока его транзакция не зафиксирована
+        during = []
+        roll_up = cohorts._roll_up
+
+        async def paused_roll_up(conn, state):
+            await reader.execute("SET lock_timeout = '1s'")
+            during.append(await cohorts.cohort_report(reader))
+            await roll_up(conn, state)
+
+        monkeypatch.setattr(cohorts, '_roll_up', paused_roll_up)
+        assert await cohorts.update_cohorts(app, rebuild=True)
+        return before, during, await cohorts.cohort_report(reader)
+
+    before, during, after = db(scenario)
+    assert before
+    assert during == [before]
+    assert after == before
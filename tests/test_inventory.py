@@ -0,0 +1,39 @@
+import inventory
+
+def test_late_committed_sale_is_not_lost(db, make_app, monkeypatch):
+    monkeypatch.setattr(inventory, 'RECONCILE_GRACE', 0)
+
+    async def scenario(connect):
+        conn, bot = await connect(), await connect()
+        subcategory_id = await conn.fetchval("INSERT INTO subcategories (name, quantity) VALUES ('s', 10) RETURNING id")
+        app = make_app(conn)
+        assert await inventory.install_inventory(app)
+
+        async def sell(sale_conn):
+            await sale_conn.execute('INSERT INTO sold_products (subcategory_id, quantity) VALUES ($1, 1)', subcategory_id)
+
+        async def write_off(sale_conn):
+            await sale_conn.execute('UPDATE subcategories SET quantity = quantity - 1 WHERE id = $1', subcategory_id)
+
+        # Продажа A получает меньший id, но фиксируется после сверки; продажа B - сразу
+        late = bot.transaction()
+        await late.start()
+        await sell(bot)
+        async with conn.transaction():
+            await sell(conn)
+            await write_off(conn)
+        results = [await inventory.reconcile_inventory(app)]
+        await write_off(bot)
+        await late.commit()
+
+        results.append(await inventory.reconcile_inventory(app))
+        # Следующая продажа снова затрагивает подкатегорию
+        async with conn.transaction():
+            await sell(conn)
+            await write_off(conn)
+        results.append(await inventory.reconcile_inventory(app))
+        return results, await conn.fetchval('SELECT quantity FROM subcategories WHERE id = $1', subcategory_id)
+
+    results, quantity = db(scenario)
+    assert [result['corrected'] for result in results] == [[], [], []]
+    assert quantity == 7
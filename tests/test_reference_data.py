@@ -0,0 +1,39 @@
+import pytest
+from reference_data import get_reference, invalidate, tracked_transaction
+
+async def _cities(connect, make_app):
+    conn, reader = await connect(), await connect()
+    await conn.execute("CREATE TABLE cities (id SERIAL PRIMARY KEY, name TEXT); INSERT INTO cities (name) VALUES ('old')")
+    app = make_app(conn)
+    await get_reference(app, reader, 'cities')
+    return app, conn, reader
+
+def _names(rows):
+    return [row['name'] for row in rows]
+
+def test_cache_dropped_after_commit(db, make_app):
+    async def scenario(connect):
+        app, conn, reader = await _cities(connect, make_app)
+        async with tracked_transaction(app, conn):
+            await conn.execute("UPDATE cities SET name = 'new'")
+            await invalidate(app, conn, 'cities')
+            # Параллельный запрос этого воркера до COMMIT: видит старые строки под старой версией
+            during = _names(await get_reference(app, reader, 'cities')), app['table_versions'].get('cities', 0)
+        after = _names(await get_reference(app, reader, 'cities')), app['table_versions'].get('cities', 0)
+        return during, after
+
+    during, after = db(scenario)
+    assert during == (['old'], 0)
+    assert after == (['new'], 1)
+
+def test_rollback_keeps_cache(db, make_app):
+    async def scenario(connect):
+        app, conn, reader = await _cities(connect, make_app)
+        with pytest.raises(RuntimeError):
+            async with tracked_transaction(app, conn):
+                await conn.execute("UPDATE cities SET name = 'new'")
+                await invalidate(app, conn, 'cities')
+                raise RuntimeError
+        return _names(await get_reference(app, reader, 'cities')), app['table_versions'].get('cities', 0)
+
+    assert db(scenario) == (['old'], 0)
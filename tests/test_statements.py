@@ -0,0 +1,16 @@
+import statements
+
+def test_prepare_all_fills_statement_cache(db):
+    async def scenario(connect):
+        conn = await connect()
+        await statements.prepare_all(conn)
+        prepared = await conn.fetchval('SELECT COUNT(*) FROM pg_prepared_statements')
+        # Запросы реестра берутся из кэша: новых подготовленных запросов на сервере не появляется
+        await statements.fetchval(conn, 'table_exists', 'purchases')
+        await statements.fetch(conn, 'orders_page', 10, 0)
+        await statements.fetchval(conn, 'users_count')
+        return prepared, await conn.fetchval('SELECT COUNT(*) FROM pg_prepared_statements')
+
+    prepared, after = db(scenario)
+    assert prepared > 0
+    assert after == prepared
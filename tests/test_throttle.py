@@ -0,0 +1,23 @@
+import asyncio
+import throttle
+
+def test_username_delay_grows_across_ips():
+    async def scenario():
+        app = {'login_throttle': throttle.MemoryCounters()}
+        delays = []
+        # Каждая попытка - с нового адреса: лимит имени от IP не зависит
+        for attempt in range(throttle.LOGIN_MAX_PER_USER + 8):
+            delays.append(await throttle.username_delay(app, 'admin'))
+            await throttle.record_failure(app, f'10.0.0.{attempt}', 'admin')
+        other = await throttle.username_delay(app, 'viewer')
+        await throttle.record_success(app, 'admin')
+        return delays, other, await throttle.username_delay(app, 'admin')
+
+    delays, other, after_success = asyncio.run(scenario())
+    limit = throttle.LOGIN_MAX_PER_USER
+    assert delays[:limit] == [0] * limit
+    assert delays[limit:limit + 3] == [throttle.LOGIN_USER_DELAY * 2 ** n for n in range(3)]
+    assert delays == sorted(delays)
+    assert delays[-1] == throttle.LOGIN_USER_MAX_DELAY
+    assert other == 0
+    assert after_success == 0
@@ -0,0 +1,38 @@
+from datetime import datetime
+import pytest
+import ledger
+import user_deletion
+
+@pytest.mark.parametrize('mode', user_deletion.MODES)
+def test_reused_user_id_starts_new_ledger(db, make_app, mode):
+    async def scenario(connect):
+        conn = await connect()
+        app = make_app(conn)
+        assert await ledger.install_ledger(app)
+        await conn.execute('INSERT INTO users (user_id, balance) VALUES (5, 0)')
+        await conn.execute('UPDATE users SET balance = balance + 10 WHERE user_id = 5')
+        await conn.execute('UPDATE users SET balance = balance + 5 WHERE user_id = 5')
+        await conn.execute('INSERT INTO users (user_id, balance) VALUES (6, 7)')
+
+        removed = await user_deletion.delete_inline(app, conn, 5, mode)
+
+        # Тот же Telegram ID регистрируется заново
+        await conn.execute('INSERT INTO users (user_id, balance) VALUES (5, 3)')
+        await conn.execute('UPDATE users SET balance = balance + 2 WHERE user_id = 5')
+        archived = None
+        if mode == 'archive':
+            archived = await conn.fetchval('SELECT COUNT(*) FROM balance_ledger_archive WHERE user_id = 5')
+        return (
+            removed,
+            await ledger.statement(conn, 5),
+            await ledger.balance_at(conn, 5, datetime(2100, 1, 1)),
+            await ledger.statement(conn, 6),
+            archived
+        )
+
+    removed, entries, balance, other, archived = db(scenario)
+    assert removed['balance_ledger'] == 2
+    assert [(entry['seq'], entry['delta'], entry['balance_after']) for entry in entries] == [(2, 2, 5), (1, 3, 3)]
+    assert balance == 5
+    assert [entry['balance_after'] for entry in other] == [7]
+    assert archived == (2 if mode == 'archive' else None)
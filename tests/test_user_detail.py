@@ -0,0 +1,56 @@
+import asyncpg
+import pytest
+import user_detail
+
+def test_summary_counts_paid_deposits(db):
+    async def scenario(connect):
+        conn = await connect()
+        await conn.execute('''
+            INSERT INTO transactions (user_id, amount, status) VALUES
+            (1, 10, 'paid'), (1, 5.5, 'paid'), (1, 7, 'pending'), (1, 3, 'canceled'), (2, 100, 'paid')
+        ''')
+        return await user_detail.user_summary(conn, 1)
+
+    summary = db(scenario)
+    assert summary['transactions'] == 4
+    assert summary['deposited'] == 15.5
+    assert summary['pending'] == 1
+
+def test_history_pages_include_rows_without_time(db):
+    total = 3 * user_detail.HISTORY_PAGE_SIZE
+
+    async def scenario(connect):
+        conn = await connect()
+        # У половины строк нет времени - граница страницы приходится на такую строку
+        await conn.execute('''
+            INSERT INTO purchases (user_id, product, price, purchase_time)
+            SELECT 1, 'p' || g, 1, CASE WHEN g % 2 = 0 THEN NULL ELSE TIMESTAMP '2024-01-01' + g * INTERVAL '1 hour' END
+            FROM generate_series(1, $1) g
+        ''', total)
+        seen, cursor, pages = [], None, 0
+        while True:
+            rows, cursor = await user_detail.history_page(conn, 'purchases', 1, cursor)
+            seen += [row['id'] for row in rows]
+            pages += 1
+            if cursor is None:
+                return seen, pages
+
+    seen, pages = db(scenario)
+    assert sorted(seen) == list(range(1, total + 1))
+    assert pages == 3
+
+def test_history_indexes_rebuild_invalid(db, make_app):
+    async def scenario(connect):
+        conn = await connect()
+        await conn.execute("INSERT INTO purchases (user_id, product) VALUES (1, 'a'), (1, 'b')")
+        # Прерванная сборка CONCURRENTLY оставляет INVALID-индекс с тем же именем
+        with pytest.raises(asyncpg.UniqueViolationError):
+            await conn.execute('CREATE UNIQUE INDEX CONCURRENTLY idx_purchases_user_time ON purchases (user_id)')
+        await user_detail.create_history_indexes(make_app(conn))
+        return await conn.fetch('''
+            SELECT c.relname, i.indisvalid, i.indisunique FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = ANY($1::text[])
+        ''', list(user_detail.HISTORY_INDEXES))
+
+    indexes = {row['relname']: (row['indisvalid'], row['indisunique']) for row in db(scenario)}
+    assert indexes == {name: (True, False) for name in user_detail.HISTORY_INDEXES}
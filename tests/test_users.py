@@ -0,0 +1,10 @@
+import pytest
+import users
+
+@pytest.mark.parametrize('amount', ['nan', 'inf', '-Infinity'])
+def test_bulk_balance_rejects_non_finite_amount(amount):
+    with pytest.raises(ValueError):
+        users._bulk_set_clause('balance', {'amount': amount})
+
+def test_bulk_balance_subtracts():
+    assert users._bulk_set_clause('balance', {'amount': '2.5', 'is_subtract': 'on'}) == ('balance = balance + $1', [-2.5])
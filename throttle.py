@@ -0,0 +1,208 @@
+import os
+import time
+import math
+import asyncio
+import logging
+from collections import OrderedDict
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Неудачные попытки входа за скользящее окно: по IP и по имени пользователя.
+# IP сверх лимита получает отказ, а имя - только растущую задержку перед проверкой пароля:
+# перебор с разных адресов замедляется, но настоящий админ все равно может войти
+LOGIN_WINDOW = int(os.getenv('LOGIN_THROTTLE_WINDOW', 900))
+LOGIN_MAX_PER_IP = int(os.getenv('LOGIN_THROTTLE_MAX_PER_IP', 20))
+LOGIN_MAX_PER_USER = int(os.getenv('LOGIN_THROTTLE_MAX_PER_USER', 10))
+# Задержка (сек) на первую попытку сверх лимита имени; дальше удваивается до потолка
+LOGIN_USER_DELAY = float(os.getenv('LOGIN_THROTTLE_USER_DELAY', 1))
+LOGIN_USER_MAX_DELAY = float(os.getenv('LOGIN_THROTTLE_USER_MAX_DELAY', 30))
+# Ограничение памяти: сколько ключей (IP/имен) помнит процесс
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv('LOGIN_THROTTLE_MAX_KEYS', 100000))
+# 1 - счетчики общие для всех воркеров (в Postgres), иначе в памяти процесса
+LOGIN_THROTTLE_SHARED = os.getenv('LOGIN_THROTTLE_SHARED', '0') == '1'
+# 1 - за обратным прокси (Render, nginx): IP клиента берется из X-Forwarded-For,
+# иначе все клиенты делили бы один счетчик адреса прокси
+TRUST_PROXY_HEADERS = os.getenv('TRUST_PROXY_HEADERS', '0') == '1'
+
+LOGIN_PATH = '/admin/login'
+
+THROTTLE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS admin_login_failures (
+        key TEXT NOT NULL,
+        window_id BIGINT NOT NULL,
+        failures INTEGER NOT NULL,
+        PRIMARY KEY (key, window_id)
+    )
+'''
+
+def _estimate(previous, current, now):
+    # Скользящее окно из двух фиксированных: предыдущее окно учитывается
+    # пропорционально той части, что еще попадает в последние LOGIN_WINDOW секунд
+    elapsed = (now % LOGIN_WINDOW) / LOGIN_WINDOW
+    return previous * (1 - elapsed) + current
+
+class MemoryCounters:
+    """Счетчики в памяти: на ключ - номер окна и два числа, не больше max_keys ключей"""
+
+    def __init__(self, max_keys=LOGIN_THROTTLE_MAX_KEYS):
+        self.max_keys = max_keys
+        self.counters = OrderedDict()  # ключ -> [номер окна, предыдущее, текущее]
+
+    def _get(self, key, window_id):
+        counter = self.counters.get(key)
+        if counter is None:
+            return None
+        if counter[0] != window_id:
+            # Сдвигаем окна: текущее становится предыдущим, а если прошло
+            # больше одного окна - обнуляем оба
+            previous = counter[2] if counter[0] == window_id - 1 else 0
+            counter[:] = [window_id, previous, 0]
+        return counter
+
+    async def estimate(self, key, now):
+        counter = self._get(key, int(now // LOGIN_WINDOW))
+        if counter is None:
+            return 0
+        return _estimate(counter[1], counter[2], now)
+
+    async def hit(self, key, now):
+        window_id = int(now // LOGIN_WINDOW)
+        counter = self._get(key, window_id)
+        if counter is None:
+            counter = self.counters[key] = [window_id, 0, 0]
+            # Вытесняем самые давние ключи, чтобы атака с тысяч IP не съела память
+            while len(self.counters) > self.max_keys:
+                self.counters.popitem(last=False)
+        else:
+            self.counters.move_to_end(key)
+        counter[2] += 1
+
+    async def reset(self, key):
+        self.counters.pop(key, None)
+
+class SharedCounters:
+    """Те же окна в Postgres: лимит действует на все воркеры сразу"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def estimate(self, key, now):
+        window_id = int(now // LOGIN_WINDOW)
+        async with self.app['db_pool'].acquire() as conn:
+            rows = await conn.fetch(
+                'SELECT window_id, failures FROM admin_login_failures WHERE key = $1 AND window_id >= $2',
+                key, window_id - 1
+            )
+        counts = {row['window_id']: row['failures'] for row in rows}
+        return _estimate(counts.get(window_id - 1, 0), counts.get(window_id, 0), now)
+
+    async def hit(self, key, now):
+        window_id = int(now // LOGIN_WINDOW)
+        async with self.app['db_pool'].acquire() as conn:
+            await conn.execute('''
+                INSERT INTO admin_login_failures (key, window_id, failures) VALUES ($1, $2, 1)
+                ON CONFLICT (key, window_id) DO UPDATE SET failures = admin_login_failures.failures + 1
+            ''', key, window_id)
+
+    async def sweep(self, now):
+        """Удаляет окна, которые уже не участвуют в оценке"""
+        async with self.app['db_pool'].acquire() as conn:
+            await conn.execute(
+                'DELETE FROM admin_login_failures WHERE window_id < $1', int(now // LOGIN_WINDOW) - 1
+            )
+
+    async def reset(self, key):
+        async with self.app['db_pool'].acquire() as conn:
+            await conn.execute('DELETE FROM admin_login_failures WHERE key = $1', key)
+
+def client_ip(request):
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get('X-Forwarded-For')
+        if forwarded:
+            # Последний адрес добавлен ближайшим (нашим) прокси - его нельзя подделать
+            return forwarded.split(',')[-1].strip()
+    return request.remote
+
+def _retry_after(now):
+    # Оценка снижается по мере ухода предыдущего окна; до конца текущего окна - верхняя граница
+    return str(math.ceil(LOGIN_WINDOW - now % LOGIN_WINDOW))
+
+async def check_ip(app, ip):
+    """Блокировать ли IP; при ошибке счетчиков вход не блокируем"""
+    try:
+        return await app['login_throttle'].estimate(f'ip:{ip}', time.time()) >= LOGIN_MAX_PER_IP
+    except Exception as e:
+        logger.error(f"Error checking login throttle: {e}")
+        return False
+
+def _user_key(username):
+    return f'user:{username}'
+
+def _user_delay(failures):
+    excess = int(failures) - LOGIN_MAX_PER_USER
+    if excess < 0:
+        return 0
+    return min(LOGIN_USER_DELAY * 2 ** min(excess, 32), LOGIN_USER_MAX_DELAY)
+
+async def username_delay(app, username):
+    """Сколько секунд ждать перед проверкой пароля этого имени; при ошибке счетчиков - 0"""
+    try:
+        return _user_delay(await app['login_throttle'].estimate(_user_key(username), time.time()))
+    except Exception as e:
+        logger.error(f"Error checking login throttle: {e}")
+        return 0
+
+async def record_failure(app, ip, username):
+    now = time.time()
+    try:
+        await app['login_throttle'].hit(f'ip:{ip}', now)
+        if username:
+            await app['login_throttle'].hit(_user_key(username), now)
+    except Exception as e:
+        logger.error(f"Error recording login failure: {e}")
+
+async def record_success(app, username):
+    try:
+        await app['login_throttle'].reset(_user_key(username))
+    except Exception as e:
+        logger.error(f"Error resetting login throttle: {e}")
+
+# Middleware: отклоняем перебор паролей с одного IP до разбора формы
+@web.middleware
+async def login_throttle_middleware(request, handler):
+    if request.method == 'POST' and request.path == LOGIN_PATH:
+        ip = client_ip(request)
+        if await check_ip(request.app, ip):
+            logger.warning(f"Login throttled for {ip}")
+            raise web.HTTPTooManyRequests(
+                text='Слишком много попыток входа, повторите позже',
+                headers={'Retry-After': _retry_after(time.time())}
+            )
+    return await handler(request)
+
+async def periodic_throttle_sweep(counters):
+    while True:
+        await asyncio.sleep(LOGIN_WINDOW)
+        try:
+            await counters.sweep(time.time())
+        except Exception as e:
+            logger.error(f"Error sweeping login throttle counters: {e}")
+
+async def start_login_throttle(app):
+    app['login_throttle_task'] = None
+    if LOGIN_THROTTLE_SHARED:
+        async with app['db_pool'].acquire() as conn:
+            await conn.execute(THROTTLE_SCHEMA)
+        app['login_throttle'] = SharedCounters(app)
+        app['login_throttle_task'] = asyncio.create_task(periodic_throttle_sweep(app['login_throttle']))
+    else:
+        app['login_throttle'] = MemoryCounters()
+
+async def stop_login_throttle(app):
+    if app['login_throttle_task'] is not None:
+        app['login_throttle_task'].cancel()
+
+def setup_login_throttle(app):
+    app.on_startup.append(start_login_throttle)
+    app.on_cleanup.append(stop_login_throttle)
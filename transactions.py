@@ -1,13 +1,15 @@
 import logging
 from aiohttp import web
-import aiohttp_jinja2
+import statements
+from conditional import conditional_page
+from reference_data import invalidate
 
 logger = logging.getLogger(__name__)
 
 transactions_routes = web.RouteTableDef()
 
 @transactions_routes.get('/admin/transactions')
-@aiohttp_jinja2.template('transactions.html')
+@conditional_page('transactions.html', 'transactions', 'users')
 async def transactions_list(request):
     db_pool = request.app['db_pool']
     page = int(request.query.get('page', 1))
@@ -17,9 +19,7 @@ async def transactions_list(request):
     try:
         async with db_pool.acquire() as conn:
             # Проверяем существование таблицы transactions
-            table_exists = await conn.fetchval(
-                "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'transactions')"
-            )
+            table_exists = await statements.fetchval(conn, 'table_exists', 'transactions')
             
             if not table_exists:
                 return {
@@ -29,15 +29,9 @@ async def transactions_list(request):
                     'total_pages': 0
                 }
             
-            transactions = await conn.fetch('''
-                SELECT t.*, u.username, u.first_name 
-                FROM transactions t 
-                LEFT JOIN users u ON t.user_id = u.user_id 
-                ORDER BY t.created_at DESC 
-                LIMIT $1 OFFSET $2
-            ''', per_page, offset)
+            transactions = await statements.fetch(conn, 'transactions_page', per_page, offset)
             
-            total_transactions = await conn.fetchval('SELECT COUNT(*) FROM transactions')
+            total_transactions = await statements.fetchval(conn, 'transactions_count')
         
         return {
             'transactions': transactions,
@@ -73,6 +67,7 @@ async def cancel_transaction(request):
                     'UPDATE transactions SET status = $1 WHERE id = $2',
                     'canceled', transaction_id
                 )
+                await invalidate(request.app, conn, 'transactions')
         
         return web.HTTPFound('/admin/transactions')
     except Exception as e:
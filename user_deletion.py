@@ -0,0 +1,241 @@
+import os
+import time
+import asyncio
+import logging
+import asyncpg
+from aiohttp import web
+from database import get_pool
+from reference_data import invalidate, tracked_transaction
+from ledger import LEDGER_TABLES
+
+logger = logging.getLogger(__name__)
+
+# Пользователь, у которого связанных строк не больше этого, удаляется одной транзакцией;
+# у более крупного строки удаляются в фоне пачками по DELETE_BATCH_SIZE
+DELETE_INLINE_LIMIT = int(os.getenv('USER_DELETE_INLINE_LIMIT', 5000))
+DELETE_BATCH_SIZE = int(os.getenv('USER_DELETE_BATCH_SIZE', 1000))
+# Пауза между пачками: бот успевает взять блокировки, которых ждал
+DELETE_BATCH_PAUSE = float(os.getenv('USER_DELETE_BATCH_PAUSE', 0.05))
+# Сколько пачка ждет чужую блокировку, прежде чем отступить и повторить позже
+DELETE_LOCK_TIMEOUT = os.getenv('USER_DELETE_LOCK_TIMEOUT', '2s')
+DELETE_LOCK_RETRIES = 5
+
+MODES = ('delete', 'archive')
+
+# Связанные таблицы в порядке удаления; сам пользователь удаляется последним
+CHILD_TABLES = ('transactions', 'purchases')
+
+# Архивные таблицы повторяют исходные и добавляют время переноса. Бот может добавить
+# колонки в свои таблицы позже - их дописываем в архив (после archived_at), поэтому
+# перенос идет по явному списку колонок исходной таблицы, а не SELECT *
+ARCHIVE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS {table}_archive (LIKE {table} INCLUDING DEFAULTS);
+    ALTER TABLE {table}_archive ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+    CREATE INDEX IF NOT EXISTS idx_{table}_archive_user_id ON {table}_archive (user_id);
+'''
+
+COLUMNS_QUERY = '''
+    SELECT attname AS name, format_type(atttypid, atttypmod) AS type
+    FROM pg_attribute
+    WHERE attrelid = $1::regclass AND attnum > 0 AND NOT attisdropped
+    ORDER BY attnum
+'''
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _delete_query(table, mode, batched, columns=None):
+    # Пачка выбирается по ctid: это не требует первичного ключа и удаляется TID-сканом
+    if batched:
+        where = f'ctid = ANY(ARRAY(SELECT ctid FROM {table} WHERE user_id = $1 LIMIT $2))'
+    else:
+        where = 'user_id = $1'
+    if mode == 'archive':
+        column_list = ', '.join(_quote(column) for column in columns)
+        return f'''
+            WITH moved AS (DELETE FROM {table} WHERE {where} RETURNING *)
+            INSERT INTO {table}_archive ({column_list}) SELECT {column_list} FROM moved
+        '''
+    return f'DELETE FROM {table} WHERE {where}'
+
+def _rows(status):
+    # Статус asyncpg вида 'DELETE 1000' или 'INSERT 0 1000'
+    return int(status.split()[-1])
+
+def _lock_key(user_id):
+    return 'admin_delete_user', str(user_id)
+
+async def _try_lock(conn, user_id, xact=False):
+    function = 'pg_try_advisory_xact_lock' if xact else 'pg_try_advisory_lock'
+    return await conn.fetchval(
+        f'SELECT {function}(hashtext($1), hashtext($2))', *_lock_key(user_id)
+    )
+
+async def _unlock(conn, user_id):
+    await conn.execute('SELECT pg_advisory_unlock(hashtext($1), hashtext($2))', *_lock_key(user_id))
+
+# Журнал баланса удаляется в одной транзакции с пользователем: Telegram ID переиспользуются,
+# и история прежнего владельца смешалась бы с балансом нового (seq продолжился бы с прежнего).
+# Таблиц журнала может не быть, пока он не установлен
+async def _ledger_tables(conn):
+    return [table for table in LEDGER_TABLES if await conn.fetchval('SELECT to_regclass($1) IS NOT NULL', table)]
+
+async def ensure_archive_tables(conn):
+    """Создает архивные таблицы, дописывает в них новые колонки; возвращает колонки исходных таблиц"""
+    columns = {}
+    for table in CHILD_TABLES + ('users',) + tuple(await _ledger_tables(conn)):
+        await conn.execute(ARCHIVE_SCHEMA.format(table=table))
+        source = await conn.fetch(COLUMNS_QUERY, table)
+        archived = {row['name'] for row in await conn.fetch(COLUMNS_QUERY, f'{table}_archive')}
+        for column in source:
+            if column['name'] not in archived:
+                await conn.execute(
+                    f"ALTER TABLE {table}_archive ADD COLUMN IF NOT EXISTS {_quote(column['name'])} {column['type']}"
+                )
+                logger.info(f"Added column {column['name']} to {table}_archive")
+        columns[table] = [column['name'] for column in source]
+    return columns
+
+async def count_rows(conn, user_id):
+    counts = await conn.fetchrow(
+        'SELECT ' + ', '.join(
+            f'(SELECT COUNT(*) FROM {table} WHERE user_id = $1) AS {table}' for table in CHILD_TABLES
+        ),
+        user_id
+    )
+    return dict(counts)
+
+async def _delete_rest(conn, user_id, mode, columns):
+    """Удаляет оставшиеся связанные строки и самого пользователя; вызывается внутри транзакции"""
+    removed = {}
+    for table in CHILD_TABLES + ('users',) + tuple(await _ledger_tables(conn)):
+        query = _delete_query(table, mode, batched=False, columns=columns.get(table))
+        removed[table] = _rows(await conn.execute(query, user_id))
+    return removed
+
+async def delete_inline(app, conn, user_id, mode):
+    """Удаление одной транзакцией; None, если пользователя уже удаляет другой запрос"""
+    async with tracked_transaction(app, conn):
+        if not await _try_lock(conn, user_id, xact=True):
+            return None
+        columns = await ensure_archive_tables(conn) if mode == 'archive' else {}
+        removed = await _delete_rest(conn, user_id, mode, columns)
+        await invalidate(app, conn, 'users', *CHILD_TABLES)
+    return removed
+
+async def _batch(conn, table, user_id, mode, columns=None):
+    """Одна пачка в своей транзакции; при чужой блокировке повторяет после паузы"""
+    query = _delete_query(table, mode, batched=True, columns=columns)
+    for attempt in range(DELETE_LOCK_RETRIES):
+        try:
+            async with conn.transaction():
+                await conn.execute(f"SET LOCAL lock_timeout = '{DELETE_LOCK_TIMEOUT}'")
+                return _rows(await conn.execute(query, user_id, DELETE_BATCH_SIZE))
+        except asyncpg.exceptions.LockNotAvailableError:
+            await asyncio.sleep(DELETE_BATCH_PAUSE * 2 ** (attempt + 4))
+    raise RuntimeError(f'таблица {table} заблокирована дольше допустимого')
+
+async def delete_in_batches(app, job):
+    """Фоновое удаление пачками с отчетом о ходе в job"""
+    user_id = job['user_id']
+    try:
+        async with get_pool(app, 'background').acquire() as conn:
+            if not await _try_lock(conn, user_id):
+                job['status'] = 'failed'
+                job['error'] = 'пользователь уже удаляется другим процессом'
+                return
+            try:
+                columns = await ensure_archive_tables(conn) if job['mode'] == 'archive' else {}
+                for table in CHILD_TABLES:
+                    while True:
+                        removed = await _batch(conn, table, user_id, job['mode'], columns.get(table))
+                        job['done'][table] += removed
+                        if removed < DELETE_BATCH_SIZE:
+                            break
+                        await asyncio.sleep(DELETE_BATCH_PAUSE)
+
+                # Бот мог добавить строки, пока шли пачки - их добираем вместе с пользователем
+                async with tracked_transaction(app, conn):
+                    removed = await _delete_rest(conn, user_id, job['mode'], columns)
+                    await invalidate(app, conn, 'users', *CHILD_TABLES)
+                for table, count in removed.items():
+                    job['done'][table] = job['done'].get(table, 0) + count
+            finally:
+                await _unlock(conn, user_id)
+        job['status'] = 'done'
+        logger.info(f"Deleted user {user_id} in batches ({job['mode']}): {job['done']}")
+    except asyncio.CancelledError:
+        # Удаленные пачки уже зафиксированы, повторный запуск продолжит с оставшихся строк
+        job['status'] = 'cancelled'
+        raise
+    except Exception as e:
+        job['status'] = 'failed'
+        job['error'] = str(e)
+        logger.error(f"Error deleting user {user_id} in batches: {e}")
+    finally:
+        job['finished_at'] = time.time()
+
+async def delete_user_data(app, conn, user_id, mode='delete'):
+    """Удаляет или архивирует пользователя со связанными данными.
+
+    Возвращает ('done', удалено по таблицам), ('started', задание),
+    ('running', задание) или ('locked', None).
+    """
+    jobs = app['user_deletions']
+    job = jobs.get(user_id)
+    if job is not None and job['status'] == 'running':
+        return 'running', job
+
+    counts = await count_rows(conn, user_id)
+    if sum(counts.values()) <= DELETE_INLINE_LIMIT:
+        removed = await delete_inline(app, conn, user_id, mode)
+        return ('done', removed) if removed is not None else ('locked', None)
+
+    job = jobs[user_id] = {
+        'user_id': user_id,
+        'mode': mode,
+        'status': 'running',
+        'total': counts,
+        'done': {table: 0 for table in CHILD_TABLES},
+        'error': None,
+        'started_at': time.time(),
+        'finished_at': None
+    }
+    job['task'] = asyncio.create_task(delete_in_batches(app, job))
+    return 'started', job
+
+def _job_json(job):
+    return {key: value for key, value in job.items() if key != 'task'}
+
+user_deletion_routes = web.RouteTableDef()
+
+@user_deletion_routes.get('/admin/users/{user_id}/delete/status')
+async def deletion_status(request):
+    """Ход фонового удаления пользователя"""
+    user_id = int(request.match_info['user_id'])
+    job = request.app['user_deletions'].get(user_id)
+    if job is not None:
+        return web.json_response(_job_json(job))
+
+    # Задание могло выполняться в другом воркере - смотрим, остался ли пользователь
+    try:
+        async with request.app['db_pool'].acquire() as conn:
+            exists = await conn.fetchval('SELECT EXISTS (SELECT FROM users WHERE user_id = $1)', user_id)
+        return web.json_response({'user_id': user_id, 'status': 'unknown' if exists else 'done'})
+    except Exception as e:
+        logger.error(f"Error in deletion_status for user {user_id}: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+async def start_user_deletion(app):
+    app['user_deletions'] = {}
+
+async def stop_user_deletion(app):
+    for job in app['user_deletions'].values():
+        if job['status'] == 'running':
+            job['task'].cancel()
+
+def setup_user_deletion(app):
+    app.on_startup.append(start_user_deletion)
+    # Задание держит соединение между пачками: останавливаем его до закрытия пулов
+    app.on_shutdown.append(stop_user_deletion)
+    app.add_routes(user_deletion_routes)
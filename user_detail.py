@@ -0,0 +1,174 @@
+import asyncio
+import logging
+from datetime import datetime
+from aiohttp import web
+import aiohttp_jinja2
+import statements
+from database import get_pool, ensure_index
+from ledger import statement
+from cursors import encode_cursor, decode_cursor
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PAGE_SIZE = 25
+# Сводка считается не больше чем по стольким последним строкам:
+# у пользователя со 100 тысячами покупок страница все равно открывается сразу
+SUMMARY_CAP = 10000
+
+# Фрагменты истории: таблица, колонки и выражение времени для сортировки (по убыванию, затем id).
+# Время у бота бывает NULL: сравнение строк с NULL не дает ни true, ни false, и такие строки
+# выпадали бы из страниц после первой, поэтому ключ - время с заменой NULL на epoch, как в users.USER_SORTS
+HISTORY = {
+    'purchases': {
+        'table': 'purchases',
+        'columns': 'id, product, price, status, district, delivery_type, purchase_time',
+        'sort': "COALESCE(purchase_time, 'epoch'::timestamp)"
+    },
+    'transactions': {
+        'table': 'transactions',
+        'columns': 'id, amount, currency, status, invoice_uuid, created_at',
+        'sort': "COALESCE(created_at, 'epoch'::timestamp)"
+    }
+}
+HISTORY_KEY = (('sort_time', datetime.fromisoformat), ('id', int))
+
+# История пользователя читается по (user_id, время, id) - составные индексы
+# дают и фильтр, и порядок, а страница - это короткий обратный проход по индексу
+HISTORY_INDEXES = {
+    'idx_purchases_user_time': f"purchases (user_id, ({HISTORY['purchases']['sort']}), id)",
+    'idx_transactions_user_time': f"transactions (user_id, ({HISTORY['transactions']['sort']}), id)"
+}
+
+def _history_query(kind, with_cursor):
+    history = HISTORY[kind]
+    sort = history['sort']
+    query = f"SELECT {history['columns']}, {sort} AS sort_time FROM {history['table']} WHERE user_id = $1"
+    if with_cursor:
+        query += f" AND ({sort}, id) < ($3, $4)"
+    return query + f" ORDER BY {sort} DESC, id DESC LIMIT $2"
+
+async def create_history_indexes(app):
+    """Создает индексы истории пользователя, если их еще нет (в фоне, без блокировки таблиц)"""
+    try:
+        async with get_pool(app, 'background').acquire() as conn:
+            # Индексы строит только один воркер
+            if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext('admin_user_history_indexes'))"):
+                return
+            try:
+                for name, definition in HISTORY_INDEXES.items():
+                    table = definition.split()[0]
+                    if not await statements.fetchval(conn, 'table_exists', table):
+                        continue
+                    if await ensure_index(conn, name, definition):
+                        logger.info(f"Created index {name}")
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock(hashtext('admin_user_history_indexes'))")
+    except Exception as e:
+        logger.error(f"Error creating user history indexes: {e}")
+
+async def user_summary(conn, user_id):
+    """Сводка по последним SUMMARY_CAP покупкам и транзакциям"""
+    return await conn.fetchrow(f'''
+        SELECT p.purchases, p.spent, p.last_purchase,
+               t.transactions, t.deposited, t.pending, t.last_transaction
+        FROM (
+            SELECT COUNT(*) AS purchases, COALESCE(SUM(price), 0) AS spent, MAX(purchase_time) AS last_purchase
+            FROM (
+                SELECT price, purchase_time FROM purchases
+                WHERE user_id = $1
+                ORDER BY {HISTORY['purchases']['sort']} DESC
+                LIMIT $2
+            ) recent
+        ) p, (
+            SELECT COUNT(*) AS transactions,
+                   COALESCE(SUM(amount) FILTER (WHERE status = 'paid'), 0) AS deposited,
+                   COUNT(*) FILTER (WHERE status = 'pending') AS pending,
+                   MAX(created_at) AS last_transaction
+            FROM (
+                SELECT amount, status, created_at FROM transactions
+                WHERE user_id = $1
+                ORDER BY {HISTORY['transactions']['sort']} DESC
+                LIMIT $2
+            ) recent
+        ) t
+    ''', user_id, SUMMARY_CAP)
+
+async def history_page(conn, kind, user_id, cursor=None):
+    """Страница истории и курсор следующей (None - страница последняя); ValueError на битом курсоре"""
+    if kind == 'balance':
+        before_seq = int(cursor) if cursor else None
+        rows = await statement(conn, user_id, limit=HISTORY_PAGE_SIZE + 1, before_seq=before_seq)
+        if len(rows) > HISTORY_PAGE_SIZE:
+            rows = rows[:HISTORY_PAGE_SIZE]
+            return rows, str(rows[-1]['seq'])
+        return rows, None
+
+    key_values = decode_cursor(cursor, HISTORY_KEY) if cursor else []
+    # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+    rows = await conn.fetch(
+        _history_query(kind, bool(key_values)), user_id, HISTORY_PAGE_SIZE + 1, *key_values
+    )
+    if len(rows) > HISTORY_PAGE_SIZE:
+        rows = rows[:HISTORY_PAGE_SIZE]
+        return rows, encode_cursor([rows[-1][name] for name, _ in HISTORY_KEY])
+    return rows, None
+
+user_detail_routes = web.RouteTableDef()
+
+@user_detail_routes.get(r'/admin/users/{user_id:\d+}')
+@aiohttp_jinja2.template('user_detail.html')
+async def user_detail(request):
+    user_id = int(request.match_info['user_id'])
+    try:
+        async with request.app['db_pool'].acquire() as conn:
+            user = await conn.fetchrow('SELECT * FROM users WHERE user_id = $1', user_id)
+            if user is None:
+                raise web.HTTPFound('/admin/users?error=Пользователь не найден')
+            summary = await user_summary(conn, user_id)
+        return {
+            'user': user,
+            'summary': summary,
+            'summary_cap': SUMMARY_CAP
+        }
+    except web.HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in user_detail for user {user_id}: {e}")
+        return {
+            'error': f'Ошибка загрузки пользователя: {e}',
+            'user': None,
+            'summary': None,
+            'summary_cap': SUMMARY_CAP
+        }
+
+@user_detail_routes.get(r'/admin/users/{user_id:\d+}/history/{kind:purchases|transactions|balance}')
+async def user_history(request):
+    """Фрагмент истории: строки таблицы, курсор следующей страницы - в X-Next-Cursor"""
+    user_id = int(request.match_info['user_id'])
+    kind = request.match_info['kind']
+    cursor = request.query.get('cursor')
+
+    try:
+        async with request.app['db_pool'].acquire() as conn:
+            rows, next_cursor = await history_page(conn, kind, user_id, cursor)
+    except ValueError:
+        return web.Response(text='Некорректный курсор', status=400)
+    except Exception as e:
+        logger.error(f"Error in user_history {kind} for user {user_id}: {e}")
+        return web.Response(text=f'Ошибка загрузки истории: {e}', status=500)
+
+    response = aiohttp_jinja2.render_template('user_history_rows.html', request, {'kind': kind, 'rows': rows})
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+async def start_history_indexes(app):
+    app['history_indexes_task'] = asyncio.create_task(create_history_indexes(app))
+
+async def stop_history_indexes(app):
+    app['history_indexes_task'].cancel()
+
+def setup_user_detail(app):
+    app.on_startup.append(start_history_indexes)
+    app.on_cleanup.append(stop_history_indexes)
+    app.add_routes(user_detail_routes)
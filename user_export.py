@@ -0,0 +1,103 @@
+import logging
+from datetime import datetime
+from aiohttp import web
+from database import get_pool
+from compression import enable_stream_compression
+from users import parse_user_filters, USER_COLUMNS, USER_SORTS, DEFAULT_SORT
+from admin_api import dumps
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('csv', 'json')
+# Строк на одну запись в ответ для JSON: курсор читает по столько же
+JSON_BATCH = 1000
+
+def _export_query(request, columns):
+    """SELECT выгрузки с фильтрами и сортировкой списка пользователей; ValueError - плохие параметры"""
+    conditions, params = parse_user_filters(request.query)
+    sort = request.query.get('sort', DEFAULT_SORT)
+    if sort not in USER_SORTS:
+        sort = DEFAULT_SORT
+    direction = 'ASC' if request.query.get('order') == 'asc' else 'DESC'
+
+    query = f"SELECT {', '.join(columns)} FROM users"
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += f' ORDER BY {USER_SORTS[sort][0]} {direction}, user_id {direction}'
+    return query, params
+
+def _parse_columns(request):
+    columns = request.query.get('columns')
+    if not columns:
+        return list(USER_COLUMNS)
+    selected = []
+    for name in columns.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in USER_COLUMNS:
+            raise ValueError(f'Неизвестная колонка: {name}')
+        if name not in selected:
+            selected.append(name)
+    return selected or list(USER_COLUMNS)
+
+async def _stream_csv(conn, response, query, params):
+    # COPY отдает CSV прямо из Postgres; asyncpg дожидается записи каждого
+    # фрагмента в сокет, так что медленный клиент не копит данные в памяти
+    await conn.copy_from_query(query, *params, output=response.write, format='csv', header=True)
+
+async def _stream_json(conn, response, query, params):
+    # Серверный курсор: в памяти не больше одной пачки строк
+    await response.write(b'[')
+    batch = []
+    first = True
+    async with conn.transaction():
+        async for record in conn.cursor(query, *params, prefetch=JSON_BATCH):
+            batch.append(dumps(record))
+            if len(batch) >= JSON_BATCH:
+                await response.write((b'' if first else b',') + b','.join(batch))
+                first = False
+                batch = []
+    if batch:
+        await response.write((b'' if first else b',') + b','.join(batch))
+    await response.write(b']')
+
+user_export_routes = web.RouteTableDef()
+
+@user_export_routes.get('/admin/users/export')
+async def export_users(request):
+    """Выгрузка пользователей в CSV/JSON: ?format=, ?columns=a,b и фильтры списка пользователей"""
+    export_format = request.query.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return web.json_response({'error': 'Формат выгрузки: csv или json'}, status=400)
+    try:
+        columns = _parse_columns(request)
+        query, params = _export_query(request, columns)
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+
+    filename = f"users_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    response = web.StreamResponse()
+    response.headers['Content-Type'] = 'text/csv; charset=utf-8' if export_format == 'csv' else 'application/json'
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+
+    # Выгрузка держит соединение долго - берем его из полосы пула для выгрузок,
+    # чтобы не занимать ни интерактивные соединения, ни фоновые задачи
+    try:
+        async with get_pool(request.app, 'export').acquire() as conn:
+            enable_stream_compression(request, response)
+            await response.prepare(request)
+            if export_format == 'csv':
+                await _stream_csv(conn, response, query, params)
+            else:
+                await _stream_json(conn, response, query, params)
+        await response.write_eof()
+    except ConnectionResetError:
+        logger.info("User export aborted by client")
+    except Exception as e:
+        logger.error(f"Error in export_users: {e}")
+        if not response.prepared:
+            return web.json_response({'error': f'Ошибка выгрузки: {e}'}, status=500)
+        # Заголовки уже отправлены - обрываем ответ, чтобы клиент не принял неполный файл
+        raise
+    return response
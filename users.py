@@ -1,23 +1,180 @@
+import re
+import math
+import asyncio
 import logging
 from aiohttp import web
-import aiohttp_jinja2
-from datetime import datetime, timedelta
+import statements
+from database import get_pool, ensure_index
+from conditional import conditional_page
+from reference_data import invalidate, tracked_transaction
+from ledger import set_balance_context
+from user_deletion import delete_user_data
+from cohorts import cohort_report, DASHBOARD_COHORTS, DASHBOARD_WEEKS
+from cursors import encode_cursor, decode_cursor
+from decimal import Decimal
+from datetime import date, datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+# Поиск пользователей: подстрока в username/first_name или точный user_id.
+# Подстроку ищет GIN-индекс pg_trgm по этому выражению - в запросах оно
+# должно совпадать с выражением индекса символ в символ
+SEARCH_EXPRESSION = "(coalesce(username, '') || ' ' || coalesce(first_name, ''))"
+# Короче трех символов триграмм нет и индекс не помогает
+SEARCH_MIN_LENGTH = 3
+TYPEAHEAD_LIMIT = 10
+TYPEAHEAD_MAX_LIMIT = 20
+
+SEARCH_INDEX_NAME = 'idx_users_search_trgm'
+SEARCH_INDEX = f'users USING gin ({SEARCH_EXPRESSION} gin_trgm_ops)'
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def build_search(q, first_param=1):
+    """Условие WHERE для поиска и его параметры; None, если запрос слишком короткий"""
+    q = q.strip()
+    conditions = []
+    params = []
+    
+    # user_id - bigint, более длинные числа заведомо не совпадут
+    if q.isdigit() and len(q) <= 18:
+        params.append(int(q))
+        conditions.append(f'user_id = ${first_param + len(params) - 1}')
+    
+    if len(q) >= SEARCH_MIN_LENGTH:
+        params.append(f'%{_escape_like(q)}%')
+        conditions.append(f'{SEARCH_EXPRESSION} ILIKE ${first_param + len(params) - 1}')
+    
+    if not conditions:
+        return None
+    return '(' + ' OR '.join(conditions) + ')', params
+
+# Колонки users, которые отдают API и выгрузка
+USER_COLUMNS = ('user_id', 'username', 'first_name', 'balance', 'discount', 'purchase_count', 'ban_until', 'created_at')
+
+# Фильтры списка: параметр запроса -> (условие, разбор значения). Условие
+# с {} получает номер параметра SQL, без разбора - это флаг (?banned=1)
+USER_FILTERS = {
+    'banned': ('ban_until > now()', None),
+    'balance_min': ('COALESCE(balance, 0) > ${}', float),
+    'has_discount': ('discount > 0', None),
+    'registered_from': ('created_at >= ${}::date', date.fromisoformat),
+    'registered_to': ('created_at < ${}::date + 1', date.fromisoformat),
+    'purchases_min': ('COALESCE(purchase_count, 0) > ${}', int)
+}
+
+# Сортировки: имя -> (выражение, разбор значения из курсора). Выражения
+# не бывают NULL (иначе сравнение строк в курсоре теряет записи) и совпадают
+# с выражениями индексов; user_id в конце ключа делает порядок однозначным
+USER_SORTS = {
+    'created_at': ("COALESCE(created_at, 'epoch'::timestamp)", datetime.fromisoformat),
+    'balance': ('COALESCE(balance, 0)', Decimal),
+    'purchase_count': ('COALESCE(purchase_count, 0)', int)
+}
+DEFAULT_SORT = 'created_at'
+
+USER_INDEXES = {
+    'idx_users_created_sort': f"users (({USER_SORTS['created_at'][0]}), user_id)",
+    'idx_users_balance_sort': f"users (({USER_SORTS['balance'][0]}), user_id)",
+    'idx_users_purchases_sort': f"users (({USER_SORTS['purchase_count'][0]}), user_id)",
+    # Заблокированных и пользователей со скидкой мало - частичные индексы маленькие
+    'idx_users_banned': 'users (ban_until) WHERE ban_until IS NOT NULL',
+    'idx_users_discount': 'users (discount) WHERE discount > 0'
+}
+
+def parse_user_filters(query, first_param=1):
+    """Условия WHERE и параметры из поиска ?q= и фильтров; пустые параметры пропускаются.
+    ValueError - некорректное значение фильтра или слишком короткий поиск"""
+    conditions = []
+    params = []
+    
+    q = query.get('q', '').strip()
+    if q:
+        search = build_search(q, first_param)
+        if search is None:
+            raise ValueError(f'Введите не меньше {SEARCH_MIN_LENGTH} символов или ID пользователя')
+        conditions.append(search[0])
+        params += search[1]
+    
+    for name, (condition, parse) in USER_FILTERS.items():
+        value = query.get(name, '').strip()
+        if not value:
+            continue
+        if parse is not None:
+            try:
+                params.append(parse(value))
+            except ValueError:
+                raise ValueError(f'Некорректное значение фильтра {name}: {value}')
+            condition = condition.format(first_param + len(params) - 1)
+        conditions.append(condition)
+    return conditions, params
+
+def build_users_query(conditions, sort, descending, with_cursor, next_param):
+    """SELECT страницы пользователей. Параметры фильтров идут первыми, следом
+    (с номера next_param) значения курсора - выражение сортировки и user_id, и последним лимит"""
+    expression = USER_SORTS[sort][0]
+    conditions = list(conditions)
+    if with_cursor:
+        conditions.append(
+            f"({expression}, user_id) {'<' if descending else '>'} (${next_param}, ${next_param + 1})"
+        )
+        next_param += 2
+    
+    query = f'SELECT *, {expression} AS sort_value FROM users'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    direction = 'DESC' if descending else 'ASC'
+    return query + f' ORDER BY {expression} {direction}, user_id {direction} LIMIT ${next_param}'
+
+async def create_user_indexes(app):
+    """Создает индексы поиска, сортировок и фильтров, если их еще нет (в фоне, без блокировки таблицы)"""
+    try:
+        async with get_pool(app, 'background').acquire() as conn:
+            if not await statements.fetchval(conn, 'table_exists', 'users'):
+                return
+            
+            # Индексы строит только один воркер
+            if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext('admin_users_search_index'))"):
+                return
+            try:
+                for name, definition in USER_INDEXES.items():
+                    try:
+                        if await ensure_index(conn, name, definition):
+                            logger.info(f"Created index {name}")
+                    except Exception as e:
+                        logger.error(f"Error creating index {name}: {e}")
+                
+                await conn.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                if await ensure_index(conn, SEARCH_INDEX_NAME, SEARCH_INDEX):
+                    logger.info("Created trigram index for user search")
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock(hashtext('admin_users_search_index'))")
+    except Exception as e:
+        # Без индекса поиск работает, но последовательным сканированием
+        logger.error(f"Error creating user search index: {e}")
+
+async def start_user_indexes(app):
+    app['user_indexes_task'] = asyncio.create_task(create_user_indexes(app))
+
+async def stop_user_indexes(app):
+    app['user_indexes_task'].cancel()
+
+def setup_user_indexes(app):
+    app.on_startup.append(start_user_indexes)
+    app.on_cleanup.append(stop_user_indexes)
+
 users_routes = web.RouteTableDef()
 
 @users_routes.get('/admin/dashboard')
-@aiohttp_jinja2.template('dashboard.html')
+@conditional_page('dashboard.html', 'users', 'purchases', 'transactions', 'cohort_sizes', 'cohort_activity', daily=True)
 async def dashboard(request):
     db_pool = request.app['db_pool']
     
     try:
         async with db_pool.acquire() as conn:
             # Проверяем существование таблиц
-            users_table_exists = await conn.fetchval(
-                "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'users')"
-            )
+            users_table_exists = await statements.fetchval(conn, 'table_exists', 'users')
             
             if not users_table_exists:
                 return {
@@ -32,23 +189,24 @@ async def dashboard(request):
                     'today_revenue': 0,
                     'recent_orders': [],
                     'recent_transactions': [],
-                    'active_users': []
+                    'cohorts': [],
+                    'cohort_weeks': DASHBOARD_WEEKS
                 }
             
             # Статистика пользователей
-            total_users = await conn.fetchval('SELECT COUNT(*) FROM users')
+            total_users = await statements.fetchval(conn, 'users_count')
             today_users = await conn.fetchval(
                 'SELECT COUNT(*) FROM users WHERE created_at >= CURRENT_DATE'
             )
             
             # Статистика заказов
-            total_orders = await conn.fetchval('SELECT COUNT(*) FROM purchases')
+            total_orders = await statements.fetchval(conn, 'orders_count')
             today_orders = await conn.fetchval(
                 'SELECT COUNT(*) FROM purchases WHERE purchase_time >= CURRENT_DATE'
             )
             
             # Статистика транзакций
-            total_transactions = await conn.fetchval('SELECT COUNT(*) FROM transactions')
+            total_transactions = await statements.fetchval(conn, 'transactions_count')
             pending_transactions = await conn.fetchval(
                 'SELECT COUNT(*) FROM transactions WHERE status = $1',
                 'pending'
@@ -81,14 +239,8 @@ async def dashboard(request):
                 LIMIT 10
             ''')
             
-            # Активные пользователи (используем created_at вместо last_purchase)
-            active_users = await conn.fetch('''
-                SELECT user_id, username, first_name, created_at,
-                       purchase_count, balance
-                FROM users 
-                ORDER BY created_at DESC
-                LIMIT 10
-            ''')
+            # Удержание последних когорт - из сводок, без обхода users и purchases
+            cohorts = await cohort_report(conn, DASHBOARD_COHORTS, DASHBOARD_WEEKS)
         
         return {
             'total_users': total_users,
@@ -101,7 +253,8 @@ async def dashboard(request):
             'today_revenue': today_revenue,
             'recent_orders': recent_orders,
             'recent_transactions': recent_transactions,
-            'active_users': active_users
+            'cohorts': cohorts,
+            'cohort_weeks': DASHBOARD_WEEKS
         }
     except Exception as e:
         import logging
@@ -119,55 +272,208 @@ async def dashboard(request):
             'today_revenue': 0,
             'recent_orders': [],
             'recent_transactions': [],
-            'active_users': []
+            'cohorts': [],
+            'cohort_weeks': DASHBOARD_WEEKS
         }
 
+def _list_params(query):
+    """Параметры фильтров и сортировки из запроса - для ссылок пагинации и формы массовых действий"""
+    names = ('q', *USER_FILTERS, 'sort', 'order')
+    return {name: query[name] for name in names if query.get(name, '').strip()}
+
 @users_routes.get('/admin/users')
-@aiohttp_jinja2.template('users.html')
+@conditional_page('users.html', 'users')
 async def users_list(request):
     db_pool = request.app['db_pool']
-    page = int(request.query.get('page', 1))
     per_page = 20
-    offset = (page - 1) * per_page
+    sort = request.query.get('sort', DEFAULT_SORT)
+    if sort not in USER_SORTS:
+        sort = DEFAULT_SORT
+    descending = request.query.get('order', 'desc') != 'asc'
+    cursor = request.query.get('cursor')
+    list_params = _list_params(request.query)
+    context = {
+        'users': [],
+        'total_users': 0,
+        'next_cursor': None,
+        'cursor': cursor,
+        'filters': list_params,
+        'sorts': list(USER_SORTS),
+        'export_columns': USER_COLUMNS,
+        'q': list_params.get('q', ''),
+        'message': request.query.get('message'),
+        'error': request.query.get('error')
+    }
+    
+    try:
+        conditions, params = parse_user_filters(request.query)
+    except ValueError as e:
+        context['error'] = str(e)
+        return context
+    try:
+        key_values = decode_cursor(cursor, (('sort_value', USER_SORTS[sort][1]), ('user_id', int))) if cursor else []
+    except ValueError:
+        context['error'] = 'Некорректная ссылка на страницу'
+        return context
     
     try:
         async with db_pool.acquire() as conn:
             # Проверяем существование таблицы users
-            table_exists = await conn.fetchval(
-                "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'users')"
-            )
+            table_exists = await statements.fetchval(conn, 'table_exists', 'users')
             
             if not table_exists:
-                return {
-                    'error': 'Таблица пользователей не создана. Запустите сначала основного бота.',
-                    'users': [],
-                    'page': 1,
-                    'total_pages': 0
-                }
-            
-            users = await conn.fetch('''
-                SELECT * FROM users 
-                ORDER BY created_at DESC 
-                LIMIT $1 OFFSET $2
-            ''', per_page, offset)
+                context['error'] = 'Таблица пользователей не создана. Запустите сначала основного бота.'
+                return context
             
-            total_users = await conn.fetchval('SELECT COUNT(*) FROM users')
+            query = build_users_query(conditions, sort, descending, bool(key_values), len(params) + 1)
+            # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+            users = await conn.fetch(query, *params, *key_values, per_page + 1)
+            if conditions:
+                total_users = await conn.fetchval(
+                    'SELECT COUNT(*) FROM users WHERE ' + ' AND '.join(conditions), *params
+                )
+            else:
+                total_users = await statements.fetchval(conn, 'users_count')
         
-        return {
-            'users': users,
-            'page': page,
-            'total_pages': (total_users + per_page - 1) // per_page
-        }
+        if len(users) > per_page:
+            users = users[:per_page]
+            context['next_cursor'] = encode_cursor([users[-1]['sort_value'], users[-1]['user_id']])
+        context['users'] = users
+        context['total_users'] = total_users
+        return context
     except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"Error in users_list: {e}")
-        return {
-            'error': f'Ошибка загрузки пользователей: {e}',
-            'users': [],
-            'page': 1,
-            'total_pages': 0
-        }
+        context['error'] = f'Ошибка загрузки пользователей: {e}'
+        return context
+
+@users_routes.get('/admin/users/search')
+async def users_typeahead(request):
+    """Подсказки для поля поиска: несколько пользователей, сначала совпадения с начала строки"""
+    q = request.query.get('q', '')
+    try:
+        limit = max(1, min(int(request.query.get('limit', TYPEAHEAD_LIMIT)), TYPEAHEAD_MAX_LIMIT))
+    except ValueError:
+        limit = TYPEAHEAD_LIMIT
+    
+    search = build_search(q, first_param=3)
+    if search is None:
+        return web.json_response({'users': []})
+    condition, params = search
+    
+    try:
+        async with request.app['db_pool'].acquire() as conn:
+            users = await conn.fetch(f'''
+                SELECT user_id, username, first_name
+                FROM users
+                WHERE {condition}
+                ORDER BY strpos(lower({SEARCH_EXPRESSION}), lower($2)), created_at DESC
+                LIMIT $1
+            ''', limit, q.strip(), *params)
+        return web.json_response({'users': [dict(user) for user in users]})
+    except Exception as e:
+        logger.error(f"Error in users_typeahead: {e}")
+        return web.json_response({'users': [], 'error': str(e)}, status=500)
+
+BULK_ACTIONS = {
+    'ban': 'заблокировано',
+    'unban': 'разблокировано',
+    'balance': 'изменен баланс',
+    'discount': 'изменена скидка'
+}
+
+BIGINT_MAX = 2 ** 63 - 1
+
+def _parse_user_ids(text):
+    # ID в любом виде: через запятую, по строкам, первым столбцом CSV.
+    # Число целиком: длинное значение не режем на куски - это не ID, а мусор вне BIGINT
+    return {int(value) for value in re.findall(r'\b\d+\b', text) if int(value) <= BIGINT_MAX}
+
+def _bulk_user_ids(data):
+    """ID из отмеченных строк и загруженного файла"""
+    user_ids = set()
+    for value in data.getall('user_ids', []):
+        user_ids.update(_parse_user_ids(value))
+    
+    upload = data.get('ids_file')
+    if isinstance(upload, web.FileField):
+        user_ids.update(_parse_user_ids(upload.file.read().decode('utf-8', errors='ignore')))
+    return sorted(user_ids)
+
+def _bulk_set_clause(action, data):
+    """SET-часть UPDATE и ее параметры (нумерация с $1)"""
+    if action == 'ban':
+        return 'ban_until = $1', [datetime.now() + timedelta(hours=24)]
+    if action == 'unban':
+        return 'ban_until = NULL', []
+    if action == 'balance':
+        amount = float(data['amount'])
+        # float() принимает 'nan' и 'inf' - такой баланс уже не исправить сложением
+        if not math.isfinite(amount):
+            raise ValueError(f'amount must be finite: {amount}')
+        if 'is_subtract' in data:
+            amount = -amount
+        return 'balance = balance + $1', [amount]
+    if action == 'discount':
+        discount = int(data['discount'])
+        if not 0 <= discount <= 100:
+            raise ValueError('discount must be between 0 and 100')
+        return 'discount = $1', [discount]
+    raise ValueError(f'unknown action {action}')
+
+@users_routes.post('/admin/users/bulk')
+async def bulk_update_users(request):
+    """Массовое изменение пользователей одним UPDATE: по отмеченным/загруженным ID или по текущим фильтрам"""
+    db_pool = request.app['db_pool']
+    data = await request.post()
+    action = data.get('action')
+    scope = data.get('scope', 'ids')
+    
+    if action not in BULK_ACTIONS:
+        return web.HTTPFound('/admin/users?error=Неизвестное массовое действие')
+    
+    try:
+        set_clause, params = _bulk_set_clause(action, data)
+    except (KeyError, ValueError):
+        return web.HTTPFound('/admin/users?error=Некорректные параметры массового действия')
+    
+    if scope == 'filter':
+        try:
+            conditions, filter_params = parse_user_filters(data, first_param=len(params) + 1)
+        except ValueError as e:
+            return web.HTTPFound(f'/admin/users?error={e}')
+        if not conditions:
+            return web.HTTPFound('/admin/users?error=Для действия по фильтру нужен поиск или фильтр')
+        query = f'UPDATE users SET {set_clause} WHERE ' + ' AND '.join(conditions)
+        params += filter_params
+        requested = None
+    else:
+        user_ids = _bulk_user_ids(data)
+        if not user_ids:
+            return web.HTTPFound('/admin/users?error=Не выбрано ни одного пользователя')
+        query = f'''
+            UPDATE users u SET {set_clause}
+            FROM unnest(${len(params) + 1}::bigint[]) AS ids(user_id)
+            WHERE u.user_id = ids.user_id
+        '''
+        params.append(user_ids)
+        requested = len(user_ids)
+    
+    try:
+        async with db_pool.acquire() as conn:
+            async with tracked_transaction(request.app, conn):
+                if action == 'balance':
+                    await set_balance_context(conn, 'admin_bulk', request['user']['username'])
+                status = await conn.execute(query, *params)
+                await invalidate(request.app, conn, 'users')
+        
+        updated = int(status.split()[-1])
+        message = f'{BULK_ACTIONS[action].capitalize()}: {updated} польз.'
+        if requested is not None and requested != updated:
+            message += f' (не найдено: {requested - updated})'
+        return web.HTTPFound(f'/admin/users?message={message}')
+    except Exception as e:
+        logger.error(f"Error in bulk {action} for users: {e}")
+        return web.HTTPFound('/admin/users?error=Ошибка при массовом изменении пользователей')
 
 @users_routes.post('/admin/users/{user_id}/ban')
 async def ban_user(request):
@@ -182,6 +488,7 @@ async def ban_user(request):
                 'UPDATE users SET ban_until = $1 WHERE user_id = $2',
                 ban_until, user_id
             )
+            await invalidate(request.app, conn, 'users')
         
         return web.HTTPFound('/admin/users?message=Пользователь заблокирован')
     except Exception as e:
@@ -199,6 +506,7 @@ async def unban_user(request):
                 'UPDATE users SET ban_until = NULL WHERE user_id = $1',
                 user_id
             )
+            await invalidate(request.app, conn, 'users')
         
         return web.HTTPFound('/admin/users?message=Пользователь разблокирован')
     except Exception as e:
@@ -216,16 +524,20 @@ async def change_balance(request):
         is_subtract = 'is_subtract' in data
         
         async with db_pool.acquire() as conn:
-            if is_subtract:
-                await conn.execute(
-                    'UPDATE users SET balance = balance - $1 WHERE user_id = $2',
-                    amount, user_id
-                )
-            else:
-                await conn.execute(
-                    'UPDATE users SET balance = balance + $1 WHERE user_id = $2',
-                    amount, user_id
-                )
+            async with tracked_transaction(request.app, conn):
+                # Запись в журнале баланса делает триггер, здесь только причина и автор
+                await set_balance_context(conn, 'admin', request['user']['username'])
+                if is_subtract:
+                    await conn.execute(
+                        'UPDATE users SET balance = balance - $1 WHERE user_id = $2',
+                        amount, user_id
+                    )
+                else:
+                    await conn.execute(
+                        'UPDATE users SET balance = balance + $1 WHERE user_id = $2',
+                        amount, user_id
+                    )
+                await invalidate(request.app, conn, 'users')
         
         action = "вычтена из" if is_subtract else "добавлена к"
         return web.HTTPFound(f'/admin/users?message=${amount} {action} балансу пользователя')
@@ -257,6 +569,7 @@ async def change_discount(request):
                     'UPDATE users SET discount = $1 WHERE user_id = $2',
                     discount, user_id
                 )
+            await invalidate(request.app, conn, 'users')
         
         discount_type = "временная" if is_temporary else "постоянная"
         return web.HTTPFound(f'/admin/users?message={discount_type.capitalize()} скидка установлена на {discount}%')
@@ -270,15 +583,22 @@ async def delete_user(request):
     db_pool = request.app['db_pool']
     
     try:
+        data = await request.post()
+        mode = 'archive' if data.get('archive') else 'delete'
+        
         async with db_pool.acquire() as conn:
-            # Удаляем связанные данные пользователя
-            await conn.execute('DELETE FROM transactions WHERE user_id = $1', user_id)
-            await conn.execute('DELETE FROM purchases WHERE user_id = $1', user_id)
-            
-            # Удаляем самого пользователя
-            await conn.execute('DELETE FROM users WHERE user_id = $1', user_id)
+            # Небольшой пользователь удаляется сразу одной транзакцией, крупный - в фоне пачками
+            state, _ = await delete_user_data(request.app, conn, user_id, mode)
         
-        return web.HTTPFound('/admin/users?message=Пользователь полностью удален')
+        if state == 'done':
+            message = 'Пользователь перенесен в архив' if mode == 'archive' else 'Пользователь полностью удален'
+            return web.HTTPFound(f'/admin/users?message={message}')
+        if state in ('started', 'running'):
+            return web.HTTPFound(
+                f'/admin/users?message=Удаление пользователя {user_id} выполняется в фоне, '
+                f'ход: /admin/users/{user_id}/delete/status'
+            )
+        return web.HTTPFound('/admin/users?error=Пользователь уже удаляется')
     except Exception as e:
         logger.error(f"Error deleting user {user_id}: {e}")
         return web.HTTPFound('/admin/users?error=Ошибка при удалении пользователя')
@@ -0,0 +1,138 @@
+import os
+import time
+import signal
+import logging
+import multiprocessing
+import server
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать, пока новый воркер начнет принимать соединения
+WORKER_READY_TIMEOUT = float(os.environ.get('ADMIN_WORKER_READY_TIMEOUT', 30))
+# Сколько ждать корректного завершения старого воркера перед SIGKILL: воркер сам
+# ждет открытые запросы (SSE) до server.SHUTDOWN_TIMEOUT, поэтому даем ему запас сверх этого
+WORKER_SHUTDOWN_TIMEOUT = float(
+    os.environ.get('ADMIN_WORKER_SHUTDOWN_TIMEOUT', server.SHUTDOWN_TIMEOUT + 10)
+)
+# Воркер, упавший быстрее этого после запуска, перезапускается с растущей паузой
+# (1, 2, 4... до WORKER_MAX_BACKOFF секунд); после WORKER_MAX_FAST_EXITS таких падений
+# подряд супервизор останавливается - например, при незаданном DATABASE_URL
+WORKER_FAST_EXIT = float(os.environ.get('ADMIN_WORKER_FAST_EXIT', 10))
+WORKER_MAX_BACKOFF = 60
+WORKER_MAX_FAST_EXITS = int(os.environ.get('ADMIN_WORKER_MAX_FAST_EXITS', 5))
+
+def _run_worker(worker_id, ready):
+    """Точка входа процесса-воркера: своя копия приложения и свои пулы БД"""
+    os.environ['ADMIN_WORKER_ID'] = str(worker_id)
+    from main import main
+    server.run(main(ready=ready, reuse_port=True))
+
+class Supervisor:
+    """Запускает N процессов с SO_REUSEPORT, перезапускает упавшие.
+
+    SIGHUP - поочередный (rolling) перезапуск воркеров без простоя,
+    SIGTERM/SIGINT - корректная остановка всех воркеров.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.context = multiprocessing.get_context('spawn')
+        self.processes = []
+        self.started = []
+        self.fast_exits = []
+        self.respawn_at = []
+        self.stopping = False
+        self.failed = False
+        self.restart_requested = False
+
+    def _spawn(self, worker_id):
+        ready = self.context.Event()
+        process = self.context.Process(
+            target=_run_worker,
+            args=(worker_id, ready),
+            name=f'admin-worker-{worker_id}'
+        )
+        process.start()
+        return process, ready
+
+    def _stop(self, process):
+        process.terminate()
+        process.join(WORKER_SHUTDOWN_TIMEOUT)
+        if process.is_alive():
+            logger.warning(f"Worker {process.name} did not stop in time, killing")
+            process.kill()
+            process.join()
+
+    def rolling_restart(self):
+        for worker_id, process in enumerate(self.processes):
+            new_process, ready = self._spawn(worker_id)
+            if not ready.wait(WORKER_READY_TIMEOUT):
+                # Новый воркер не поднялся - оставляем старый в работе
+                logger.error(f"Worker {worker_id} failed to start during rolling restart")
+                self._stop(new_process)
+                continue
+
+            self._stop(process)
+            self.processes[worker_id] = new_process
+            self.started[worker_id] = time.monotonic()
+            logger.info(f"Worker {worker_id} restarted (pid {new_process.pid})")
+
+    def _respawn(self, worker_id):
+        """Перезапускает упавший воркер; False, если он падает сразу слишком много раз подряд"""
+        process = self.processes[worker_id]
+        now = time.monotonic()
+        if self.respawn_at[worker_id] is None:
+            if now - self.started[worker_id] < WORKER_FAST_EXIT:
+                self.fast_exits[worker_id] += 1
+            else:
+                self.fast_exits[worker_id] = 0
+            if self.fast_exits[worker_id] >= WORKER_MAX_FAST_EXITS:
+                logger.error(f"Worker {worker_id} exited {self.fast_exits[worker_id]} times right after start, giving up")
+                return False
+            delay = min(2 ** self.fast_exits[worker_id] - 1, WORKER_MAX_BACKOFF)
+            self.respawn_at[worker_id] = now + delay
+            logger.warning(f"Worker {worker_id} exited with code {process.exitcode}, restarting in {delay}s")
+        if now >= self.respawn_at[worker_id]:
+            self.respawn_at[worker_id] = None
+            self.processes[worker_id] = self._spawn(worker_id)[0]
+            self.started[worker_id] = time.monotonic()
+        return True
+
+    def _handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def _handle_restart(self, signum, frame):
+        self.restart_requested = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_restart)
+
+        self.processes = [self._spawn(worker_id)[0] for worker_id in range(self.workers)]
+        self.started = [time.monotonic()] * self.workers
+        self.fast_exits = [0] * self.workers
+        self.respawn_at = [None] * self.workers
+        logger.info(f"Supervisor started {self.workers} workers")
+
+        while not self.stopping:
+            if self.restart_requested:
+                self.restart_requested = False
+                self.rolling_restart()
+
+            for worker_id, process in enumerate(self.processes):
+                if not process.is_alive() and not self.stopping:
+                    if not self._respawn(worker_id):
+                        self.failed = self.stopping = True
+
+            time.sleep(1)
+
+        for process in self.processes:
+            self._stop(process)
+        logger.info("Supervisor stopped")
+
+def supervise(workers):
+    supervisor = Supervisor(workers)
+    supervisor.run()
+    if supervisor.failed:
+        raise SystemExit(1)